@@ -0,0 +1,146 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A binary building many apps in one invocation.
+
+The manifest is a JSON file:
+
+  {
+    "args": ["--base", "gcr.io/...", "--cache-repository", "gcr.io/..."],
+    "apps": [
+      {"runtime": "node", "directory": "/apps/web", "name": "gcr.io/.../web",
+       "args": ["--entrypoint", "npm start"]},
+      ...
+    ]
+  }
+
+Each app is built as ftl/<runtime>/main.py would build it, with the
+top-level args followed by --directory, --name and the args of the app.
+The builds share one resources.Resources, so the base image, credentials
+and connections are set up once for the whole batch.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from containerregistry.tools import patched
+
+from ftl.common import builder
+from ftl.common import constants
+from ftl.common import ftl_util
+from ftl.common import logger
+from ftl.common import resources
+from ftl.daemon import daemon
+
+parser = argparse.ArgumentParser(
+    description='Build the apps listed in a manifest.')
+parser.add_argument(
+    '--manifest',
+    dest='manifest',
+    action='store',
+    required=True,
+    help='The JSON file listing the apps to build')
+parser.add_argument(
+    '--jobs',
+    dest='jobs',
+    action='store',
+    type=int,
+    default=constants.BATCH_JOBS,
+    help='The number of apps built at the same time')
+parser.add_argument(
+    '--threads',
+    dest='threads',
+    action='store',
+    type=int,
+    default=constants.THREADS,
+    help='The number of connections to registries shared by all builds')
+parser.add_argument(
+    '--builder-output-path',
+    dest='builder_output_path',
+    action='store',
+    default=None,
+    help='The directory the timings of the batch are written to')
+parser.add_argument(
+    '--verbosity',
+    default=constants.DEFAULT_LOG_LEVEL,
+    nargs='?',
+    action='store',
+    choices=logger.LEVEL_MAP.keys())
+
+
+def _app_args(manifest, app):
+    return (manifest.get('args', []) +
+            ['--directory', app['directory'], '--name', app['name']] +
+            app.get('args', []))
+
+
+def run(manifest, shared, jobs=constants.BATCH_JOBS, runtimes=None):
+    """Build the apps of manifest, jobs at a time.
+
+    Returns:
+      the report of the batch: the result and build time of each app, in
+      manifest order, and the time the whole batch took.
+    """
+    start = time.time()
+    scheduler = builder.Scheduler(threads=jobs)
+    for i, app in enumerate(manifest['apps']):
+
+        def build(app=app):
+            app_start = time.time()
+            reply = daemon.run_build(shared, app['runtime'],
+                                     _app_args(manifest, app), runtimes)
+            reply.update({
+                'name': app['name'],
+                'directory': app['directory'],
+                'runtime': app['runtime'],
+                'seconds': time.time() - app_start,
+            })
+            return reply
+
+        scheduler.Add(i, build)
+    results = scheduler.Run()
+    apps = [results[i] for i in range(len(manifest['apps']))]
+    return {
+        'apps': apps,
+        'failed': len([app for app in apps if app['exitCode'] != 0]),
+        'buildSeconds': sum(app['seconds'] for app in apps),
+        'totalSeconds': time.time() - start,
+    }
+
+
+def main(cli_args):
+    batch_args = parser.parse_args(cli_args)
+    logger.setup_logging(batch_args)
+    with open(batch_args.manifest, 'r') as f:
+        manifest = json.load(f)
+    shared = resources.Resources(
+        threads=batch_args.threads, keep_images=True)
+    with ftl_util.Timing('batch of %d apps' % len(manifest['apps'])):
+        report = run(manifest, shared, jobs=batch_args.jobs)
+    for app in report['apps']:
+        logging.info('%s: exit code %d after %d seconds', app['name'],
+                     app['exitCode'], app['seconds'])
+    logging.info('%d of %d apps failed; builds took %d seconds in total',
+                 report['failed'], len(report['apps']),
+                 report['buildSeconds'])
+    ftl_util.update_builder_output(batch_args.builder_output_path,
+                                   {'batch': report})
+    sys.exit(1 if report['failed'] else 0)
+
+
+if __name__ == '__main__':
+    with patched.Httplib2():
+        main(sys.argv[1:])
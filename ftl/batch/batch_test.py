@@ -0,0 +1,91 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for batch.py"""
+
+import argparse
+import threading
+import unittest
+
+from ftl.batch import batch
+from ftl.common import ftl_error
+from ftl.common import resources
+
+_parser = argparse.ArgumentParser()
+_parser.add_argument('--base', required=True)
+_parser.add_argument('--directory', required=True)
+_parser.add_argument('--name', required=True)
+_parser.add_argument('--fail', action='store_true', default=False)
+_parser.add_argument('--builder-output-path', default=None)
+_parser.add_argument('--fail-on-error', default=True)
+
+
+class _FakeBuilder(object):
+    lock = threading.Lock()
+    built = []
+
+    def __init__(self, ctx, args, resources=None):
+        self._args = args
+        self._resources = resources
+
+    def Build(self):
+        if self._args.fail:
+            raise ftl_error.UserError('bad app')
+        with _FakeBuilder.lock:
+            _FakeBuilder.built.append(
+                (self._args.base, self._args.name, self._resources))
+
+    def Close(self):
+        pass
+
+
+class BatchTest(unittest.TestCase):
+    def test_run(self):
+        manifest = {
+            'args': ['--base', 'gcr.io/base'],
+            'apps': [{
+                'runtime': 'fake',
+                'directory': '/apps/one',
+                'name': 'gcr.io/one'
+            }, {
+                'runtime': 'fake',
+                'directory': '/apps/two',
+                'name': 'gcr.io/two',
+                'args': ['--fail']
+            }, {
+                'runtime': 'fake',
+                'directory': '/apps/three',
+                'name': 'gcr.io/three'
+            }]
+        }
+        shared = resources.Resources(threads=1)
+        report = batch.run(
+            manifest, shared, jobs=2, runtimes={'fake': (_parser,
+                                                         _FakeBuilder)})
+
+        self.assertEqual(
+            sorted(_FakeBuilder.built),
+            [('gcr.io/base', 'gcr.io/one', shared),
+             ('gcr.io/base', 'gcr.io/three', shared)])
+        self.assertEqual([app['name'] for app in report['apps']],
+                         ['gcr.io/one', 'gcr.io/two', 'gcr.io/three'])
+        self.assertEqual([app['exitCode'] for app in report['apps']],
+                         [0, 1, 0])
+        self.assertEqual(report['apps'][1]['error'], 'bad app')
+        self.assertEqual(report['failed'], 1)
+        self.assertGreaterEqual(report['buildSeconds'], 0)
+        self.assertGreaterEqual(report['totalSeconds'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
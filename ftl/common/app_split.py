@@ -0,0 +1,147 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package decides how an app directory is split into layers.
+
+A Policy assigns every file of the directory to a partition. Partitions
+are named by --app-layer-split glob patterns and, optionally, by a
+ChangeHistory which learns which top-level entries of the app change
+often, so frequently edited source ends up apart from rarely touched
+assets. Everything else, including every directory, goes to the
+remainder partition.
+"""
+
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from ftl.common import constants
+
+REMAINDER = 'remainder'
+HOT = 'hot'
+
+
+def _top(path):
+    return path.split('/', 1)[0]
+
+
+class ChangeHistory(object):
+    """ChangeHistory counts how often each top-level entry of an app
+    changed between builds, persisted in path."""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._apps = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    self._apps = json.load(f)
+            except (IOError, ValueError) as e:
+                logging.warning('Ignoring unreadable history %s: %s', path,
+                                e)
+
+    def Hot(self, app):
+        """The top-level entries of app which change in most builds."""
+        history = self._apps.get(app)
+        if not history or history['builds'] < constants.APP_SPLIT_MIN_BUILDS:
+            return set()
+        return set(
+            top for top, changes in history['changes'].iteritems()
+            if changes >= history['builds'] * constants.APP_SPLIT_HOT_RATIO)
+
+    def Record(self, app, entries):
+        """Record the tree_hash entries of a build of app."""
+        tops = {}
+        for path in sorted(entries):
+            tops.setdefault(_top(path), hashlib.sha256()).update(
+                '%s %s\n' % (path, entries[path]))
+        signatures = dict((top, sha256.hexdigest()[:16])
+                          for top, sha256 in tops.iteritems())
+        with self._lock:
+            history = self._apps.setdefault(app, {
+                'builds': 0,
+                'signatures': {},
+                'changes': {}
+            })
+            if history['signatures']:
+                history['builds'] += 1
+                for top, signature in signatures.iteritems():
+                    if history['signatures'].get(top) != signature:
+                        history['changes'][top] = (
+                            history['changes'].get(top, 0) + 1)
+            history['signatures'] = signatures
+            self._save()
+
+    def _save(self):
+        if not self._path:
+            return
+        try:
+            directory = os.path.dirname(self._path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._apps, f)
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            logging.warning('Could not save history to %s: %s', self._path,
+                            e)
+
+
+class Policy(object):
+    """Policy partitions the entries of an app directory.
+
+    Args:
+      patterns: a list of partitions, each a comma separated list of
+        fnmatch patterns matched against paths relative to the directory,
+        e.g. 'static/*,assets/*'.
+      hot: top-level entries collected into their own partition.
+    """
+
+    def __init__(self, patterns=None, hot=None):
+        self._patterns = [[p for p in pattern.split(',') if p]
+                          for pattern in patterns or []]
+        self._hot = hot or set()
+
+    def Partition(self, entries, is_dir):
+        """Split tree_hash entries into partitions.
+
+        Args:
+          entries: the paths of the directory.
+          is_dir: whether a path is a directory.
+        Returns:
+          a list of (name, paths) pairs, remainder first, without empty
+          partitions other than the remainder.
+        """
+        partitions = [(REMAINDER, [])]
+        partitions += [(','.join(p), []) for p in self._patterns]
+        partitions.append((HOT, []))
+        for path in sorted(entries):
+            partitions[self._index(path, is_dir(path))][1].append(path)
+        return [(name, paths) for i, (name, paths) in enumerate(partitions)
+                if paths or i == 0]
+
+    def _index(self, path, is_dir):
+        if is_dir:
+            return 0
+        for i, patterns in enumerate(self._patterns):
+            for pattern in patterns:
+                if fnmatch.fnmatch(path, pattern):
+                    return i + 1
+        if _top(path) in self._hot:
+            return len(self._patterns) + 1
+        return 0
@@ -0,0 +1,65 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for app_split.py"""
+
+import unittest
+
+import app_split
+import constants
+
+_DIRS = set(['static', 'src'])
+_ENTRIES = {
+    'static': '1',
+    'static/logo.png': '2',
+    'src': '3',
+    'src/main.py': '4',
+    'app.yaml': '5',
+}
+
+
+class PolicyTest(unittest.TestCase):
+    def test_patterns(self):
+        policy = app_split.Policy(['static/*'])
+        partitions = policy.Partition(_ENTRIES, lambda p: p in _DIRS)
+        self.assertEqual(partitions, [
+            (app_split.REMAINDER, ['app.yaml', 'src', 'src/main.py',
+                                   'static']),
+            ('static/*', ['static/logo.png']),
+        ])
+
+    def test_hot(self):
+        policy = app_split.Policy(hot=set(['src']))
+        partitions = policy.Partition(_ENTRIES, lambda p: p in _DIRS)
+        self.assertEqual(partitions[1], (app_split.HOT, ['src/main.py']))
+
+    def test_empty_directory(self):
+        partitions = app_split.Policy(['static/*']).Partition(
+            {}, lambda p: False)
+        self.assertEqual(partitions, [(app_split.REMAINDER, [])])
+
+
+class ChangeHistoryTest(unittest.TestCase):
+    def test_learns_hot_entries(self):
+        history = app_split.ChangeHistory()
+        entries = dict(_ENTRIES)
+        history.Record('app', entries)
+        for i in range(constants.APP_SPLIT_MIN_BUILDS):
+            entries['src/main.py'] = str(i)
+            self.assertEqual(history.Hot('app'), set())
+            history.Record('app', entries)
+        self.assertEqual(history.Hot('app'), set(['src']))
+
+
+if __name__ == '__main__':
+    unittest.main()
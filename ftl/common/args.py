@@ -16,6 +16,7 @@
 import argparse
 import os
 
+from ftl.common import compression
 from ftl.common import constants
 from ftl.common import logger
 
@@ -87,6 +88,27 @@ def base_parser():
         default=False,
         action='store_true',
         help='Use global cache')
+    parser.add_argument(
+        '--cache-tag-index',
+        dest='cache_tag_index',
+        default=False,
+        action='store_true',
+        help='List the tags of the cache repository once, instead of \
+        checking for every cache key in turn')
+    parser.add_argument(
+        '--local-cache-dir',
+        dest='local_cache_dir',
+        action='store',
+        default=None,
+        help='Keep cached layers in this directory of the build host, in \
+        front of the cache repository')
+    parser.add_argument(
+        '--local-cache-max-size',
+        dest='local_cache_max_size',
+        action='store',
+        type=int,
+        default=constants.LOCAL_CACHE_MAX_SIZE,
+        help='The size in bytes the local cache directory is kept under')
     parser.add_argument(
         '--export-cache-stats',
         dest='export_cache_stats',
@@ -104,6 +126,29 @@ def base_parser():
         default=True,
         action='store_true',
         help='Upload to cache during build (default).')
+    parser.add_argument(
+        '--cache-writes',
+        dest='cache_writes',
+        action='store',
+        choices=constants.CACHE_WRITES_MODES,
+        default=constants.CACHE_WRITES_SYNC,
+        help='When layers are written to the cache: sync, as they are \
+        built; background, alongside the rest of the build and finished \
+        before the final push; or after-push, finished after it')
+    parser.add_argument(
+        '--stream-upload',
+        dest='stream_upload',
+        action='store_true',
+        default=False,
+        help='Start pushing each layer to the target repository as soon \
+        as it is built, instead of pushing the whole image at the end')
+    parser.add_argument(
+        '--persistent-blob-ledger',
+        dest='persistent_blob_ledger',
+        action='store_true',
+        default=False,
+        help='Remember the blobs pushed to each repository in the state \
+        directory, so later builds skip checking for them again')
     parser.add_argument(
         '--output-path',
         dest='output_path',
@@ -161,6 +206,96 @@ def base_parser():
         action='store',
         default=constants.DEFAULT_TTL_HOURS,
         help='The TTL (in hours) set on the cached images that FTL creates')
+    parser.add_argument(
+        '--compression',
+        dest='compression',
+        action='store',
+        choices=compression.CODECS,
+        default=compression.GZIP,
+        help='The codec layers are compressed with. zstd layers are pushed \
+        with the OCI +zstd layer media type in an OCI manifest')
+    parser.add_argument(
+        '--compression-level',
+        dest='compression_level',
+        action='store',
+        type=int,
+        default=None,
+        help='The compression level, by default 1 for gzip and 3 for zstd')
+    parser.add_argument(
+        '--compression-threads',
+        dest='compression_threads',
+        action='store',
+        type=int,
+        default=1,
+        help='The number of threads used to gzip each layer. Layers are \
+        compressed in fixed size blocks, so the layer digest is the same for \
+        any number of threads')
+    parser.add_argument(
+        '--reproducible',
+        dest='reproducible',
+        action='store_true',
+        default=False,
+        help='Write byte-identical layers and configs for identical inputs \
+        by normalizing file times, owners and modes')
+    parser.add_argument(
+        '--dedup-files',
+        dest='dedup_files',
+        action='store_true',
+        default=False,
+        help='Store hardlinked and identical files once per layer, as tar \
+        hardlinks to the first copy')
+    parser.add_argument(
+        '--app-delta',
+        dest='app_delta',
+        action='store_true',
+        default=False,
+        help='Build the app as a delta layer on top of the app layers of \
+        the previous build')
+    parser.add_argument(
+        '--app-delta-max-depth',
+        dest='app_delta_max_depth',
+        action='store',
+        type=int,
+        default=constants.APP_DELTA_MAX_DEPTH,
+        help='The number of app layers after which they are compacted \
+        back into a single layer')
+    parser.add_argument(
+        '--app-delta-max-size',
+        dest='app_delta_max_size',
+        action='store',
+        type=int,
+        default=constants.APP_DELTA_MAX_SIZE,
+        help='The total size in bytes of app delta layers after which they \
+        are compacted back into a single layer')
+    parser.add_argument(
+        '--app-layer-split',
+        dest='app_layer_split',
+        action='append',
+        default=None,
+        help='Put the app files matching these comma separated globs, \
+        relative to the app directory, into a layer of their own. May be \
+        repeated for several layers')
+    parser.add_argument(
+        '--app-layer-split-learned',
+        dest='app_layer_split_learned',
+        action='store_true',
+        default=False,
+        help='Put the top-level app entries which change in most builds \
+        into a layer of their own. Requires --state-dir')
+    parser.add_argument(
+        '--adaptive-compression',
+        dest='adaptive_compression',
+        action='store_true',
+        default=False,
+        help='Choose the compression level of each layer, or skip \
+        compression, from the push bandwidth measured by earlier builds')
+    parser.add_argument(
+        '--state-dir',
+        dest='state_dir',
+        action='store',
+        default=os.environ.get(constants.FTL_STATE_DIR),
+        help='The directory FTL keeps measurements and file indexes \
+        between builds in. Nothing is kept between builds when unset')
 
     return parser
 
@@ -168,7 +303,7 @@ def base_parser():
 node_flgs = []
 php_flgs = []
 python_flgs = ['python_cmd', 'pip_cmd', 'virtualenv_cmd', 'virtualenv_dir',
-               'venv_cmd']
+               'venv_cmd', 'max_package_layers']
 
 
 def extra_args(parser, opt_list):
@@ -213,6 +348,16 @@ def extra_args(parser, opt_list):
                 "help": 'The virtualenv command to be run (ex: virtualenv)'
             }
         ],
+        'max_package_layers': [
+            '--max-package-layers', {
+                "dest": 'max_package_layers',
+                "action": 'store',
+                "type": int,
+                "default": None,
+                "help": 'Coalesce package layers into at most this many \
+                layers, grouping packages by a hash of their name'
+            }
+        ],
     }
     for opt in opt_list:
         arg_vars = opt_dict[opt]
@@ -0,0 +1,130 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package defines a disk-backed store for layer blobs."""
+
+import atexit
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from ftl.common import compression
+
+
+class Entry(object):
+    """Entry is the metadata of a layer blob held in a Store.
+
+    The digest, diff_id and sizes are computed once when the blob is
+    written so the blob never has to be re-read to describe it.
+    """
+
+    def __init__(self,
+                 path,
+                 digest,
+                 diff_id,
+                 size,
+                 uncompressed_size,
+                 codec=None):
+        self.path = path
+        self.digest = digest
+        self.diff_id = diff_id
+        self.size = size
+        self.uncompressed_size = uncompressed_size
+        self.codec = codec or compression.Gzip()
+
+    def Open(self):
+        """A file object reading the raw compressed blob from disk."""
+        return open(self.path, 'rb')
+
+    @contextlib.contextmanager
+    def OpenUncompressed(self):
+        """A file object decompressing the blob as it is read from disk,
+        as a context manager."""
+        with self.Open() as f:
+            yield self.codec.DecompressStream(f)
+
+    def Blob(self):
+        """The raw compressed blob, read from disk into memory.
+
+        Prefer Open for large layers."""
+        with self.Open() as f:
+            return f.read()
+
+    def UncompressedBlob(self):
+        """The uncompressed blob, decompressed from disk into memory.
+
+        Prefer OpenUncompressed for large layers."""
+        with self.OpenUncompressed() as f:
+            return f.read()
+
+
+class Store(object):
+    """Store keeps layer blobs as files in a directory, named by digest."""
+
+    def __init__(self, directory=None):
+        self._directory = directory or tempfile.mkdtemp(prefix='ftl-blobs-')
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+
+    def TempPath(self, suffix='.tmp'):
+        """A fresh path inside the store for a blob being written."""
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self._directory)
+        os.close(fd)
+        return path
+
+    def Commit(self,
+               path,
+               digest,
+               diff_id,
+               size,
+               uncompressed_size,
+               codec=None):
+        """Move a fully written blob into place and return its Entry."""
+        final_path = os.path.join(self._directory,
+                                  digest.replace(':', '-') + '.blob')
+        os.rename(path, final_path)
+        return Entry(final_path, digest, diff_id, size, uncompressed_size,
+                     codec)
+
+    def AddBlob(self, blob, u_blob):
+        """Write an in-memory gzipped blob pair to disk and return its
+        Entry."""
+        path = self.TempPath()
+        with open(path, 'wb') as f:
+            f.write(blob)
+        return self.Commit(path, _sha256(blob), _sha256(u_blob), len(blob),
+                           len(u_blob))
+
+    def Close(self):
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+def _sha256(content):
+    return 'sha256:' + hashlib.sha256(content).hexdigest()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def Default():
+    """The process wide Store, removed when the process exits."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = Store()
+            atexit.register(_default_store.Close)
+        return _default_store
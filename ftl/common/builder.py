@@ -16,18 +16,27 @@ import abc
 import datetime
 import tarfile
 import logging
-import httplib2
+import os
+
+import concurrent.futures
 
-from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
 from containerregistry.client.v2_2 import docker_image
-from containerregistry.client.v2_2 import docker_session
 from containerregistry.client.v2_2 import save
-from containerregistry.transport import transport_pool
 
+from ftl.common import app_split
+from ftl.common import blob_store
 from ftl.common import cache
 from ftl.common import constants
+from ftl.common import ftl_error
 from ftl.common import ftl_util
+from ftl.common import layer_builder
+from ftl.common import layer_writer
+from ftl.common import ledger
+from ftl.common import resources as resources_lib
+from ftl.common import session
+from ftl.common import tree_hash
+from ftl.common import tuning
 
 # Do not Remove. Fix for strptime not being thread safe.
 # Initialize datetime in the base class RuntimeBase. The Build calls
@@ -36,6 +45,67 @@ from ftl.common import ftl_util
 datetime.datetime.strptime('', '')
 
 
+class Scheduler(object):
+    """Scheduler runs the steps of a build concurrently.
+
+    Each step names the steps whose results it needs, and starts as soon
+    as those have finished, so independent layers are built side by side.
+    Steps can only depend on steps added before them, which keeps the
+    graph acyclic.
+
+    Args:
+      threads: the number of steps run at once.
+    """
+
+    def __init__(self, threads=constants.THREADS):
+        self._threads = threads
+        self._steps = []
+        self._deps = {}
+        self._fns = {}
+
+    def Add(self, name, fn, deps=None):
+        """Add the step name, which calls fn once deps have finished."""
+        if name in self._fns:
+            raise ValueError('Duplicate build step %s' % name)
+        for dep in deps or []:
+            if dep not in self._fns:
+                raise ValueError('Build step %s depends on unknown step %s' %
+                                 (name, dep))
+        self._steps.append(name)
+        self._deps[name] = set(deps or [])
+        self._fns[name] = fn
+
+    def Run(self):
+        """Run every step and return their results by name.
+
+        When a step fails no further steps are started; the running ones
+        are waited for and the error of the failed step is raised.
+        """
+        results = {}
+        running = {}
+        pending = list(self._steps)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._threads) as executor:
+            while pending or running:
+                for name in list(pending):
+                    if self._deps[name].issubset(results):
+                        pending.remove(name)
+                        running[executor.submit(self._run, name)] = name
+                done, _ = concurrent.futures.wait(
+                    running.keys(),
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        concurrent.futures.wait(running.keys())
+                    results[name] = future.result()
+        return results
+
+    def _run(self, name):
+        with ftl_util.Timing('build step %s' % name):
+            return self._fns[name]()
+
+
 class Base(object):
     """Base is an abstract base class representing a container builder.
     It provides methods for generating runtime layers and an application
@@ -71,12 +141,24 @@ class RuntimeBase(JustApp):
     """RuntimeBase is an abstract base class representing a container builder
     for runtime applications with dependencies.
 
-    It provides methods for generating appending layers and caching images
+    It provides methods for generating appending layers and caching images.
+    Builds sharing a process share its resources, a resources.Resources.
+    Such builds write their layers to a blob store of their own, which
+    Close removes once the build is done.
     """
 
-    def __init__(self, ctx, cache_namespace, args, descriptor_files):
+    def __init__(self,
+                 ctx,
+                 cache_namespace,
+                 args,
+                 descriptor_files,
+                 resources=None):
         super(RuntimeBase, self).__init__(ctx)
         self._cache_namespace = cache_namespace
+        self._resources = resources or resources_lib.Resources()
+        # A single build writes to the process wide store, which is
+        # removed when it exits.
+        self._blob_store = blob_store.Store() if resources else None
         if args.entrypoint:
             args.entrypoint = args.entrypoint.split(" ")
             if args.sh_c_prefix:
@@ -87,20 +169,17 @@ class RuntimeBase(JustApp):
                                             args.cache_salt)
         self._args = args
         self._base_name = docker_name.Tag(self._args.base, strict=False)
-        self._base_creds = docker_creds.DefaultKeychain.Resolve(
-            self._base_name)
+        self._base_creds = self._resources.Credentials(self._base_name)
         self._target_image = docker_name.Tag(self._args.name, strict=False)
-        self._target_creds = docker_creds.DefaultKeychain.Resolve(
-            self._target_image)
-        self._transport = transport_pool.Http(
-            httplib2.Http, size=constants.THREADS)
+        self._target_creds = self._resources.Credentials(self._target_image)
+        self._transport = self._resources.transport
         if args.tar_base_image_path:
             self._base_image = docker_image.FromTarball(
                 args.tar_base_image_path)
+            self._base_image.__enter__()
         else:
-            self._base_image = docker_image.FromRegistry(
-                self._base_name, self._base_creds, self._transport)
-        self._base_image.__enter__()
+            self._base_image = self._resources.BaseImage(
+                self._base_name, self._base_creds)
         cache_repo = args.cache_repository
         if not cache_repo:
             cache_repo = self._target_image.as_repository()
@@ -108,6 +187,37 @@ class RuntimeBase(JustApp):
             ttl = args.ttl
         else:
             ttl = ftl_util.get_ttl(descriptor_files, ctx)
+        stats_path = None
+        index_path = None
+        if args.state_dir:
+            stats_path = os.path.join(args.state_dir,
+                                      constants.TUNING_STATS_FILE)
+            index_path = os.path.join(args.state_dir,
+                                      constants.TREE_INDEX_FILE)
+        self._tuning_stats = self._resources.Shared(
+            ('stats', stats_path), lambda: tuning.Stats(stats_path))
+        self._tree_index = self._resources.Shared(
+            ('index', index_path), lambda: tree_hash.Index(index_path))
+        ledger_path = None
+        if args.persistent_blob_ledger and args.state_dir:
+            ledger_path = os.path.join(args.state_dir,
+                                       constants.BLOB_LEDGER_FILE)
+        self._ledger = self._resources.Shared(
+            ('ledger', ledger_path),
+            lambda: ledger.Ledger(
+                ledger_path, ttl_hours=constants.BLOB_LEDGER_TTL_HOURS))
+        self._app_history = None
+        if args.app_layer_split_learned:
+            if not args.state_dir:
+                raise ftl_error.UserError(
+                    '--app-layer-split-learned requires --state-dir, to '
+                    'keep the changes of earlier builds in')
+            self._app_history = app_split.ChangeHistory(
+                os.path.join(args.state_dir, constants.APP_CHANGES_FILE))
+        tag_indexes = None
+        if args.cache_tag_index:
+            tag_indexes = self._resources.Shared(
+                ('tag_indexes', ), lambda: cache.TagIndexes(self._transport))
         self._cache = cache.Registry(
             repo=cache_repo,
             namespace=self._cache_namespace,
@@ -120,13 +230,145 @@ class RuntimeBase(JustApp):
             export_stats=args.export_cache_stats,
             export_location=args.builder_output_path,
             should_cache=args.cache,
-            should_upload=args.upload)
+            should_upload=args.upload,
+            stats=self._tuning_stats,
+            background_writes=(
+                args.cache_writes != constants.CACHE_WRITES_SYNC),
+            ledger=self._ledger,
+            tag_indexes=tag_indexes)
+        if args.local_cache_dir and args.cache:
+            self._cache = cache.Local(
+                directory=args.local_cache_dir,
+                namespace=self._cache_namespace,
+                max_size=args.local_cache_max_size,
+                ttl=ttl,
+                backing=self._cache)
+        tuner = None
+        if args.adaptive_compression:
+            tuner = tuning.Tuner(
+                self._tuning_stats,
+                args.compression,
+                threads=args.compression_threads,
+                export_location=args.builder_output_path)
+        self._layer_options = layer_writer.Options.FromArgs(
+            args, tuner=tuner, store=self._blob_store)
+        self._streaming_push = None
+        if args.stream_upload and args.upload and not args.output_path:
+            self._streaming_push = session.StreamingPush(
+                self._target_image,
+                self._target_creds,
+                self._transport,
+                threads=constants.THREADS,
+                mount=self._mounts(),
+                stats=self._tuning_stats,
+                ledger=self._ledger)
         self._descriptor_files = descriptor_files
 
     def Build(self):
         return
 
+    def Close(self):
+        """Stop the upload of streamed layers and release the blobs of the
+        build, once the cache writes reading them are done. Close is called
+        whether or not the build succeeded."""
+        try:
+            self._cache.Drain()
+        finally:
+            try:
+                if self._streaming_push:
+                    self._streaming_push.Close()
+            finally:
+                if self._blob_store:
+                    self._blob_store.Close()
+
+    def _app_layer_builder(self, directory, destination_path):
+        """The builder of the layer(s) holding an application directory."""
+        split = self._args.app_layer_split or self._app_history
+        if split and self._args.app_delta:
+            raise ftl_error.UserError(
+                '--app-delta cannot be combined with --app-layer-split')
+        if split:
+            return layer_builder.SplitAppLayerBuilder(
+                directory=directory,
+                destination_path=destination_path,
+                entrypoint=self._args.entrypoint,
+                exposed_ports=self._args.exposed_ports,
+                layer_options=self._layer_options,
+                cache_key_version=self._args.cache_key_version,
+                cache=self._cache,
+                tree_index=self._tree_index,
+                patterns=self._args.app_layer_split,
+                history=self._app_history,
+                app_name='%s %s' % (self._target_image.as_repository(),
+                                    destination_path))
+        if self._args.app_delta:
+            return layer_builder.DeltaAppLayerBuilder(
+                directory=directory,
+                destination_path=destination_path,
+                entrypoint=self._args.entrypoint,
+                exposed_ports=self._args.exposed_ports,
+                layer_options=self._layer_options,
+                cache_key_version=self._args.cache_key_version,
+                cache=self._cache,
+                tree_index=self._tree_index,
+                chain_name=self._target_image.as_repository(),
+                max_depth=self._args.app_delta_max_depth,
+                max_size=self._args.app_delta_max_size)
+        return layer_builder.AppLayerBuilder(
+            directory=directory,
+            destination_path=destination_path,
+            entrypoint=self._args.entrypoint,
+            exposed_ports=self._args.exposed_ports,
+            layer_options=self._layer_options,
+            cache_key_version=self._args.cache_key_version,
+            cache=self._cache,
+            tree_index=self._tree_index)
+
+    def _prefetch_base_image(self):
+        """Fetch the manifest and config of the base image, which the
+        final image is assembled on, while layers are being built."""
+        self._base_image.manifest()
+        self._base_image.config_file()
+        self._stream([self._base_image])
+
+    def _layer_step(self, lyr_builder):
+        """The Scheduler step building the layer(s) of lyr_builder."""
+
+        def step():
+            lyr_builder.BuildLayer()
+            if lyr_builder.GetImage():
+                self._stream([lyr_builder.GetImage()])
+
+        return step
+
+    def _stream(self, imgs):
+        """With --stream-upload, start pushing the layers of imgs to the
+        target repository. Returns imgs."""
+        if self._streaming_push:
+            for img in imgs:
+                self._streaming_push.AddImage(img)
+        return imgs
+
     def StoreImage(self, result_image):
+        if self._args.cache_writes == constants.CACHE_WRITES_BACKGROUND:
+            self._drain_cache_writes()
+        try:
+            self._store_image(result_image)
+        finally:
+            if self._args.cache_writes == constants.CACHE_WRITES_AFTER_PUSH:
+                self._drain_cache_writes()
+            self._ledger.Save()
+
+    def _mounts(self):
+        """The repositories blobs can be mounted from into the target."""
+        return [self._base_name] + self._cache.Mounts(
+            self._target_image.registry)
+
+    def _drain_cache_writes(self):
+        with ftl_util.Timing('Finishing cache writes'):
+            self._cache.Drain()
+
+    def _store_image(self, result_image):
         with ftl_util.Timing('Uploading final image'):
             if self._args.output_path:
                 with ftl_util.Timing('Saving tarball image'):
@@ -137,13 +379,20 @@ class RuntimeBase(JustApp):
                         str(self._target_image), self._args.output_path))
                 return
             if self._args.upload:
+                if self._streaming_push:
+                    with ftl_util.Timing('Finishing streamed image push'):
+                        logging.info('Pushing final image...')
+                        self._streaming_push.Finish(result_image)
+                    return
                 with ftl_util.Timing('Pushing image to Docker registry'):
-                    with docker_session.Push(
+                    with session.Push(
                             self._target_image,
                             self._target_creds,
                             self._transport,
                             threads=constants.THREADS,
-                            mount=[self._base_name]) as session:
+                            mount=self._mounts(),
+                            stats=self._tuning_stats,
+                            ledger=self._ledger) as push:
                         logging.info('Pushing final image...')
-                        session.upload(result_image)
+                        push.upload(result_image)
                     return
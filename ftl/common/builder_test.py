@@ -13,12 +13,19 @@
 # limitations under the License.
 
 import cStringIO
+import json
+import mock
 import os
 import unittest
 import tarfile
 import tempfile
+import threading
 
+import builder
+import cache
+import constants
 import layer_builder
+import layer_writer
 
 
 def gen_tmp_dir(dirr):
@@ -62,5 +69,236 @@ class JustAppTest(unittest.TestCase):
                 self.assertEquals(tf.extractfile(tar_path).read(), f)
 
 
+class _FakeCache(object):
+    def __init__(self, ttl=None):
+        self.entries = {}
+        self._ttl = ttl
+
+    def Get(self, cache_key):
+        entry = self.entries.get(cache_key)
+        if entry and self._ttl and not cache.Registry.checkTTL(
+                entry, self._ttl):
+            return None
+        return entry
+
+    def Set(self, cache_key, value):
+        self.entries[cache_key] = value
+
+
+class CachedAppTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = gen_tmp_dir("cachedapptest")
+        with open(os.path.join(self.tmp_dir, 'foo'), 'w') as f:
+            f.write('foo_contents')
+        self.cache = _FakeCache()
+
+    def test_unchanged_app_hits_cache(self):
+        first = layer_builder.AppLayerBuilder(self.tmp_dir, cache=self.cache)
+        first.BuildLayer()
+        self.assertEqual(len(self.cache.entries), 1)
+
+        second = layer_builder.AppLayerBuilder(self.tmp_dir, cache=self.cache)
+        second._build_layer = None  # must not be called on a hit
+        second.BuildLayer()
+        self.assertIs(second.GetImage(), first.GetImage())
+
+    def test_reproducible_app_hits_cache(self):
+        # Reproducible configs are created in 1970, so the TTL must be
+        # checked against the label holding the real creation time.
+        self.cache = _FakeCache(ttl=constants.DEFAULT_TTL_HOURS)
+        options = layer_writer.Options(reproducible=True)
+        first = layer_builder.AppLayerBuilder(
+            self.tmp_dir, cache=self.cache, layer_options=options)
+        first.BuildLayer()
+        cfg = json.loads(first.GetImage().config_file())
+        self.assertEqual(cfg['created'], constants.REPRODUCIBLE_CREATED)
+        self.assertIn(constants.CREATED_LABEL, cfg['config']['Labels'])
+
+        second = layer_builder.AppLayerBuilder(
+            self.tmp_dir, cache=self.cache, layer_options=options)
+        second._build_layer = None  # must not be called on a hit
+        second.BuildLayer()
+        self.assertIs(second.GetImage(), first.GetImage())
+
+    def test_changed_app_misses_cache(self):
+        first = layer_builder.AppLayerBuilder(self.tmp_dir, cache=self.cache)
+        first.BuildLayer()
+        with open(os.path.join(self.tmp_dir, 'foo'), 'w') as f:
+            f.write('new_contents')
+        second = layer_builder.AppLayerBuilder(self.tmp_dir, cache=self.cache)
+        second.BuildLayer()
+        self.assertEqual(len(self.cache.entries), 2)
+        self.assertNotEqual(first.GetImage().fs_layers(),
+                            second.GetImage().fs_layers())
+
+
+class DeltaAppTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = gen_tmp_dir("deltaapptest")
+        for name in ['keep', 'change', 'remove']:
+            with open(os.path.join(self.tmp_dir, name), 'w') as f:
+                f.write(name)
+        self.cache = _FakeCache()
+
+    def _build(self, **kwargs):
+        app = layer_builder.DeltaAppLayerBuilder(
+            self.tmp_dir, cache=self.cache, chain_name='app', **kwargs)
+        app.BuildLayer()
+        return app.GetImage()
+
+    def test_delta_layer(self):
+        self._build()
+        with open(os.path.join(self.tmp_dir, 'change'), 'w') as f:
+            f.write('changed')
+        os.remove(os.path.join(self.tmp_dir, 'remove'))
+        with mock.patch('ftl.common.blob_store.Entry.Blob',
+                        side_effect=AssertionError('read into memory')):
+            img = self._build()
+
+        layers = json.loads(img.manifest())['layers']
+        self.assertEqual(len(layers), 2)
+        delta = img.blob(layers[1]['digest'])
+        with tarfile.open(
+                fileobj=cStringIO.StringIO(delta), mode='r:gz') as tf:
+            self.assertEqual(
+                sorted(tf.getnames()), ['srv/./.wh.remove', 'srv/./change'])
+            self.assertEqual(tf.extractfile('srv/./change').read(), 'changed')
+
+    def test_reproducible_delta_layer(self):
+        self.cache = _FakeCache(ttl=constants.DEFAULT_TTL_HOURS)
+        options = layer_writer.Options(reproducible=True)
+        self._build(layer_options=options)
+        with open(os.path.join(self.tmp_dir, 'change'), 'w') as f:
+            f.write('changed')
+        img = self._build(layer_options=options)
+        # The chain head passed its TTL check, so only a delta was built.
+        self.assertEqual(len(json.loads(img.manifest())['layers']), 2)
+        self.assertTrue(cache.Registry.checkTTL(img, 1))
+
+    def test_compaction(self):
+        self._build(max_depth=2)
+        for contents in ['one', 'two']:
+            with open(os.path.join(self.tmp_dir, 'change'), 'w') as f:
+                f.write(contents)
+            img = self._build(max_depth=2)
+        # The third build finds a chain of two layers and compacts it.
+        self.assertEqual(len(json.loads(img.manifest())['layers']), 1)
+
+
+class SplitAppTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = gen_tmp_dir("splitapptest")
+        os.mkdir(os.path.join(self.tmp_dir, 'static'))
+        for name in ['main.py', 'static/logo.png']:
+            with open(os.path.join(self.tmp_dir, name), 'w') as f:
+                f.write(name)
+        self.cache = _FakeCache()
+
+    def _build(self):
+        app = layer_builder.SplitAppLayerBuilder(
+            self.tmp_dir, cache=self.cache, patterns=['static/*'])
+        app.BuildLayer()
+        return app.GetImage()
+
+    def test_split_layers(self):
+        img = self._build()
+        self.assertEqual(len(json.loads(img.manifest())['layers']), 2)
+        self.assertEqual(len(self.cache.entries), 2)
+
+        with open(os.path.join(self.tmp_dir, 'main.py'), 'w') as f:
+            f.write('changed')
+        self._build()
+        # Only the partition holding main.py was rebuilt.
+        self.assertEqual(len(self.cache.entries), 3)
+
+
+class CoalescePackagesTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = _FakeCache()
+
+    def _package(self, name, version):
+        pkg_dir = gen_tmp_dir(name)
+        with open(os.path.join(pkg_dir, name), 'w') as f:
+            f.write(version)
+        pkg = layer_builder.AppLayerBuilder(pkg_dir, destination_path='/env')
+        pkg.BuildLayer()
+        return (name, '%s==%s' % (name, version), pkg.GetImage())
+
+    def _coalesce(self, versions, max_layers):
+        packages = [self._package(name, versions[name]) for name in versions]
+        return layer_builder.coalesce_packages(
+            packages, max_layers, cache=self.cache)
+
+    def test_below_limit(self):
+        imgs = self._coalesce({'a': '1', 'b': '1'}, 2)
+        self.assertEqual(len(imgs), 2)
+        self.assertEqual(self.cache.entries, {})
+
+    def test_coalesced(self):
+        versions = {name: '1' for name in 'abcdefgh'}
+        # Package layers are decompressed as they are copied.
+        with mock.patch('ftl.common.blob_store.Entry.UncompressedBlob',
+                        side_effect=AssertionError('read into memory')):
+            imgs = self._coalesce(versions, 3)
+        self.assertLessEqual(len(imgs), 3)
+        contents = {}
+        for img in imgs:
+            with tarfile.open(
+                    fileobj=cStringIO.StringIO(img.GetFirstBlob()),
+                    mode='r:gz') as tf:
+                for member in tf.getmembers():
+                    if member.isfile():
+                        contents[member.name] = tf.extractfile(member).read()
+        self.assertEqual(contents,
+                         {'env/./' + name: '1' for name in versions})
+        self.assertEqual(len(self.cache.entries), len(imgs))
+
+        # Upgrading a package only rebuilds its own bucket.
+        versions['c'] = '2'
+        self._coalesce(versions, 3)
+        self.assertEqual(len(self.cache.entries), len(imgs) + 1)
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_dependencies_first(self):
+        order = []
+        scheduler = builder.Scheduler()
+        scheduler.Add('deps', lambda: order.append('deps') or 'deps')
+        scheduler.Add('app', lambda: order.append('app') or 'app', ['deps'])
+        results = scheduler.Run()
+        self.assertEqual(order, ['deps', 'app'])
+        self.assertEqual(results, {'deps': 'deps', 'app': 'app'})
+
+    def test_independent_steps_overlap(self):
+        # Each step waits for the other to start, so this only finishes
+        # when they run at the same time.
+        started = [threading.Event(), threading.Event()]
+
+        def step(i):
+            started[i].set()
+            return started[1 - i].wait(5)
+
+        scheduler = builder.Scheduler(threads=2)
+        scheduler.Add('one', lambda: step(0))
+        scheduler.Add('two', lambda: step(1))
+        self.assertEqual(scheduler.Run(), {'one': True, 'two': True})
+
+    def test_failure_stops_dependents(self):
+        ran = []
+
+        def fail():
+            raise ValueError('failed')
+
+        scheduler = builder.Scheduler()
+        scheduler.Add('deps', fail)
+        scheduler.Add('app', lambda: ran.append('app'), ['deps'])
+        self.assertRaises(ValueError, scheduler.Run)
+        self.assertEqual(ran, [])
+
+    def test_unknown_dependency(self):
+        scheduler = builder.Scheduler()
+        self.assertRaises(ValueError, scheduler.Add, 'app', len, ['deps'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -15,19 +15,31 @@
 
 import abc
 import datetime
+import errno
+import fcntl
+import httplib
 import json
 import logging
 import os
+import shutil
+import tempfile
+import threading
+import time
+
+import concurrent.futures
 
 from ftl.common import constants
 
 from containerregistry.client import docker_name
 from containerregistry.client import docker_creds
+from containerregistry.client.v2_2 import docker_digest
 from containerregistry.client.v2_2 import docker_image
-from containerregistry.client.v2_2 import docker_session
 from containerregistry.client.v2_2 import docker_http
 
+from ftl.common import compression
 from ftl.common import ftl_util
+from ftl.common import session
+from ftl.common import tar_to_dockerimage
 
 
 class Base(object):
@@ -62,6 +74,108 @@ class Base(object):
         """
 
 
+class TagIndex(object):
+    """TagIndex answers whether a tag exists in a repository from a single
+    listing of its tags.
+
+    The tags are listed, following the pages of the listing, the first
+    time they are asked about and again once the listing is older than
+    max_age seconds. Tags pushed by others since may be reported missing,
+    which only costs a rebuild; tags reported present are still fetched.
+
+    The listing also holds the companion tags Registry pushes next to its
+    entries (see CreationTag), so the creation time of an entry is known
+    without fetching its config.
+    """
+
+    def __init__(self, repository, creds, transport, max_age):
+        self._repository = repository
+        self._creds = creds
+        self._transport = transport
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._tags = None
+        self._created = {}
+        self._listed = 0
+
+    def Contains(self, tag):
+        """Whether tag exists, or None when the tags could not be listed."""
+        with self._lock:
+            if time.time() - self._listed > self._max_age:
+                self._tags = self._list()
+                self._created = {}
+                for listed in self._tags or []:
+                    self._addCreationTag(listed)
+                self._listed = time.time()
+            if self._tags is None:
+                return None
+            return tag in self._tags
+
+    def CreationTime(self, tag):
+        """The latest creation time recorded for tag in the listing, or
+        None."""
+        with self._lock:
+            return self._created.get(tag)
+
+    def Add(self, tag):
+        """Record a tag pushed since the listing."""
+        with self._lock:
+            if self._tags is not None:
+                self._tags.add(tag)
+                self._addCreationTag(tag)
+
+    def _addCreationTag(self, tag):
+        parsed = _parseCreationTag(tag)
+        if parsed:
+            entry, created = parsed
+            # Timestamps of one format compare in time order.
+            self._created[entry] = max(created, self._created.get(entry))
+
+    def _list(self):
+        url = '{scheme}://{registry}/v2/{repository}/tags/list?n={n}'.format(
+            scheme=docker_http.Scheme(self._repository.registry),
+            registry=self._repository.registry,
+            repository=self._repository.repository,
+            n=constants.TAG_INDEX_PAGE_SIZE)
+        tags = set()
+        try:
+            with ftl_util.Timing('listing tags of %s' % self._repository):
+                transport = docker_http.Transport(
+                    self._repository, self._creds, self._transport,
+                    docker_http.PULL)
+                for _, content in transport.PaginatedRequest(
+                        url, accepted_codes=[httplib.OK]):
+                    tags.update(json.loads(content).get('tags') or [])
+        except Exception as e:
+            # A repository nothing was pushed to yet has no tags to list,
+            # and a failed listing only means tags are looked up one by
+            # one, as without the index.
+            logging.info('Could not list the tags of %s: %s',
+                         self._repository, e)
+            return None
+        logging.info('Found %d tags in %s', len(tags), self._repository)
+        return tags
+
+
+class TagIndexes(object):
+    """TagIndexes holds the TagIndex of each repository, so builds sharing
+    a process share the listings."""
+
+    def __init__(self, transport, max_age=constants.TAG_INDEX_MAX_AGE):
+        self._transport = transport
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def Get(self, repository, creds):
+        with self._lock:
+            key = str(repository)
+            if key not in self._indexes:
+                self._indexes[key] = TagIndex(repository, creds,
+                                              self._transport, self._max_age)
+            return self._indexes[key]
+
+
 class Registry(Base):
     """Registry is a cache implementation that stores layers in a registry.
 
@@ -83,6 +197,10 @@ class Registry(Base):
             use_global=False,
             export_stats=False,
             export_location=None,
+            stats=None,
+            background_writes=False,
+            ledger=None,
+            tag_indexes=None,
     ):
         super(Registry, self).__init__()
         self._repo = repo
@@ -92,9 +210,13 @@ class Registry(Base):
             base=constants.GLOBAL_CACHE_REGISTRY, namespace=self._namespace)
         # TODO(nkubala): default this to true to point builds to global cache
         self._use_global = use_global
+        self._lookups = None
         if use_global:
             _reg = docker_name.Registry(_reg_name)
             self._global_creds = docker_creds.DefaultKeychain.Resolve(_reg)
+            # Both tiers are looked up at once for every key.
+            self._lookups = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2 * threads)
         self._export_stats = export_stats
         self._export_location = export_location
         self._transport = transport
@@ -103,6 +225,15 @@ class Registry(Base):
         self._should_cache = should_cache
         self._should_upload = should_upload
         self._ttl = ttl
+        self._stats = stats
+        self._ledger = ledger
+        self._tag_indexes = tag_indexes
+        self._writer = None
+        if background_writes:
+            self._writer = concurrent.futures.ThreadPoolExecutor(
+                max_workers=threads)
+        self._writes_lock = threading.Lock()
+        self._writes = []
 
     def _tag(self, cache_key, repo=None):
         return docker_name.Tag('{repo}/{namespace}:{tag}'.format(
@@ -110,76 +241,129 @@ class Registry(Base):
             namespace=self._namespace,
             tag=cache_key))
 
+    def Mounts(self, registry):
+        """The repositories the blobs of cache hits can be mounted from
+        into a repository of registry.
+
+        Registries only mount blobs between repositories they host, so
+        the caches on other registries are left out.
+        """
+        mounts = [
+            docker_name.Repository('{repo}/{namespace}'.format(
+                repo=str(self._repo), namespace=self._namespace))
+        ]
+        if self._use_global:
+            mounts.append(
+                docker_name.Repository('{base}/{namespace}'.format(
+                    base=constants.GLOBAL_CACHE_REGISTRY,
+                    namespace=self._namespace)))
+        return [m for m in mounts if m.registry == registry]
+
     def Get(self, cache_key):
         if not self._should_cache:
             logging.info("--no-cache flag set, cache won't be checked")
             return
         """Attempt to retrieve value from cache."""
         logging.debug('Checking cache for cache_key %s', cache_key)
+        # _getEntry only returns hits whose TTL has been checked.
         hit = self._getEntry(cache_key)
         if hit:
             logging.info('Found cached dependency layer for %s' % cache_key)
-            try:
-                if Registry.checkTTL(hit, self._ttl):
-                    return hit
-                else:
-                    logging.info(
-                        'TTL expired for cached image, \
-                        rebuilding %s' % cache_key)
-            except docker_http.V2DiagnosticException:
-                logging.info('Fetching cached dep layer for %s failed, \
-                             rebuilding' % cache_key)
-                return
-        else:
-            logging.info('No cached dependency layer for %s' % cache_key)
+            return hit
+        logging.info('No cached dependency layer for %s' % cache_key)
 
     def _getEntry(self, cache_key):
-        """Retrieve value from cache."""
-        # check global cache first
-        cache_results = []
-        (img, cache_status) = self._validateEntry(
-            self._getGlobalEntry(cache_key), cache_key)
-        cache_results.append(
-            Registry.buildCacheResult("global", cache_key, cache_status))
-        if img:
-            logging.info(
-                'Found dependency layer for %s in global cache' % cache_key)
-            self._maybeExportCacheResult(cache_results)
-            return img
-
-        # if we get a global cache miss, check the local cache
-        (img, cache_status) = self._validateEntry(
-            self._getLocalEntry(cache_key), cache_key)
-        cache_results.append(
-            Registry.buildCacheResult("project", cache_key, cache_status))
-        if img:
-            logging.info(
-                'Found dependency layer for %s in local cache' % cache_key)
-        self._maybeExportCacheResult(cache_results)
+        """Retrieve value from cache.
+
+        With the global cache in use, the global and project caches are
+        looked up at once, and a valid global hit is always taken. The
+        project lookup is only waited for when the global cache misses;
+        otherwise it is abandoned and recorded as SKIPPED.
+        """
+        tiers = [("global", self._getGlobalEntry),
+                 ("project", self._getLocalEntry)]
+        statuses = {}
+        hit = None
+        if not self._lookups:
+            statuses["global"] = "MISS"
+            img, statuses["project"] = self._lookup(self._getLocalEntry,
+                                                    cache_key)
+            if img:
+                hit = ("project", img)
+        else:
+            futures = [(level, self._lookups.submit(self._lookup, get,
+                                                    cache_key))
+                       for level, get in tiers]
+            for level, future in futures:
+                if hit:
+                    future.cancel()
+                    statuses[level] = "SKIPPED"
+                    continue
+                img, statuses[level] = future.result()
+                if img:
+                    hit = (level, img)
+
+        self._maybeExportCacheResult([
+            Registry.buildCacheResult(level, cache_key, statuses[level])
+            for level, _ in tiers
+        ])
+        if not hit:
+            return None
+        level, img = hit
+        logging.info('Found dependency layer for %s in %s cache', cache_key,
+                     level)
         return img
 
+    def _lookup(self, get_entry, cache_key):
+        """The (image or None, cache status) of cache_key in one tier."""
+        entry, created = get_entry(cache_key)
+        return self._validateEntry(entry, cache_key, created)
+
     def _getGlobalEntry(self, cache_key):
-        if self._use_global:
-            key = self._tag(cache_key, constants.GLOBAL_CACHE_REGISTRY)
-            entry = Registry.getEntryFromCreds(key, self._global_creds,
-                                               self._transport)
-            if not entry:
-                # TODO(nkubala): standardize this log message so we can
-                # crawl cloudbuild logs for cache misses
-                logging.info('Cache miss on global cache for %s', key)
-            return entry
+        """The (image or None, creation time or None) of cache_key in the
+        global cache."""
+        if not self._use_global:
+            return None, None
+        key = self._tag(cache_key, constants.GLOBAL_CACHE_REGISTRY)
+        entry, created = self._getEntryFromIndex(key, self._global_creds)
+        if entry and self._ledger:
+            self._ledger.AddImage(key.as_repository(), entry)
+        if not entry:
+            # TODO(nkubala): standardize this log message so we can
+            # crawl cloudbuild logs for cache misses
+            logging.info('Cache miss on global cache for %s', key)
+        return entry, created
 
     def _getLocalEntry(self, cache_key):
+        """The (image or None, creation time or None) of cache_key in the
+        project cache."""
         key = self._tag(cache_key)
-        entry = Registry.getEntryFromCreds(key, self._creds, self._transport)
+        entry, created = self._getEntryFromIndex(key, self._creds)
+        if entry and self._ledger:
+            self._ledger.AddImage(key.as_repository(), entry)
         if not entry:
             logging.info('Cache miss on local cache for %s', key)
-        return entry
+        return entry, created
+
+    def _getEntryFromIndex(self, key, creds):
+        """Like getEntryFromCreds, without a request for tags the tag
+        index knows are missing. The creation time of the entry is also
+        returned when the tag index knows it."""
+        created = None
+        if self._tag_indexes:
+            index = self._tag_indexes.Get(key.as_repository(), creds)
+            if index.Contains(key.tag) is False:
+                logging.info('No cached base image found for entry: %s.' %
+                             key)
+                return None, None
+            created = index.CreationTime(key.tag)
+        return Registry.getEntryFromCreds(key, creds,
+                                          self._transport), created
 
-    def _validateEntry(self, entry, cache_key):
+    def _validateEntry(self, entry, cache_key, created=None):
         if entry:
             try:
-                if Registry.checkTTL(entry, self._ttl):
+                if Registry.checkTTL(entry, self._ttl, created):
                     return entry, "HIT"
                 else:
                     logging.info('TTL expired for cached image %s' % cache_key)
@@ -194,22 +378,72 @@ class Registry(Base):
             cacheStats = {
                 "cacheStats": results
             }
-            with open(os.path.join(self._export_location,
-                                   constants.BUILDER_OUTPUT_FILE), "w") as f:
-                f.write(json.dumps(cacheStats))
+            ftl_util.update_builder_output(self._export_location, cacheStats)
 
     def Set(self, cache_key, value):
         if not self._should_upload:
             logging.info("--no-upload flag set, images won't be pushed")
             return
+        if self._writer:
+            logging.info('Queueing cache write of %s', cache_key)
+            with self._writes_lock:
+                self._writes.append((cache_key,
+                                     self._writer.submit(
+                                         self._set, cache_key, value)))
+            return
+        self._set(cache_key, value)
+
+    def Drain(self):
+        """Wait for the queued background writes.
+
+        Cache writes are best effort, so a failed write is logged rather
+        than raised. The outcome of every write is recorded under
+        cacheWrites in the builder output.
+
+        Returns:
+          whether every write completed.
+        """
+        if not self._writer:
+            return True
+        with self._writes_lock:
+            writes = list(self._writes)
+        logging.info('Waiting for %d cache writes', len(writes))
+        results = []
+        for cache_key, future in writes:
+            try:
+                future.result()
+                status = 'DONE'
+            except Exception as e:
+                logging.warning('Cache write of %s failed: %s', cache_key, e)
+                status = 'FAILED'
+            results.append({'hash': cache_key, 'status': status})
+        completed = all(r['status'] == 'DONE' for r in results)
+        ftl_util.update_builder_output(self._export_location, {
+            'cacheWrites': {
+                'completed': completed,
+                'writes': results
+            }
+        })
+        return completed
+
+    def _set(self, cache_key, value):
         entry = self._tag(cache_key)
-        with docker_session.Push(
-                entry,
-                self._creds,
-                self._transport,
-                threads=self._threads,
-                mount=self._mount) as session:
-            session.upload(value)
+        value = WithCreationTime(value)
+        # The manifest is also tagged with its creation time, so that hits
+        # found through the tag index skip the config fetch of checkTTL.
+        for tag in [entry, CreationTag(entry, _creationTime(value))]:
+            with session.Push(
+                    tag,
+                    self._creds,
+                    self._transport,
+                    threads=self._threads,
+                    mount=self._mount + self.Mounts(entry.registry),
+                    stats=self._stats,
+                    ledger=self._ledger) as push:
+                push.upload(value)
+            if self._tag_indexes:
+                self._tag_indexes.Get(entry.as_repository(),
+                                      self._creds).Add(tag.tag)
 
     @staticmethod
     def buildCacheResult(cache_level, cache_key, cache_status):
@@ -231,11 +465,360 @@ class Registry(Base):
             logging.info('No cached base image found for entry: %s.' % entry)
 
     @staticmethod
-    def checkTTL(entry, ttl):
+    def checkTTL(entry, ttl, created=None):
         """Check TTL of cache entry.
-        Return whether or not the entry is expired."""
+        Return whether or not the entry is expired.
+
+        The creation time is created, known from the tag index, or is read
+        from the manifest annotation of OCI entries, which the existence
+        check already fetched, or else from the config."""
         last_created = ftl_util.timestamp_to_time(
+            created or ftl_util.manifest_creation_time(entry) or
             ftl_util.creation_time(entry))
         now = datetime.datetime.now()
         return last_created > now - datetime.timedelta(
             hours=ttl)
+
+
+def WithCreationTime(value):
+    """value with its creation time annotated on the manifest, so the TTL
+    of a hit is checked without fetching its config.
+
+    Only OCI manifests have annotations; registries may reject or strip
+    them from docker manifests, whose creation time is only recorded in a
+    CreationTag.
+    """
+    if value.media_type() != docker_http.OCI_MANIFEST_MIME:
+        return value
+    if ftl_util.manifest_creation_time(value):
+        return value
+    return tar_to_dockerimage.WithAnnotations(
+        value, {constants.CREATED_LABEL: _creationTime(value)})
+
+
+def _creationTime(value):
+    return (ftl_util.manifest_creation_time(value) or
+            ftl_util.creation_time(value) or
+            datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+
+def CreationTag(entry, created):
+    """The companion tag of the docker_name.Tag entry recording that it
+    was created at the timestamp created."""
+    created = ftl_util.timestamp_to_time(created)
+    return docker_name.Tag('{repo}:{tag}{sep}{created}'.format(
+        repo=entry.as_repository(),
+        tag=entry.tag,
+        sep=constants.CREATION_TAG_SEPARATOR,
+        created=created.strftime(constants.CREATION_TAG_TIME_FORMAT)))
+
+
+def _parseCreationTag(tag):
+    """The (entry tag, timestamp) recorded by a CreationTag, or None."""
+    entry, sep, created = tag.rpartition(constants.CREATION_TAG_SEPARATOR)
+    if not sep:
+        return None
+    try:
+        created = datetime.datetime.strptime(
+            created, constants.CREATION_TAG_TIME_FORMAT)
+    except ValueError:
+        return None
+    return entry, created.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class Local(Base):
+    """Local is a cache in a directory of the build host, in front of a
+    Registry.
+
+    Blobs are stored once per digest under blobs/, and the manifest and
+    config of each entry under entries/. Hits of the backing cache and
+    images Set are stored here; Set also writes through to the backing
+    cache, with the same manifest. Set only copies layers already on
+    local disk. Other layers, like those of a hit, are only fetched from
+    the backing cache, and stored here, when they are read, so a hit
+    whose layers are mounted onto the target costs no network round trip.
+
+    Several FTL processes may share the directory: files are written
+    under temporary names and renamed into place, and entries are
+    written holding an exclusive flock on the directory. Reading a file
+    touches it, and once the directory holds more than max_size bytes the
+    least recently used files are evicted. Files used in the last
+    LOCAL_CACHE_EVICTION_GRACE_SECONDS are kept, so blobs are not removed
+    from under the builds using them.
+    """
+
+    def __init__(self, directory, namespace, max_size, ttl, backing):
+        super(Local, self).__init__()
+        self._directory = directory
+        self._blobs = os.path.join(directory, 'blobs')
+        self._entries = os.path.join(directory, 'entries', namespace)
+        self._max_size = max_size
+        self._ttl = ttl
+        self._backing = backing
+        for d in (self._blobs, self._entries):
+            try:
+                os.makedirs(d)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def __enter__(self):
+        return self
+
+    def Mounts(self, registry):
+        return self._backing.Mounts(registry)
+
+    def Drain(self):
+        return self._backing.Drain()
+
+    def Get(self, cache_key):
+        hit = self._getEntry(cache_key)
+        if hit:
+            logging.info('Found cached dependency layer for %s in local '
+                         'cache', cache_key)
+            return hit
+        hit = self._backing.Get(cache_key)
+        if hit:
+            self._store(cache_key, hit, blobs=False)
+            return _LocalImage(self, hit.manifest(), hit.config_file(),
+                               lambda: hit)
+        return None
+
+    def Set(self, cache_key, value):
+        value = WithCreationTime(value)
+        self._store(cache_key, value, blobs=True)
+        self._backing.Set(cache_key, value)
+
+    def _entry_path(self, cache_key):
+        return os.path.join(self._entries, cache_key + '.json')
+
+    def BlobPath(self, digest):
+        return os.path.join(self._blobs, digest.replace(':', '-'))
+
+    def _getEntry(self, cache_key):
+        path = self._entry_path(cache_key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            _touch(path)
+        except (IOError, ValueError):
+            return None
+        backing_hit = []
+
+        def remote():
+            if not backing_hit:
+                backing_hit.append(self._backing.Get(cache_key))
+            if not backing_hit[0]:
+                raise IOError('%s is no longer in the cache' % cache_key)
+            return backing_hit[0]
+
+        img = _LocalImage(self, entry['manifest'], entry['config'], remote)
+        if not Registry.checkTTL(img, self._ttl):
+            logging.info('TTL expired for locally cached image %s',
+                         cache_key)
+            return None
+        return img
+
+    def StoreBlob(self, digest, blob):
+        """Store blob under its digest, returning the path it is at."""
+        path = self.BlobPath(digest)
+        if not os.path.exists(path):
+            self._write(path, blob)
+        return path
+
+    def _copyBlob(self, digest, src):
+        """Store the blob at src under its digest."""
+        path = self.BlobPath(digest)
+        if os.path.exists(path):
+            return
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=self._blobs)
+        os.close(fd)
+        os.remove(tmp_path)
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.rename(tmp_path, path)
+
+    def _write(self, path, content):
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.tmp-', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.rename(tmp_path, path)
+
+    def _store(self, cache_key, img, blobs):
+        try:
+            # Blobs are renamed into place, so they are copied without
+            # the lock; blobs not on local disk are left to be fetched
+            # when read.
+            if blobs:
+                for digest in img.fs_layers():
+                    src = _blob_path(img, digest)
+                    if src:
+                        self._copyBlob(digest, src)
+            with _Flock(os.path.join(self._directory, '.lock')):
+                self._write(
+                    self._entry_path(cache_key),
+                    json.dumps({
+                        'manifest': img.manifest(),
+                        'config': img.config_file()
+                    }))
+                self._evict()
+        except (IOError, OSError) as e:
+            # The local cache is an optimization; a build never fails
+            # because it could not be written.
+            logging.warning('Could not store %s in the local cache: %s',
+                            cache_key, e)
+
+    def _evict(self):
+        """Remove least recently used files until the directory fits in
+        max_size. Called with the directory locked."""
+        files = []
+        for d in (self._blobs, self._entries):
+            for name in os.listdir(d):
+                path = os.path.join(d, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - constants.LOCAL_CACHE_EVICTION_GRACE_SECONDS
+        for mtime, size, path in sorted(files):
+            if total <= self._max_size or mtime > cutoff:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def _blob_path(img, digest):
+    """The file holding the blob digest of img, or None when it is not
+    on local disk."""
+    if not hasattr(img, 'blob_path'):
+        return None
+    return img.blob_path(digest)
+
+
+def _touch(path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+class _Flock(object):
+    """An exclusive flock on path, held as a context manager."""
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._path, 'a')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+class _LocalImage(docker_image.DockerImage):
+    """_LocalImage is an entry of a Local cache.
+
+    Blobs are read from the local cache, or else fetched from the image
+    remote() returns and stored locally.
+    """
+
+    def __init__(self, local, manifest, config_file, remote):
+        self._local = local
+        self._manifest = manifest
+        self._config_file = config_file
+        self._remote = remote
+        self._layers = {
+            lyr['digest']: lyr
+            for lyr in json.loads(manifest).get('layers', [])
+        }
+
+    def fs_layers(self):
+        manifest = json.loads(self.manifest())
+        return [x['digest'] for x in reversed(manifest['layers'])]
+
+    def diff_ids(self):
+        cfg = json.loads(self.config_file())
+        return list(reversed(cfg.get('rootfs', {}).get('diff_ids', [])))
+
+    def config_blob(self):
+        manifest = json.loads(self.manifest())
+        return manifest['config']['digest']
+
+    def blob_set(self):
+        return set(self.fs_layers() + [self.config_blob()])
+
+    def digest(self):
+        return docker_digest.SHA256(self.manifest())
+
+    def media_type(self):
+        manifest = json.loads(self.manifest())
+        return manifest.get('mediaType', docker_http.MANIFEST_SCHEMA2_MIME)
+
+    def manifest(self):
+        return self._manifest
+
+    def config_file(self):
+        return self._config_file
+
+    def blob_size(self, digest):
+        if digest in self._layers:
+            return self._layers[digest]['size']
+        return len(self.blob(digest))
+
+    def blob(self, digest):
+        if digest == self.config_blob():
+            return self._config_file
+        path = self._local.BlobPath(digest)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            _touch(path)
+            return blob
+        except IOError:
+            pass
+        blob = self._remote().blob(digest)
+        try:
+            self._local.StoreBlob(digest, blob)
+        except (IOError, OSError) as e:
+            logging.warning('Could not store %s in the local cache: %s',
+                            digest, e)
+        return blob
+
+    def uncompressed_blob(self, digest):
+        if digest not in self._layers:
+            return self.blob(digest)
+        codec = compression.FromMediaType(self._layers[digest]['mediaType'])
+        return codec.Decompress(self.blob(digest))
+
+    def _diff_id_to_digest(self, diff_id):
+        for this_diff_id, digest in zip(self.diff_ids(), self.fs_layers()):
+            if this_diff_id == diff_id:
+                return digest
+        raise ValueError('Unmatched "diff_id": "%s"' % diff_id)
+
+    def layer(self, diff_id):
+        return self.blob(self._diff_id_to_digest(diff_id))
+
+    def uncompressed_layer(self, diff_id):
+        return self.uncompressed_blob(self._diff_id_to_digest(diff_id))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        """Close the image."""
+
+    def __str__(self):
+        return 'local cache image %s' % self.digest()
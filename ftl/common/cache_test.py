@@ -14,10 +14,23 @@
 """Unit tests for cache.py"""
 
 import unittest
+import cStringIO
+import gzip
 import cache
 import mock
 import constants
 import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from containerregistry.client.v2_2 import docker_http
+
+import blob_store
+import ftl_util
+import tar_to_dockerimage
 
 
 class RegistryTest(unittest.TestCase):
@@ -38,6 +51,8 @@ class RegistryTest(unittest.TestCase):
         create_timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         mock_img.config_file.return_value = '{{"created": "{}"}}'.format(
             create_timestamp)
+        # An entry cached before creation times were annotated.
+        mock_img.manifest.return_value = '{}'
         c = cache.Registry(
             repo='fake.gcr.io/google-appengine',
             namespace='namespace',
@@ -56,6 +71,366 @@ class RegistryTest(unittest.TestCase):
             ttl=constants.DEFAULT_TTL_HOURS)
         self.assertIsNone(c._getEntry('abc123'))
 
+    def test_ttl_from_annotation(self):
+        img = mock.MagicMock()
+        img.config_file.side_effect = AssertionError('config fetched')
+        created = datetime.datetime.now() - datetime.timedelta(hours=2)
+        img.manifest.return_value = json.dumps({
+            'annotations': {
+                constants.CREATED_LABEL:
+                created.strftime("%Y-%m-%dT%H:%M:%SZ")
+            }
+        })
+        self.assertTrue(cache.Registry.checkTTL(img, 3))
+        self.assertFalse(cache.Registry.checkTTL(img, 1))
+
+    def test_ttl_from_config(self):
+        # Docker manifests are not annotated, so without a tag index the
+        # TTL of their entries is checked from the config.
+        created = datetime.datetime.now() - datetime.timedelta(hours=2)
+        store = blob_store.Store()
+        self.addCleanup(store.Close)
+        img = tar_to_dockerimage.FromFSImage(
+            layers=[store.AddBlob(_gzip('layer'), 'layer')],
+            overrides={'created': created.strftime("%Y-%m-%dT%H:%M:%SZ")},
+            store=store)
+        entry = cache.WithCreationTime(img)
+        self.assertIs(entry, img)
+        self.assertIsNone(ftl_util.manifest_creation_time(entry))
+        self.assertTrue(cache.Registry.checkTTL(entry, 3))
+        self.assertFalse(cache.Registry.checkTTL(entry, 1))
+
+    def test_ttl_from_tag_index(self):
+        img = mock.MagicMock()
+        img.config_file.side_effect = AssertionError('config fetched')
+        img.manifest.return_value = '{}'
+        created = datetime.datetime.now() - datetime.timedelta(hours=2)
+        created = created.strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.assertTrue(cache.Registry.checkTTL(img, 3, created))
+        self.assertFalse(cache.Registry.checkTTL(img, 1, created))
+
+    @mock.patch('cache.session.Push')
+    def test_set_tags_creation_time(self, mock_push):
+        index = mock.MagicMock()
+        c = cache.Registry(
+            repo='fake.gcr.io/google-appengine',
+            namespace='namespace',
+            creds=None,
+            transport=None,
+            ttl=constants.DEFAULT_TTL_HOURS,
+            tag_indexes=mock.MagicMock(**{'Get.return_value': index}))
+        img = mock.MagicMock()
+        img.media_type.return_value = docker_http.MANIFEST_SCHEMA2_MIME
+        img.manifest.return_value = '{}'
+        img.config_file.return_value = json.dumps(
+            {'created': '2018-01-02T03:04:05Z'})
+        c._set('abc123', img)
+        # The docker manifest is pushed under the key and a tag holding
+        # its creation time, which the tag index can read back.
+        tags = [str(call[0][0]) for call in mock_push.call_args_list]
+        self.assertEqual(tags, [
+            'fake.gcr.io/google-appengine/namespace:abc123',
+            'fake.gcr.io/google-appengine/namespace:abc123'
+            '.created-20180102T030405Z'
+        ])
+        self.assertEqual([call[0][0] for call in index.Add.call_args_list],
+                         ['abc123', 'abc123.created-20180102T030405Z'])
+
+    def test_oci_manifest_annotated(self):
+        img = mock.MagicMock()
+        img.media_type.return_value = docker_http.OCI_MANIFEST_MIME
+        img.manifest.return_value = json.dumps({
+            'mediaType': docker_http.OCI_MANIFEST_MIME,
+            'layers': []
+        })
+        img.config_file.return_value = json.dumps(
+            {'created': '2018-01-01T00:00:00Z'})
+        entry = cache.WithCreationTime(img)
+        self.assertEqual(ftl_util.manifest_creation_time(entry),
+                         '2018-01-01T00:00:00Z')
+
+    def test_background_writes(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        release = threading.Event()
+
+        def fake_set(cache_key, value):
+            release.wait(5)
+            if cache_key == 'bad':
+                raise IOError('push failed')
+
+        c = cache.Registry(
+            repo='fake.gcr.io/google-appengine',
+            namespace='namespace',
+            creds=None,
+            transport=None,
+            ttl=constants.DEFAULT_TTL_HOURS,
+            threads=2,
+            export_location=output_dir,
+            background_writes=True)
+        with mock.patch.object(c, '_set', side_effect=fake_set) as set_:
+            # Set returns before the write has happened.
+            c.Set('good', None)
+            c.Set('bad', None)
+            release.set()
+            self.assertFalse(c.Drain())
+            self.assertEqual(set_.call_count, 2)
+
+        with open(os.path.join(output_dir,
+                               constants.BUILDER_OUTPUT_FILE)) as f:
+            writes = json.load(f)['cacheWrites']
+        self.assertFalse(writes['completed'])
+        self.assertEqual(writes['writes'], [{
+            'hash': 'good',
+            'status': 'DONE'
+        }, {
+            'hash': 'bad',
+            'status': 'FAILED'
+        }])
+
+    def _lookup_stats(self, global_entry, project_entry):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        c = cache.Registry(
+            repo='fake.gcr.io/google-appengine',
+            namespace='namespace',
+            creds=None,
+            transport=None,
+            ttl=constants.DEFAULT_TTL_HOURS,
+            use_global=True,
+            export_stats=True,
+            export_location=output_dir)
+        with mock.patch.object(c, '_getGlobalEntry',
+                               side_effect=global_entry), \
+                mock.patch.object(c, '_getLocalEntry',
+                                  side_effect=project_entry):
+            hit = c._getEntry('abc123')
+        with open(os.path.join(output_dir,
+                               constants.BUILDER_OUTPUT_FILE)) as f:
+            stats = json.load(f)['cacheStats']
+        return hit, [(s['level'], s['status']) for s in stats]
+
+    @mock.patch('cache.Registry.checkTTL', return_value=True)
+    def test_global_hit_preferred(self, unused_check_ttl):
+        project_done = threading.Event()
+        global_img = mock.MagicMock()
+
+        def slow_global_entry(cache_key):
+            project_done.wait(5)
+            return global_img, None
+
+        def project_entry(cache_key):
+            project_done.set()
+            return mock.MagicMock(), None
+
+        # The global hit wins even when the project hit arrives first.
+        hit, stats = self._lookup_stats(slow_global_entry, project_entry)
+        self.assertIs(hit, global_img)
+        self.assertEqual(stats, [('global', 'HIT'), ('project', 'SKIPPED')])
+
+    @mock.patch('cache.Registry.checkTTL', return_value=True)
+    def test_project_hit_on_global_miss(self, unused_check_ttl):
+        project_started = threading.Event()
+        project_img = mock.MagicMock()
+
+        def global_entry(cache_key):
+            # Both tiers are looked up at once.
+            self.assertTrue(project_started.wait(5))
+            return None, None
+
+        def project_entry(cache_key):
+            project_started.set()
+            return project_img, None
+
+        hit, stats = self._lookup_stats(global_entry, project_entry)
+        self.assertIs(hit, project_img)
+        self.assertEqual(stats, [('global', 'MISS'), ('project', 'HIT')])
+
+    def test_mounts_on_same_registry(self):
+        c = cache.Registry(
+            repo='fake.gcr.io/google-appengine',
+            namespace='namespace',
+            creds=None,
+            transport=None,
+            ttl=constants.DEFAULT_TTL_HOURS,
+            use_global=True)
+        self.assertEqual([str(m) for m in c.Mounts('fake.gcr.io')],
+                         ['fake.gcr.io/google-appengine/namespace'])
+        self.assertEqual([str(m) for m in c.Mounts('gcr.io')],
+                         [constants.GLOBAL_CACHE_REGISTRY + '/namespace'])
+        self.assertEqual(c.Mounts('other.io'), [])
+
+    @mock.patch('containerregistry.client.v2_2.docker_image.FromRegistry')
+    def test_tag_index(self, mock_from):
+        index = mock.MagicMock()
+        index.Contains.side_effect = lambda tag: tag == 'hit'
+        index.CreationTime.return_value = '2018-01-01T00:00:00Z'
+        tag_indexes = mock.MagicMock()
+        tag_indexes.Get.return_value = index
+        mock_img = mock.MagicMock()
+        mock_from.return_value.__enter__.return_value = mock_img
+        c = cache.Registry(
+            repo='fake.gcr.io/google-appengine',
+            namespace='namespace',
+            creds=None,
+            transport=None,
+            ttl=constants.DEFAULT_TTL_HOURS,
+            tag_indexes=tag_indexes)
+        self.assertEqual(c._getLocalEntry('miss'), (None, None))
+        self.assertFalse(mock_from.called)
+        self.assertEqual(c._getLocalEntry('hit'),
+                         (mock_img, '2018-01-01T00:00:00Z'))
+
+
+class TagIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._transport = mock.MagicMock()
+        patcher = mock.patch.object(
+            cache.docker_http,
+            'Transport',
+            create=True,
+            return_value=self._transport)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+            cache.docker_http, 'Scheme', create=True, return_value='https')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._index = cache.TagIndex(
+            cache.docker_name.Repository('fake.gcr.io/repo/namespace'),
+            None, None, max_age=60)
+
+    def test_pages_listed_once(self):
+        self._transport.PaginatedRequest.return_value = [
+            (None, json.dumps({'tags': ['one', 'two']})),
+            (None, json.dumps({'tags': ['three']})),
+        ]
+        self.assertTrue(self._index.Contains('three'))
+        self.assertFalse(self._index.Contains('four'))
+        self._index.Add('four')
+        self.assertTrue(self._index.Contains('four'))
+        self.assertEqual(self._transport.PaginatedRequest.call_count, 1)
+
+    def test_creation_times(self):
+        self._transport.PaginatedRequest.return_value = [
+            (None, json.dumps({'tags': [
+                'one', 'one.created-20180101T000000Z',
+                'one.created-20180301T000000Z', 'two.created-bad'
+            ]})),
+        ]
+        self.assertTrue(self._index.Contains('one'))
+        self.assertEqual(self._index.CreationTime('one'),
+                         '2018-03-01T00:00:00Z')
+        self.assertIsNone(self._index.CreationTime('two'))
+        self._index.Add('two.created-20180401T000000Z')
+        self.assertEqual(self._index.CreationTime('two'),
+                         '2018-04-01T00:00:00Z')
+
+    def test_listing_failed(self):
+        self._transport.PaginatedRequest.side_effect = ValueError('bad')
+        self.assertIsNone(self._index.Contains('one'))
+
+    @mock.patch('containerregistry.client.v2_2.docker_image.FromRegistry')
+    def test_transport_error_falls_back(self, mock_from):
+        self._transport.PaginatedRequest.side_effect = (
+            docker_http.BadStateException('bad page'))
+        mock_from.return_value.__enter__.return_value.exists.return_value = (
+            False)
+        c = cache.Registry(
+            repo='fake.gcr.io/google-appengine',
+            namespace='namespace',
+            creds=None,
+            transport=None,
+            ttl=constants.DEFAULT_TTL_HOURS,
+            tag_indexes=mock.MagicMock(**{'Get.return_value': self._index}))
+        self.assertEqual(c._getLocalEntry('abc123'), (None, None))
+        self.assertTrue(mock_from.called)
+
+
+def _gzip(content):
+    buf = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+class LocalTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._store = blob_store.Store()
+        self._backing = mock.MagicMock()
+        self._backing.Get.return_value = None
+        created = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        self._blob = _gzip('layer')
+        self._img = tar_to_dockerimage.FromFSImage(
+            layers=[self._store.AddBlob(self._blob, 'layer')],
+            overrides={'created': created},
+            store=self._store)
+
+    def tearDown(self):
+        self._store.Close()
+        shutil.rmtree(self._dir)
+
+    def _local(self, max_size=constants.LOCAL_CACHE_MAX_SIZE):
+        return cache.Local(
+            directory=self._dir,
+            namespace='namespace',
+            max_size=max_size,
+            ttl=constants.DEFAULT_TTL_HOURS,
+            backing=self._backing)
+
+    def test_write_through(self):
+        self._local().Set('abc123', self._img)
+        self.assertEqual(self._backing.Set.call_count, 1)
+        key, stored = self._backing.Set.call_args[0]
+        self.assertEqual(key, 'abc123')
+
+        # Another process finds the entry without asking the registry,
+        # with the manifest the registry was given.
+        hit = self._local().Get('abc123')
+        self.assertEqual(hit.manifest(), stored.manifest())
+        self.assertEqual(hit.fs_layers(), self._img.fs_layers())
+        digest = self._img.fs_layers()[0]
+        self.assertEqual(hit.blob(digest), self._blob)
+        self.assertFalse(self._backing.Get.called)
+
+    def test_read_through(self):
+        self._backing.Get.return_value = self._img
+        hit = self._local().Get('abc123')
+        self.assertEqual(hit.digest(), self._img.digest())
+
+        # Blobs are fetched once they are read, and kept.
+        hit = self._local().Get('abc123')
+        digest = self._img.fs_layers()[0]
+        self.assertEqual(hit.blob(digest), self._blob)
+        self.assertEqual(self._backing.Get.call_count, 2)
+        self.assertEqual(hit.blob(digest), self._blob)
+        self.assertEqual(self._backing.Get.call_count, 2)
+        self.assertEqual(hit.uncompressed_blob(digest), 'layer')
+
+    def test_remote_blobs_not_fetched_on_set(self):
+        img = mock.MagicMock(wraps=self._img)
+        img.manifest.return_value = self._img.manifest()
+        img.config_file.return_value = self._img.config_file()
+        img.blob_path.return_value = None
+        img.blob.side_effect = AssertionError('blob fetched')
+        self._local().Set('abc123', img)
+        self.assertFalse(os.path.exists(
+            self._local().BlobPath(self._img.fs_layers()[0])))
+
+    def test_miss(self):
+        self.assertIsNone(self._local().Get('abc123'))
+        self._backing.Get.assert_called_once_with('abc123')
+
+    @mock.patch.object(cache.constants, 'LOCAL_CACHE_EVICTION_GRACE_SECONDS',
+                       -1)
+    def test_eviction(self):
+        local = self._local(max_size=0)
+        local.Set('abc123', self._img)
+        self.assertIsNone(local._getEntry('abc123'))
+        self.assertFalse(os.path.exists(
+            local.BlobPath(self._img.fs_layers()[0])))
+
 
 if __name__ == '__main__':
     unittest.main()
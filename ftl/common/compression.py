@@ -0,0 +1,194 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package defines the codecs layer blobs can be compressed with."""
+
+import abc
+import cStringIO
+import gzip
+import zlib
+
+from ftl.common import ftl_error
+from ftl.common import parallel_gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+UNCOMPRESSED = 'uncompressed'
+ZSTD = 'zstd'
+CODECS = [GZIP, UNCOMPRESSED, ZSTD]
+
+DOCKER_LAYER_GZIP_MIME = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+DOCKER_LAYER_TAR_MIME = 'application/vnd.docker.image.rootfs.diff.tar'
+OCI_LAYER_GZIP_MIME = 'application/vnd.oci.image.layer.v1.tar+gzip'
+OCI_LAYER_TAR_MIME = 'application/vnd.oci.image.layer.v1.tar'
+OCI_LAYER_ZSTD_MIME = 'application/vnd.oci.image.layer.v1.tar+zstd'
+OCI_CONFIG_MIME = 'application/vnd.oci.image.config.v1+json'
+
+# The OCI media types equivalent to docker schema 2 layer media types.
+OCI_EQUIVALENTS = {
+    DOCKER_LAYER_GZIP_MIME:
+    OCI_LAYER_GZIP_MIME,
+    DOCKER_LAYER_TAR_MIME:
+    OCI_LAYER_TAR_MIME,
+    'application/vnd.docker.image.rootfs.foreign.diff.tar.gzip':
+    'application/vnd.oci.image.layer.nondistributable.v1.tar+gzip',
+}
+
+
+class Codec(object):
+    """Codec is an abstract base class for a layer compression format."""
+
+    __metaclass__ = abc.ABCMeta  # For enforcing that methods are overriden.
+
+    name = None
+    # The layer media type in a docker schema 2 manifest, or None if the
+    # format is only expressible in an OCI manifest.
+    docker_media_type = None
+    oci_media_type = None
+
+    def __init__(self, level=None):
+        self.level = level
+
+    @abc.abstractmethod
+    def Compressor(self, fileobj, threads=1):
+        """A write-only file object compressing into fileobj."""
+
+    @abc.abstractmethod
+    def Decompress(self, blob):
+        """The uncompressed contents of a compressed blob string."""
+
+    def DecompressStream(self, fileobj):
+        """A read-only file object of the uncompressed contents of the
+        compressed fileobj."""
+        return cStringIO.StringIO(self.Decompress(fileobj.read()))
+
+    def __str__(self):
+        if self.level is None:
+            return self.name
+        return '%s:%d' % (self.name, self.level)
+
+
+class Gzip(Codec):
+    name = GZIP
+    docker_media_type = DOCKER_LAYER_GZIP_MIME
+    oci_media_type = OCI_LAYER_GZIP_MIME
+
+    def __init__(self, level=1):
+        super(Gzip, self).__init__(1 if level is None else level)
+
+    def Compressor(self, fileobj, threads=1):
+        # Layers are always written in blocks, so their digest does not
+        # depend on the number of threads compressing them.
+        return parallel_gzip.ParallelGzipFile(
+            fileobj, compresslevel=self.level, threads=threads)
+
+    def Decompress(self, blob):
+        return zlib.decompress(blob, 16 + zlib.MAX_WBITS)
+
+    def DecompressStream(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+class _PlainFile(object):
+    """A pass-through file object that leaves fileobj open on close."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, data):
+        self._fileobj.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Uncompressed(Codec):
+    name = UNCOMPRESSED
+    docker_media_type = DOCKER_LAYER_TAR_MIME
+    oci_media_type = OCI_LAYER_TAR_MIME
+
+    def __init__(self, level=None):
+        super(Uncompressed, self).__init__(None)
+
+    def Compressor(self, fileobj, threads=1):
+        return _PlainFile(fileobj)
+
+    def Decompress(self, blob):
+        return blob
+
+    def DecompressStream(self, fileobj):
+        return fileobj
+
+
+class _ZstdFile(object):
+    """A write-only file object writing a single zstd frame to fileobj."""
+
+    def __init__(self, fileobj, level, threads):
+        cctx = zstandard.ZstdCompressor(level=level, threads=threads)
+        self._writer = cctx.stream_writer(fileobj)
+
+    def write(self, data):
+        self._writer.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._writer.flush(zstandard.FLUSH_FRAME)
+
+
+class Zstd(Codec):
+    name = ZSTD
+    oci_media_type = OCI_LAYER_ZSTD_MIME
+
+    def __init__(self, level=3):
+        if zstandard is None:
+            raise ftl_error.UserError(
+                'zstd layer compression requires the zstandard module')
+        super(Zstd, self).__init__(3 if level is None else level)
+
+    def Compressor(self, fileobj, threads=1):
+        return _ZstdFile(fileobj, self.level, threads if threads > 1 else 0)
+
+    def Decompress(self, blob):
+        return zstandard.ZstdDecompressor().decompressobj().decompress(blob)
+
+    def DecompressStream(self, fileobj):
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+
+def FromName(name, level=None):
+    """The Codec for a --compression flag value."""
+    if name == GZIP:
+        return Gzip(level)
+    if name == UNCOMPRESSED:
+        return Uncompressed()
+    if name == ZSTD:
+        return Zstd(level)
+    raise ftl_error.UserError('unknown layer compression: %s' % name)
+
+
+def FromMediaType(media_type):
+    """The Codec able to decompress a layer of the given media type."""
+    if media_type in (DOCKER_LAYER_TAR_MIME, OCI_LAYER_TAR_MIME):
+        return Uncompressed()
+    if media_type == OCI_LAYER_ZSTD_MIME:
+        return Zstd()
+    return Gzip()
@@ -0,0 +1,70 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for compression.py"""
+
+import cStringIO
+import unittest
+
+import compression
+
+
+class CompressionTest(unittest.TestCase):
+    def _compress(self, codec, content, threads=1):
+        buf = cStringIO.StringIO()
+        f = codec.Compressor(buf, threads)
+        f.write(content)
+        f.close()
+        return buf.getvalue()
+
+    def _round_trip(self, codec, threads=1):
+        content = 'layer contents ' * 1000
+        blob = self._compress(codec, content, threads)
+        self.assertEqual(codec.Decompress(blob), content)
+        stream = codec.DecompressStream(cStringIO.StringIO(blob))
+        self.assertEqual(stream.read(100) + stream.read(), content)
+
+    def test_gzip(self):
+        self._round_trip(compression.Gzip())
+        self._round_trip(compression.Gzip(6), threads=2)
+
+    def test_gzip_digest_independent_of_threads(self):
+        content = 'layer contents ' * 200000
+        codec = compression.Gzip()
+        self.assertEqual(
+            self._compress(codec, content, threads=1),
+            self._compress(codec, content, threads=4))
+
+    def test_uncompressed(self):
+        self._round_trip(compression.Uncompressed())
+
+    @unittest.skipIf(compression.zstandard is None, 'zstandard not installed')
+    def test_zstd(self):
+        self._round_trip(compression.Zstd())
+
+    def test_from_name(self):
+        self.assertEqual(str(compression.FromName('gzip', 9)), 'gzip:9')
+        self.assertEqual(str(compression.FromName('uncompressed')),
+                         'uncompressed')
+
+    def test_from_media_type(self):
+        self.assertEqual(
+            compression.FromMediaType(compression.OCI_LAYER_TAR_MIME).name,
+            compression.UNCOMPRESSED)
+        self.assertEqual(
+            compression.FromMediaType(compression.DOCKER_LAYER_GZIP_MIME).name,
+            compression.GZIP)
+
+
+if __name__ == '__main__':
+    unittest.main()
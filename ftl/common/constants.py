@@ -27,6 +27,29 @@ FTL_VERSION = "v0.18.0"
 BUILDER_OUTPUT = 'BUILDER_OUTPUT'
 BUILDER_OUTPUT_FILE = 'output'
 
+# local state kept between builds
+FTL_STATE_DIR = 'FTL_STATE_DIR'
+DEFAULT_STATE_DIR = '~/.ftl'
+TUNING_STATS_FILE = 'tuning.json'
+TREE_INDEX_FILE = 'tree_index.json'
+BLOB_LEDGER_FILE = 'blob_ledger.json'
+BLOB_LEDGER_TTL_HOURS = 24
+DAEMON_SOCKET_FILE = 'daemon.sock'
+
+# cache tag listings
+TAG_INDEX_PAGE_SIZE = 1000
+TAG_INDEX_MAX_AGE = 60
+# companion tags recording when a cache entry was pushed
+CREATION_TAG_SEPARATOR = '.created-'
+CREATION_TAG_TIME_FORMAT = '%Y%m%dT%H%M%SZ'
+
+# local layer cache
+LOCAL_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+LOCAL_CACHE_EVICTION_GRACE_SECONDS = 60 * 60
+
+# batch builds
+BATCH_JOBS = 4
+
 # Google Cloud Builder Args
 GLOBAL_CACHE_REGISTRY = 'gcr.io/ftl-global-cache'
 
@@ -56,10 +79,36 @@ VIRTUALENV_DEFAULT_CMD = 'virtualenv'
 VENV_DEFAULT_CMD = None
 PIP_OPTIONS = ['--disable-pip-version-check']
 
+# the file listing paths left out of a directory's layer
+FTLIGNORE = '.ftlignore'
+
+# reproducible mode constants
+REPRODUCIBLE_CREATED = '1970-01-01T00:00:00Z'
+REPRODUCIBLE_MTIME = 0
+CREATED_LABEL = 'ftl.created'
+
+# app delta layer constants
+APP_ENTRIES_LABEL = 'ftl.app-entries'
+APP_DELTA_MAX_DEPTH = 8
+APP_DELTA_MAX_SIZE = 64 * 1024 * 1024
+
+# app layer split constants
+APP_CHANGES_FILE = 'app_changes.json'
+APP_SPLIT_MIN_BUILDS = 3
+APP_SPLIT_HOT_RATIO = 0.5
+
 # cache constants
 DEFAULT_TTL_HOURS = 168  # hrs in a week
 MINIMUM_TTL_HOURS = 6    # 6 hrs in terms of weeks
 
+# when cache writes happen, see --cache-writes
+CACHE_WRITES_SYNC = 'sync'
+CACHE_WRITES_BACKGROUND = 'background'
+CACHE_WRITES_AFTER_PUSH = 'after-push'
+CACHE_WRITES_MODES = [
+    CACHE_WRITES_SYNC, CACHE_WRITES_BACKGROUND, CACHE_WRITES_AFTER_PUSH
+]
+
 # descriptor files with unspecified dependencies
 UNSPECIFIED_DEPS_FILES = [REQUIREMENTS_TXT, PACKAGE_JSON, COMPOSER_JSON]
 
@@ -16,6 +16,8 @@
 import abc
 import os
 
+from ftl.common import ignore
+
 
 class Base(object):
     """Base is an abstract base class representing an application context.
@@ -67,12 +69,23 @@ class Workspace(Base):
         return os.path.isfile(fqpath)
 
     def ListFiles(self):
-        """Override."""
+        """Override.
+
+        Paths excluded by the .ftlignore of the workspace are skipped.
+        """
+        ignore_paths = ignore.ForDirectory(self._directory)
         dir = self._directory + '/'
         for root, dirnames, filenames in os.walk(dir):
             relative = root[len(dir):]
+            # Prune ignored subtrees so os.walk never lists them.
+            dirnames[:] = [
+                d for d in dirnames
+                if not ignore_paths.Skip(os.path.join(relative, d))
+            ]
             for fname in filenames:
-                yield os.path.join(relative, fname)
+                path = os.path.join(relative, fname)
+                if not ignore_paths.Excluded(path):
+                    yield path
 
     def GetFile(self, filename):
         """Override."""
@@ -52,6 +52,18 @@ class WorkspaceTest(unittest.TestCase):
             f.write('hey')
         self.assertTrue(self.workspace.Contains(p))
 
+    def test_list_files_ftlignore(self):
+        for p in ['app.py', '.git/HEAD', 'logs/a.log']:
+            path = os.path.join(self.tmp_dir, p)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('hey')
+        with open(os.path.join(self.tmp_dir, '.ftlignore'), 'w') as f:
+            f.write('.git\n*/*.log\n')
+        self.assertEqual(
+            sorted(self.workspace.ListFiles()), ['.ftlignore', 'app.py'])
+
 
 if __name__ == '__main__':
     unittest.main()
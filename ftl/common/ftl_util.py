@@ -20,11 +20,13 @@ import tempfile
 import datetime
 import json
 import re
+import threading
 
 from ftl.common import constants
 from ftl.common import ftl_error
+from ftl.common import image_assembler
+from ftl.common import layer_writer
 
-from containerregistry.client.v2_2 import append
 from containerregistry.transform.v2_2 import metadata
 
 
@@ -37,28 +39,25 @@ def AppendLayersIntoImage(imgs):
         logging.info("requirements.txt file with no deps used")
         return None
     with Timing('Stitching layers into final image'):
-        for i, img in enumerate(imgs):
-            if i == 0:
-                result_image = img
-                continue
-            diff_ids = img.diff_ids()
-            for diff_id in diff_ids:
-                lyr = img.blob(img._diff_id_to_digest(diff_id))
-                overrides = CfgDctToOverrides(json.loads(img.config_file()))
-                result_image = append.Layer(
-                    result_image, lyr, diff_id=diff_id, overrides=overrides)
-        return result_image
+        assembler = image_assembler.ImageAssembler(imgs[0])
+        for img in imgs[1:]:
+            assembler.AddImage(
+                img, CfgDctToOverrides(image_assembler.Config(img)))
+        return assembler.Assemble()
 
 
 # This is a 'whitelist' of values to pass from the
 # config_file of a DockerImage to an Overrides object
 # _OVERRIDES_VALUES = ['created', 'Entrypoint', 'Env']
-def CfgDctToOverrides(config_dct):
+def CfgDctToOverrides(config_dct, labels=None):
     """
     Takes a dct of config values and runs them through
-    the whitelist
+    the whitelist. Labels are not whitelisted, but can be
+    given explicitly.
     """
     overrides_dct = {}
+    if labels:
+        overrides_dct['labels'] = labels
     for k, v in config_dct.iteritems():
         if k == 'created':
             # this key change is made as the key is
@@ -98,26 +97,41 @@ class Timing(object):
         logging.info('%s took %d seconds', self.descriptor, end - self.start)
 
 
-def zip_dir_to_layer_sha(app_dir, destination_path, alter_symlinks=True):
-
-    tar_dir = tempfile.mkdtemp()
-
-    tar_path = tempfile.mktemp(suffix='.tar')
-    txfrm_regex = 's,^,%s/,' % destination_path
-    if alter_symlinks:
-        txfrm_regex = 'flags=r;s,^,%s/,' % destination_path
-    tar_cmd = [
-        'tar', '-pcf', tar_path, '--hard-dereference', '--transform', txfrm_regex, '--exclude',
-        '*.pyc', '.'
-    ]
-
-    run_command('tar_runtime_package', tar_cmd, cmd_cwd=app_dir)
-
-    u_blob = open(tar_path, 'r').read()
-    # We use gzip for performance instead of python's zip.
-    gzip_cmd = ['gzip', tar_path, '-1']
-    run_command('gzip_tar_runtime_package', gzip_cmd)
-    return open(os.path.join(tar_dir, tar_path + '.gz'), 'rb').read(), u_blob
+_builder_output_lock = threading.Lock()
+
+
+def update_builder_output(path, output):
+    """Merge the keys of output into the builder output file in path."""
+    if not path:
+        return
+    output_file = os.path.join(path, constants.BUILDER_OUTPUT_FILE)
+    with _builder_output_lock:
+        current = {}
+        if os.path.isfile(output_file):
+            try:
+                with open(output_file, 'r') as f:
+                    current = json.load(f)
+            except ValueError:
+                current = {}
+        current.update(output)
+        with open(output_file, 'w') as f:
+            f.write(json.dumps(current))
+
+
+def zip_dir_to_layer(app_dir,
+                     destination_path,
+                     alter_symlinks=True,
+                     options=None):
+    """Tar and gzip app_dir into the blob store.
+
+    Args:
+      options: the layer_writer.Options to write the layer with.
+    Returns:
+      the blob_store.Entry of the written layer.
+    """
+    with Timing('tar_and_gzip_runtime_package'):
+        return layer_writer.FromDirectory(
+            app_dir, destination_path, alter_symlinks, options=options)
 
 
 def has_pkg_descriptor(descriptor_files, ctx):
@@ -196,10 +210,19 @@ def gen_tmp_dir(dirr):
     return dir_name
 
 
+def manifest_creation_time(image):
+    """The creation time annotated on the manifest of a cache entry, or
+    None for docker manifests and entries cached before the annotation
+    was added."""
+    manifest = json.loads(image.manifest())
+    return (manifest.get('annotations') or {}).get(constants.CREATED_LABEL)
+
+
 def creation_time(image):
-    logging.info(image.config_file())
+    logging.debug(image.config_file())
     cfg = json.loads(image.config_file())
-    return cfg.get('created')
+    labels = (cfg.get('config') or {}).get('Labels') or {}
+    return labels.get(constants.CREATED_LABEL) or cfg.get('created')
 
 
 def timestamp_to_time(dt_str):
@@ -207,11 +230,28 @@ def timestamp_to_time(dt_str):
     return datetime.datetime.strptime(dt, "%Y-%m-%dT%H:%M:%S")
 
 
-def generate_overrides(set_env, virtualenv_dir=constants.VIRTUALENV_DIR):
+def generate_overrides(set_env,
+                       virtualenv_dir=constants.VIRTUALENV_DIR,
+                       options=None):
+    """Generate the config overrides of a cached dependency layer.
+
+    In reproducible mode (see layer_writer.Options) the config is created
+    at a fixed time, and the real creation time, which the cache TTL is
+    checked against, is kept in a label instead. Labels are not carried
+    into the final image, so it stays identical for identical inputs.
+    """
     created_time = datetime.datetime.now().strftime('%Y-%m-%dT%H:') + '00:00Z'
-    overrides_dct = {
-        'created': created_time,
-    }
+    if options and options.reproducible:
+        overrides_dct = {
+            'created': constants.REPRODUCIBLE_CREATED,
+            'Labels': {
+                constants.CREATED_LABEL: created_time
+            },
+        }
+    else:
+        overrides_dct = {
+            'created': created_time,
+        }
     if set_env:
         env = {
             'VIRTUAL_ENV': virtualenv_dir,
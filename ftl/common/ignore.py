@@ -0,0 +1,173 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package implements .ftlignore files.
+
+An .ftlignore file at the root of a directory lists patterns of paths to
+leave out of its layer, with the semantics of .dockerignore:
+
+  - one pattern per line, blank lines and lines starting with # ignored;
+  - paths are relative to the directory, a leading / is dropped;
+  - * and ? match within a path component, ** matches any number of
+    components;
+  - a pattern also excludes everything below the paths it matches;
+  - a pattern starting with ! re-includes what it matches, and the last
+    pattern matching a path decides.
+
+Patterns are compiled to regular expressions once per directory.
+"""
+
+import logging
+import os
+import re
+import threading
+
+from ftl.common import constants
+
+# Bytecode is never put into layers; the interpreter regenerates it.
+DEFAULT_PATTERNS = ['**/*.pyc']
+
+_WILDCARDS = '*?[\\'
+
+
+def _compile(pattern):
+    """Compile a cleaned pattern into a regular expression."""
+    regex = ''
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if i + 1 < n and pattern[i + 1] == '*':
+                i += 1
+                if i + 1 < n and pattern[i + 1] == '/':
+                    i += 1
+                    regex += '(.*/)?'
+                else:
+                    regex += '.*'
+            else:
+                regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                chars = pattern[i + 1:end].replace('\\', '\\\\')
+                if chars.startswith('!') or chars.startswith('^'):
+                    chars = '^' + chars[1:]
+                regex += '[' + chars + ']'
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return re.compile('^' + regex + '$')
+
+
+class _Pattern(object):
+    def __init__(self, line):
+        self.negated = line.startswith('!')
+        if self.negated:
+            line = line[1:].strip()
+        self.pattern = os.path.normpath(line).lstrip('/')
+        self.regex = _compile(self.pattern)
+        # The part of the pattern before its first wildcard.
+        self.prefix = self.pattern
+        for i, c in enumerate(self.pattern):
+            if c in _WILDCARDS:
+                self.prefix = self.pattern[:i]
+                break
+
+    def Matches(self, path, parts):
+        if self.regex.match(path):
+            return True
+        # A pattern matching any parent directory matches the path too;
+        # with ** the parent may be at any depth.
+        for i in range(1, len(parts)):
+            if self.regex.match('/'.join(parts[:i])):
+                return True
+        return False
+
+
+class Ignore(object):
+    """Ignore decides which paths of a directory are left out.
+
+    Args:
+      patterns: .ftlignore lines, in order.
+    """
+
+    def __init__(self, patterns):
+        self._patterns = []
+        for line in patterns:
+            line = line.strip()
+            if not line or line.startswith('#') or line in ('!', '/'):
+                continue
+            self._patterns.append(_Pattern(line))
+        self._negations = [p for p in self._patterns if p.negated]
+
+    def Excluded(self, path):
+        """Whether the relative path is left out."""
+        parts = path.split('/')
+        excluded = False
+        for pattern in self._patterns:
+            if pattern.Matches(path, parts):
+                excluded = not pattern.negated
+        return excluded
+
+    def CanPrune(self, path):
+        """Whether nothing below the excluded directory path can be
+        re-included, so the walk can skip it without listing it."""
+        prefix = path + '/'
+        for pattern in self._negations:
+            if (not pattern.prefix or pattern.prefix.startswith(prefix)
+                    or prefix.startswith(pattern.prefix)):
+                return False
+        return True
+
+    def Skip(self, path):
+        """Whether the walk can skip path and everything below it."""
+        return self.Excluded(path) and self.CanPrune(path)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def ForDirectory(directory):
+    """The Ignore of directory: the default patterns followed by the
+    lines of its .ftlignore, if it has one."""
+    path = os.path.join(directory, constants.FTLIGNORE)
+    try:
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime)
+    except OSError:
+        return Default()
+    with _cache_lock:
+        if key not in _cache:
+            with open(path, 'r') as f:
+                lines = f.read().splitlines()
+            logging.info('Applying %d lines of %s', len(lines), path)
+            _cache[key] = Ignore(DEFAULT_PATTERNS + lines)
+        return _cache[key]
+
+
+_default = Ignore(DEFAULT_PATTERNS)
+
+
+def Default():
+    """The Ignore of a directory without an .ftlignore file."""
+    return _default
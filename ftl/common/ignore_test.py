@@ -0,0 +1,93 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for ignore.py"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import constants
+import ignore
+
+
+class IgnoreTest(unittest.TestCase):
+    def test_defaults(self):
+        matcher = ignore.Default()
+        self.assertTrue(matcher.Excluded('foo.pyc'))
+        self.assertTrue(matcher.Excluded('a/b/foo.pyc'))
+        self.assertFalse(matcher.Excluded('foo.py'))
+
+    def test_patterns(self):
+        matcher = ignore.Ignore([
+            '# comment',
+            '',
+            '/.git',
+            'node_modules',
+            '*.log',
+            'docs/**/*.tmp',
+            'build/?',
+        ])
+        self.assertTrue(matcher.Excluded('.git'))
+        self.assertTrue(matcher.Excluded('.git/objects/ab'))
+        self.assertTrue(matcher.Excluded('node_modules/foo/index.js'))
+        self.assertTrue(matcher.Excluded('server.log'))
+        self.assertFalse(matcher.Excluded('logs/server.log'))
+        self.assertTrue(matcher.Excluded('docs/a.tmp'))
+        self.assertTrue(matcher.Excluded('docs/a/b/c.tmp'))
+        self.assertTrue(matcher.Excluded('build/x'))
+        self.assertFalse(matcher.Excluded('build/xy'))
+        self.assertFalse(matcher.Excluded('# comment'))
+        self.assertFalse(matcher.Excluded('src/node.js'))
+
+    def test_deep_paths(self):
+        matcher = ignore.Ignore(['**/node_modules', 'a/*/b', 'build/?'])
+        self.assertTrue(matcher.Excluded('node_modules/x/y/z/index.js'))
+        self.assertTrue(matcher.Excluded('src/lib/node_modules/x/y/z.js'))
+        self.assertTrue(matcher.Excluded('a/x/b/c/d/e'))
+        self.assertTrue(matcher.Excluded('build/x/y/z'))
+        self.assertFalse(matcher.Excluded('a/x/c/b/d'))
+        self.assertFalse(matcher.Excluded('src/node_modules.js'))
+
+    def test_negation(self):
+        matcher = ignore.Ignore(['*.md', '!README.md', 'docs', '!docs/keep'])
+        self.assertTrue(matcher.Excluded('CHANGES.md'))
+        self.assertFalse(matcher.Excluded('README.md'))
+        self.assertTrue(matcher.Excluded('docs/other'))
+        self.assertFalse(matcher.Excluded('docs/keep'))
+        # docs may not be pruned, docs/keep lives below it.
+        self.assertFalse(matcher.CanPrune('docs'))
+
+    def test_prune(self):
+        matcher = ignore.Ignore(['.git', 'tmp', '!tmp/keep'])
+        self.assertTrue(matcher.Skip('.git'))
+        self.assertFalse(matcher.Skip('tmp'))
+        self.assertFalse(matcher.Skip('src'))
+
+    def test_for_directory(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            self.assertIs(ignore.ForDirectory(tmp_dir), ignore.Default())
+            with open(os.path.join(tmp_dir, constants.FTLIGNORE), 'w') as f:
+                f.write('.git\n')
+            matcher = ignore.ForDirectory(tmp_dir)
+            self.assertTrue(matcher.Excluded('.git/HEAD'))
+            self.assertTrue(matcher.Excluded('foo.pyc'))
+            self.assertIs(ignore.ForDirectory(tmp_dir), matcher)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
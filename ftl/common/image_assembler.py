@@ -0,0 +1,226 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package stitches the layers of several images into one image.
+
+Chaining append.Layer once per layer re-parses and re-serializes the
+config and manifest for every layer. ImageAssembler instead collects the
+layer descriptors of all its inputs and writes the config and manifest of
+the result once.
+"""
+
+import copy
+import json
+import threading
+import weakref
+
+from containerregistry.client import docker_name
+from containerregistry.client.v2_2 import docker_digest
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import docker_image
+from containerregistry.transform.v2_2 import metadata
+
+from ftl.common import compression
+from ftl.common import tar_to_dockerimage
+
+_parsed = weakref.WeakKeyDictionary()
+_parsed_lock = threading.Lock()
+
+
+def _parse(img):
+    """The parsed (manifest, config) of img, parsed once per image."""
+    with _parsed_lock:
+        parsed = _parsed.get(img)
+    if parsed is None:
+        parsed = (json.loads(img.manifest()), json.loads(img.config_file()))
+        with _parsed_lock:
+            _parsed[img] = parsed
+    return parsed
+
+
+def Config(img):
+    """The parsed config of img. It is shared, so must not be modified."""
+    return _parse(img)[1]
+
+
+class _Layer(object):
+    """A layer of an input image: its manifest descriptor and diff_id."""
+
+    def __init__(self, image, descriptor, diff_id):
+        self.image = image
+        self.descriptor = descriptor
+        self.diff_id = diff_id
+
+
+class ImageAssembler(object):
+    """ImageAssembler appends the layers of images onto a base image.
+
+    Args:
+      base: the image the other images' layers are appended to; its own
+        layers, config and manifest are kept as they are.
+    """
+
+    def __init__(self, base):
+        self._base = base
+        self._images = []
+
+    def AddImage(self, img, overrides=None):
+        """Append the layers of img, in order.
+
+        Args:
+          img: the image whose layers are appended.
+          overrides: the metadata.Overrides applied to the config along
+            with the layers, as append.Layer would apply them.
+        """
+        self._images.append((img, overrides))
+
+    def Assemble(self):
+        """The image with the layers of every added image appended."""
+        manifest, config = _parse(self._base)
+        manifest = copy.deepcopy(manifest)
+        config = copy.deepcopy(config)
+        layers = []
+        for img, overrides in self._images:
+            img_manifest, img_config = _parse(img)
+            diff_ids = img_config.get('rootfs', {}).get('diff_ids', [])
+            img_layers = [
+                _Layer(img, dict(descriptor), diff_id)
+                for descriptor, diff_id in zip(img_manifest['layers'],
+                                               diff_ids)
+            ]
+            if not img_layers:
+                continue
+            overrides = overrides or metadata.Overrides()
+            config = metadata.Override(
+                config,
+                overrides.Override(
+                    created_by=docker_name.USER_AGENT,
+                    layers=[lyr.diff_id for lyr in img_layers]))
+            layers.extend(img_layers)
+        config_file = json.dumps(config, sort_keys=True)
+        manifest['layers'].extend(lyr.descriptor for lyr in layers)
+        if manifest.get('mediaType') == docker_http.OCI_MANIFEST_MIME:
+            # Keep an OCI base OCI; convert the appended docker layers.
+            manifest['config']['mediaType'] = compression.OCI_CONFIG_MIME
+            for lyr in manifest['layers']:
+                lyr['mediaType'] = compression.OCI_EQUIVALENTS.get(
+                    lyr['mediaType'], lyr['mediaType'])
+        manifest['config']['digest'] = docker_digest.SHA256(config_file)
+        manifest['config']['size'] = len(config_file)
+        manifest = tar_to_dockerimage.NormalizeMediaTypes(manifest)
+        return AssembledImage(self._base, layers, config_file,
+                              json.dumps(manifest, sort_keys=True))
+
+
+class AssembledImage(docker_image.DockerImage):
+    """AssembledImage is the result of an ImageAssembler.
+
+    Blobs are served by the image each layer came from, looked up by
+    digest, and only when they are read: layers of cache hits stay
+    references to the registry they were found in, so a push which mounts
+    or skips them never downloads them.
+    """
+
+    def __init__(self, base, layers, config_file, manifest):
+        self._base = base
+        self._config_file = config_file
+        self._manifest = manifest
+        self._digest_to_layer = {lyr.descriptor['digest']: lyr
+                                 for lyr in layers}
+        self._sizes = {
+            lyr['digest']: lyr['size']
+            for lyr in json.loads(manifest)['layers'] if 'size' in lyr
+        }
+        self._diff_id_to_digest_map = None
+
+    def fs_layers(self):
+        manifest = json.loads(self.manifest())
+        return [x['digest'] for x in reversed(manifest['layers'])]
+
+    def diff_ids(self):
+        cfg = json.loads(self.config_file())
+        return list(reversed(cfg.get('rootfs', {}).get('diff_ids', [])))
+
+    def config_blob(self):
+        manifest = json.loads(self.manifest())
+        return manifest['config']['digest']
+
+    def blob_set(self):
+        return set(self.fs_layers() + [self.config_blob()])
+
+    def digest(self):
+        return docker_digest.SHA256(self.manifest())
+
+    def media_type(self):
+        manifest = json.loads(self.manifest())
+        return manifest.get('mediaType', docker_http.OCI_MANIFEST_MIME)
+
+    def manifest(self):
+        return self._manifest
+
+    def config_file(self):
+        return self._config_file
+
+    def _source(self, digest):
+        lyr = self._digest_to_layer.get(digest)
+        return lyr.image if lyr else self._base
+
+    def blob_size(self, digest):
+        # Sizes come from the manifests, so no blob is fetched for them.
+        if digest == self.config_blob():
+            return len(self._config_file)
+        if digest in self._sizes:
+            return self._sizes[digest]
+        return self._source(digest).blob_size(digest)
+
+    def blob(self, digest):
+        if digest == self.config_blob():
+            return self._config_file
+        return self._source(digest).blob(digest)
+
+    def blob_path(self, digest):
+        source = self._source(digest)
+        if not hasattr(source, 'blob_path'):
+            return None
+        return source.blob_path(digest)
+
+    def uncompressed_blob(self, digest):
+        lyr = self._digest_to_layer.get(digest)
+        if lyr and lyr.descriptor['mediaType'] != docker_http.LAYER_MIME:
+            codec = compression.FromMediaType(lyr.descriptor['mediaType'])
+            return codec.Decompress(self.blob(digest))
+        return self._source(digest).uncompressed_blob(digest)
+
+    def _diff_id_to_digest(self, diff_id):
+        if self._diff_id_to_digest_map is None:
+            self._diff_id_to_digest_map = dict(
+                zip(self.diff_ids(), self.fs_layers()))
+        if diff_id in self._diff_id_to_digest_map:
+            return self._diff_id_to_digest_map[diff_id]
+        raise ValueError('Unmatched "diff_id": "%s"' % diff_id)
+
+    def layer(self, diff_id):
+        return self.blob(self._diff_id_to_digest(diff_id))
+
+    def uncompressed_layer(self, diff_id):
+        return self.uncompressed_blob(self._diff_id_to_digest(diff_id))
+
+    def __enter__(self):
+        """Open the image for reading."""
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        """Close the image."""
+
+    def __str__(self):
+        """A human-readable representation of the image."""
+        return str(type(self))
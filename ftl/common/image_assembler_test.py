@@ -0,0 +1,141 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for image_assembler.py"""
+
+import cStringIO
+import gzip
+import hashlib
+import json
+import unittest
+
+from containerregistry.client import docker_name
+
+import blob_store
+import compression
+import ftl_util
+import image_assembler
+import tar_to_dockerimage
+
+
+def _gzip(content):
+    buf = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+class _RemoteImage(object):
+    """An image whose blobs would have to be downloaded."""
+
+    def __init__(self, img):
+        self._img = img
+
+    def manifest(self):
+        return self._img.manifest()
+
+    def config_file(self):
+        return self._img.config_file()
+
+    def blob(self, digest):
+        raise AssertionError('downloaded %s' % digest)
+
+    blob_size = blob
+    uncompressed_blob = blob
+
+
+class ImageAssemblerTest(unittest.TestCase):
+    def setUp(self):
+        self.store = blob_store.Store()
+
+    def tearDown(self):
+        self.store.Close()
+
+    def _image(self, contents, raw=False, overrides=None):
+        layers = []
+        for content in contents:
+            if not raw:
+                layers.append(self.store.AddBlob(_gzip(content), content))
+                continue
+            path = self.store.TempPath()
+            with open(path, 'wb') as f:
+                f.write(content)
+            digest = 'sha256:' + hashlib.sha256(content).hexdigest()
+            layers.append(
+                self.store.Commit(path, digest, digest, len(content),
+                                  len(content), compression.Uncompressed()))
+        return tar_to_dockerimage.FromFSImage(
+            layers=layers, overrides=overrides or {}, store=self.store)
+
+    def test_layers_in_order(self):
+        base = self._image(['base'])
+        first = self._image(['one', 'two'])
+        second = self._image(['three'], overrides={'Entrypoint': ['run']})
+        img = ftl_util.AppendLayersIntoImage([base, first, second])
+
+        diff_ids = [
+            'sha256:' + hashlib.sha256(c).hexdigest()
+            for c in ['base', 'one', 'two', 'three']
+        ]
+        self.assertEqual(img.diff_ids(), list(reversed(diff_ids)))
+        manifest = json.loads(img.manifest())
+        self.assertEqual(
+            [lyr['digest'] for lyr in manifest['layers']],
+            list(reversed(img.fs_layers())))
+        self.assertEqual(manifest['config']['digest'],
+                         'sha256:' + hashlib.sha256(
+                             img.config_file()).hexdigest())
+        self.assertEqual(manifest['config']['size'], len(img.config_file()))
+        config = json.loads(img.config_file())
+        self.assertEqual(config['config']['Entrypoint'], ['run'])
+        # Appended layers are recorded in the history as append.Layer did.
+        self.assertEqual(
+            [h['created_by'] for h in config['history']][-3:],
+            [docker_name.USER_AGENT] * 3)
+        for diff_id, content in zip(diff_ids, ['base', 'one', 'two',
+                                               'three']):
+            self.assertEqual(img.uncompressed_layer(diff_id), content)
+
+    def test_media_types_kept(self):
+        base = self._image(['base'])
+        raw = self._image(['raw'], raw=True)
+        img = ftl_util.AppendLayersIntoImage([base, raw])
+
+        manifest = json.loads(img.manifest())
+        self.assertEqual(manifest['layers'][-1]['mediaType'],
+                         compression.DOCKER_LAYER_TAR_MIME)
+        diff_id = 'sha256:' + hashlib.sha256('raw').hexdigest()
+        self.assertEqual(img.uncompressed_layer(diff_id), 'raw')
+        self.assertEqual(img.layer(diff_id), 'raw')
+
+    def test_layers_not_downloaded(self):
+        base = _RemoteImage(self._image(['base']))
+        cached = _RemoteImage(self._image(['cached']))
+        built = self._image(['built'])
+        img = ftl_util.AppendLayersIntoImage([base, cached, built])
+
+        self.assertEqual(len(img.fs_layers()), 3)
+        for digest in img.fs_layers():
+            self.assertGreater(img.blob_size(digest), 0)
+        built_digest = img.fs_layers()[0]
+        self.assertEqual(img.uncompressed_blob(built_digest), 'built')
+        self.assertRaises(AssertionError, img.blob, img.fs_layers()[1])
+
+    def test_config_parsed_once(self):
+        img = self._image(['one'])
+        self.assertIs(image_assembler.Config(img),
+                      image_assembler.Config(img))
+
+
+if __name__ == '__main__':
+    unittest.main()
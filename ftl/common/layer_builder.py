@@ -12,44 +12,499 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import datetime
+import base64
+import contextlib
+import cStringIO
+import hashlib
+import json
 import logging
+import os
+import zlib
 
+import concurrent.futures
+
+from ftl.common import app_split
 from ftl.common import constants
 from ftl.common import ftl_util
+from ftl.common import image_assembler
+from ftl.common import layer_writer
 from ftl.common import single_layer_image
 from ftl.common import tar_to_dockerimage
+from ftl.common import tree_hash
+
+
+class AppLayerBuilder(single_layer_image.CacheableLayerBuilder):
+    """AppLayerBuilder builds the layer of an application directory.
 
+    When a cache is given the layer is keyed by the tree_hash of the
+    directory, so an unchanged directory is never re-archived or pushed.
+    """
 
-class AppLayerBuilder(single_layer_image.BaseLayerBuilder):
     def __init__(self,
                  directory,
                  destination_path=constants.DEFAULT_DESTINATION_PATH,
                  entrypoint=constants.DEFAULT_ENTRYPOINT,
-                 exposed_ports=None):
+                 exposed_ports=None,
+                 layer_options=None,
+                 cache_key_version=None,
+                 cache=None,
+                 tree_index=None):
+        super(AppLayerBuilder, self).__init__()
         self._directory = directory
         self._destination_path = destination_path
         self._entrypoint = entrypoint
         self._exposed_ports = exposed_ports
+        self._layer_options = layer_options
+        self._cache_key_version = cache_key_version
+        self._cache = cache
+        self._tree_index = tree_index
+        self._tree = None
 
     def GetCacheKeyRaw(self):
-        return None
+        return '%s %s' % (self._hash_tree(), self._GetConfigKeyRaw())
+
+    def _hash_tree(self):
+        if self._tree is None:
+            self._tree = tree_hash.TreeHash(
+                self._directory, index=self._tree_index)
+            with ftl_util.Timing('hashing_app_directory'):
+                self._tree_digest = self._tree.Digest()
+        return self._tree_digest
+
+    def _GetConfigKeyRaw(self):
+        """The parts of the cache key other than the directory contents."""
+        options = self._layer_options or layer_writer.Options()
+        return '%s %s %s %s %s %s %s' % (
+            self._destination_path, self._entrypoint, self._exposed_ports,
+            options.codec, options.reproducible, options.dedup,
+            self._cache_key_version)
 
     def BuildLayer(self):
         """Override."""
+        cached_img = None
+        if self._cache:
+            key = self.GetCacheKey()
+            with ftl_util.Timing('checking_cached_app_layer'):
+                cached_img = self._cache.Get(key)
+                self._log_cache_result(cached_img is not None, key)
+        if cached_img:
+            self.SetImage(cached_img)
+            return
+        self._build_layer()
+        if self._cache:
+            with ftl_util.Timing('uploading_app_layer'):
+                self._cache.Set(key, self.GetImage())
+
+    def _build_layer(self):
         with ftl_util.Timing('Building app layer'):
-            gz, tar = ftl_util.zip_dir_to_layer_sha(self._directory,
-                                                    self._destination_path)
-
-            overrides_dct = {
-                'created': str(datetime.date.today()) + 'T00:00:00Z'
-            }
-            if self._entrypoint:
-                overrides_dct['Entrypoint'] = self._entrypoint
-            if self._exposed_ports:
-                overrides_dct['ExposedPorts'] = self._exposed_ports
-            if self._exposed_ports:
-                overrides_dct['ExposedPorts'] = self._exposed_ports
+            lyr = ftl_util.zip_dir_to_layer(
+                self._directory,
+                self._destination_path,
+                options=self._layer_options)
             logging.info('Finished gzipping tarfile.')
-            self._img = tar_to_dockerimage.FromFSImage([gz], [tar],
-                                                       overrides_dct)
+            self._img = tar_to_dockerimage.FromFSImage(
+                layers=[lyr], overrides=self._overrides())
+
+    def _overrides(self, labels=None):
+        overrides_dct = ftl_util.generate_overrides(
+            False, options=self._layer_options)
+        if labels:
+            overrides_dct['Labels'] = dict(
+                overrides_dct.get('Labels', {}), **labels)
+        if self._entrypoint:
+            overrides_dct['Entrypoint'] = self._entrypoint
+        if self._exposed_ports:
+            overrides_dct['ExposedPorts'] = self._exposed_ports
+        return overrides_dct
+
+    def _log_cache_result(self, hit, key):
+        if hit:
+            cache_str = constants.PHASE_1_CACHE_HIT
+        else:
+            cache_str = constants.PHASE_1_CACHE_MISS
+        logging.info(
+            cache_str.format(
+                key_version=constants.CACHE_KEY_VERSION,
+                language='APP',
+                key=key))
+
+
+class DeltaAppLayerBuilder(AppLayerBuilder):
+    """DeltaAppLayerBuilder builds the app as a chain of layers.
+
+    The chain starts with a full layer of the directory. Each later build
+    of a changed directory appends a delta layer holding only the added
+    and changed entries, plus whiteouts for removed ones. The chain is
+    cached under a key naming the app rather than its contents, and it
+    carries the tree_hash entries of its last build in a config label so
+    the next delta can be computed without downloading any layer.
+
+    Once the chain holds max_depth layers, or its deltas add up to more
+    than max_size bytes, it is compacted back into a single full layer.
+
+    Args:
+      chain_name: identifies the app across builds, e.g. the target
+        repository.
+      max_depth: the most layers a chain may hold.
+      max_size: the most bytes the deltas of a chain may hold.
+    """
+
+    def __init__(self,
+                 directory,
+                 destination_path=constants.DEFAULT_DESTINATION_PATH,
+                 entrypoint=constants.DEFAULT_ENTRYPOINT,
+                 exposed_ports=None,
+                 layer_options=None,
+                 cache_key_version=None,
+                 cache=None,
+                 tree_index=None,
+                 chain_name=None,
+                 max_depth=constants.APP_DELTA_MAX_DEPTH,
+                 max_size=constants.APP_DELTA_MAX_SIZE):
+        super(DeltaAppLayerBuilder, self).__init__(
+            directory,
+            destination_path=destination_path,
+            entrypoint=entrypoint,
+            exposed_ports=exposed_ports,
+            layer_options=layer_options,
+            cache_key_version=cache_key_version,
+            cache=cache,
+            tree_index=tree_index)
+        self._chain_name = chain_name
+        self._max_depth = max_depth
+        self._max_size = max_size
+
+    def GetChainKey(self):
+        return hashlib.sha256('delta-chain %s %s' % (
+            self._chain_name, self._GetConfigKeyRaw())).hexdigest()
+
+    def BuildLayer(self):
+        """Override."""
+        if not self._cache:
+            return super(DeltaAppLayerBuilder, self).BuildLayer()
+        key = self.GetCacheKey()
+        with ftl_util.Timing('checking_cached_app_layer'):
+            cached_img = self._cache.Get(key)
+            self._log_cache_result(cached_img is not None, key)
+        if cached_img:
+            self.SetImage(cached_img)
+            return
+
+        chain_key = self.GetChainKey()
+        with ftl_util.Timing('checking_cached_app_chain'):
+            head = self._cache.Get(chain_key)
+        entries = self._tree.Entries()
+        previous = _chain_entries(head) if head else None
+        if previous is None or self._should_compact(head):
+            logging.info('Building full app layer')
+            self._build_layer()
+            self._img = tar_to_dockerimage.FromFSImage(
+                layers=self._img._layers,
+                overrides=self._overrides(
+                    labels={constants.APP_ENTRIES_LABEL:
+                            _encode_entries(entries)}))
+        else:
+            self._build_delta(head, previous, entries)
+        with ftl_util.Timing('uploading_app_layer'):
+            self._cache.Set(key, self.GetImage())
+            self._cache.Set(chain_key, self.GetImage())
+
+    def _should_compact(self, head):
+        layers = json.loads(head.manifest())['layers']
+        delta_size = sum(lyr['size'] for lyr in layers[1:])
+        if len(layers) >= self._max_depth or delta_size > self._max_size:
+            logging.info('Compacting app chain of %d layers, %d delta bytes',
+                         len(layers), delta_size)
+            return True
+        return False
+
+    def _build_delta(self, head, previous, entries):
+        changed = sorted(path for path, signature in entries.iteritems()
+                         if previous.get(path) != signature)
+        # A whiteout of a removed directory covers everything below it.
+        removed = [
+            path for path in sorted(previous) if path not in entries and (
+                not os.path.dirname(path) or os.path.dirname(path) in entries)
+        ]
+        logging.info('Building app delta layer: %d changed, %d removed',
+                     len(changed), len(removed))
+        with ftl_util.Timing('Building app delta layer'):
+            with layer_writer.LayerWriter(
+                    options=self._layer_options) as writer:
+                for path in removed:
+                    writer.AddWhiteout(self._destination_path, path)
+                for path in changed:
+                    writer.AddPath(self._directory, self._destination_path,
+                                   path)
+            lyr = writer.Close()
+        # The labels are merged over the head's, so the creation time label
+        # of a reproducible config must be replaced along with the entries.
+        labels = {constants.APP_ENTRIES_LABEL: _encode_entries(entries)}
+        layer_overrides = self._overrides(labels=labels)
+        delta = tar_to_dockerimage.FromFSImage(
+            layers=[lyr], overrides=dict(layer_overrides))
+        overrides = ftl_util.CfgDctToOverrides(
+            json.loads(delta.config_file()), labels=layer_overrides['Labels'])
+        # The delta stays on disk, where its digest was computed when it
+        # was written.
+        assembler = image_assembler.ImageAssembler(head)
+        assembler.AddImage(delta, overrides)
+        self._img = assembler.Assemble()
+
+
+class SplitAppLayerBuilder(AppLayerBuilder):
+    """SplitAppLayerBuilder builds the app as one layer per partition.
+
+    The directory is partitioned by an app_split.Policy. Each partition is
+    cached under the entries it holds, and the partitions are looked up,
+    built and uploaded in parallel, so a change only rebuilds and pushes
+    the partitions it touches.
+
+    Args:
+      patterns: the --app-layer-split partitions, see app_split.Policy.
+      history: an optional app_split.ChangeHistory frequently changing
+        top-level entries are learned from.
+      app_name: identifies the app in history across builds.
+    """
+
+    def __init__(self,
+                 directory,
+                 destination_path=constants.DEFAULT_DESTINATION_PATH,
+                 entrypoint=constants.DEFAULT_ENTRYPOINT,
+                 exposed_ports=None,
+                 layer_options=None,
+                 cache_key_version=None,
+                 cache=None,
+                 tree_index=None,
+                 patterns=None,
+                 history=None,
+                 app_name=None):
+        super(SplitAppLayerBuilder, self).__init__(
+            directory,
+            destination_path=destination_path,
+            entrypoint=entrypoint,
+            exposed_ports=exposed_ports,
+            layer_options=layer_options,
+            cache_key_version=cache_key_version,
+            cache=cache,
+            tree_index=tree_index)
+        self._patterns = patterns
+        self._history = history
+        self._app_name = app_name
+
+    def BuildLayer(self):
+        """Override."""
+        self._hash_tree()
+        entries = self._tree.Entries()
+        directories = self._tree.Directories()
+        hot = self._history.Hot(self._app_name) if self._history else None
+        partitions = app_split.Policy(self._patterns, hot).Partition(
+            entries, lambda path: path in directories)
+        logging.info('Splitting app into %d layers', len(partitions))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(partitions)) as executor:
+            imgs = list(
+                executor.map(
+                    lambda partition: self._build_partition(
+                        partition[0], partition[1], entries), partitions))
+        if self._history:
+            self._history.Record(self._app_name, entries)
+        self._img = ftl_util.AppendLayersIntoImage(imgs)
+
+    def _build_partition(self, name, paths, entries):
+        members = set(paths)
+        if name != app_split.REMAINDER:
+            # Give every entry its parent directories, so the layer does
+            # not depend on the order layers are applied in.
+            for path in paths:
+                parent = os.path.dirname(path)
+                while parent:
+                    members.add(parent)
+                    parent = os.path.dirname(parent)
+        sha256 = hashlib.sha256()
+        for path in sorted(members):
+            sha256.update('%s %s\n' % (path, entries[path]))
+        key = hashlib.sha256('%s %s %s' % (
+            name, sha256.hexdigest(), self._GetConfigKeyRaw())).hexdigest()
+        if self._cache:
+            with ftl_util.Timing('checking_cached_app_layer %s' % name):
+                cached_img = self._cache.Get(key)
+                self._log_cache_result(cached_img is not None, key)
+            if cached_img:
+                return cached_img
+        with ftl_util.Timing('Building app layer %s' % name):
+            with layer_writer.LayerWriter(
+                    options=self._layer_options) as writer:
+                if name == app_split.REMAINDER:
+                    writer.AddPath(self._directory, self._destination_path,
+                                   '')
+                for path in sorted(members):
+                    writer.AddPath(self._directory, self._destination_path,
+                                   path)
+            img = tar_to_dockerimage.FromFSImage(
+                layers=[writer.Close()], overrides=self._overrides())
+        if self._cache:
+            with ftl_util.Timing('uploading_app_layer %s' % name):
+                self._cache.Set(key, img)
+        return img
+
+
+def _encode_entries(entries):
+    return base64.b64encode(zlib.compress(json.dumps(entries, sort_keys=True)))
+
+
+def _chain_entries(img):
+    """The tree_hash entries recorded in a cached chain image, or None."""
+    cfg = json.loads(img.config_file())
+    labels = (cfg.get('config') or {}).get('Labels') or {}
+    encoded = labels.get(constants.APP_ENTRIES_LABEL)
+    if not encoded:
+        return None
+    try:
+        return json.loads(zlib.decompress(base64.b64decode(encoded)))
+    except (TypeError, ValueError, zlib.error):
+        logging.warning('Ignoring unreadable app chain state')
+        return None
+
+
+def _open_uncompressed_layer(image, diff_id):
+    """The uncompressed layer diff_id of image as a file object, in a
+    context manager. Layers on local disk are decompressed as they are
+    read; others are read into memory."""
+    if hasattr(image, 'open_uncompressed_layer'):
+        return image.open_uncompressed_layer(diff_id)
+    return contextlib.closing(
+        cStringIO.StringIO(image.uncompressed_layer(diff_id)))
+
+
+def package_buckets(packages, count):
+    """Group package layers into at most count buckets.
+
+    A package always lands in the bucket its name hashes to, so adding,
+    removing or upgrading a package changes only the members of its own
+    bucket.
+
+    Args:
+      packages: (name, cache_key, image) tuples, one per package layer.
+      count: the number of buckets.
+    Returns:
+      the non-empty buckets in order, each a list of packages sorted by
+      name.
+    """
+    buckets = [[] for _ in range(count)]
+    for package in packages:
+        index = int(hashlib.sha256(package[0]).hexdigest()[:8], 16) % count
+        buckets[index].append(package)
+    return [
+        sorted(bucket, key=lambda package: package[0]) for bucket in buckets
+        if bucket
+    ]
+
+
+def coalesce_packages(packages,
+                      max_layers,
+                      layer_options=None,
+                      cache_key_version=None,
+                      cache=None):
+    """The images of package layers, coalesced into at most max_layers.
+
+    Without a limit, or below it, the package images are returned as they
+    are. Otherwise each bucket of package_buckets is merged into a single
+    layer by a PackageBucketLayerBuilder; buckets are built in parallel.
+
+    Args:
+      packages: (name, cache_key, image) tuples, one per package layer.
+      max_layers: the --max-package-layers limit, or None.
+    """
+    packages = sorted(packages, key=lambda package: package[0])
+    if not max_layers or len(packages) <= max_layers:
+        return [image for _, _, image in packages]
+    buckets = package_buckets(packages, max_layers)
+    logging.info('Coalescing %d package layers into %d layers',
+                 len(packages), len(buckets))
+    builders = [
+        PackageBucketLayerBuilder(
+            bucket,
+            layer_options=layer_options,
+            cache_key_version=cache_key_version,
+            cache=cache) for bucket in buckets
+    ]
+    with ftl_util.Timing('coalescing_package_layers'):
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=constants.THREADS) as executor:
+            list(executor.map(lambda b: b.BuildLayer(), builders))
+    return [b.GetImage() for b in builders]
+
+
+class PackageBucketLayerBuilder(single_layer_image.CacheableLayerBuilder):
+    """PackageBucketLayerBuilder merges package layers into one layer.
+
+    The bucket is cached under the cache keys of its members, so it is
+    only rebuilt when a member changes. The members are the images of
+    the per-package layers, which stay cached on their own.
+
+    Args:
+      packages: the (name, cache_key, image) members, in layer order.
+    """
+
+    def __init__(self,
+                 packages,
+                 layer_options=None,
+                 cache_key_version=None,
+                 cache=None):
+        super(PackageBucketLayerBuilder, self).__init__()
+        self._packages = packages
+        self._layer_options = layer_options
+        self._cache_key_version = cache_key_version
+        self._cache = cache
+
+    def GetCacheKeyRaw(self):
+        options = self._layer_options or layer_writer.Options()
+        members = ' '.join(
+            '%s:%s' % (name, key) for name, key, _ in self._packages)
+        return 'bucket %s %s %s %s %s' % (members, options.codec,
+                                          options.reproducible,
+                                          options.dedup,
+                                          self._cache_key_version)
+
+    def BuildLayer(self):
+        """Override."""
+        cached_img = None
+        if self._cache:
+            key = self.GetCacheKey()
+            with ftl_util.Timing('checking_cached_package_bucket_layer'):
+                cached_img = self._cache.Get(key)
+                self._log_cache_result(cached_img is not None, key)
+        if cached_img:
+            self.SetImage(cached_img)
+            return
+        self._build_layer()
+        if self._cache:
+            with ftl_util.Timing('uploading_package_bucket_layer'):
+                self._cache.Set(key, self.GetImage())
+
+    def _build_layer(self):
+        with ftl_util.Timing('Building package bucket layer'):
+            with layer_writer.LayerWriter(
+                    options=self._layer_options) as writer:
+                for _, _, image in self._packages:
+                    for diff_id in reversed(image.diff_ids()):
+                        with _open_uncompressed_layer(image,
+                                                      diff_id) as f:
+                            writer.AddTarStream(f)
+            lyr = writer.Close()
+        overrides = ftl_util.generate_overrides(
+            False, options=self._layer_options)
+        self._img = tar_to_dockerimage.FromFSImage(
+            layers=[lyr], overrides=overrides)
+
+    def _log_cache_result(self, hit, key):
+        if hit:
+            cache_str = constants.PHASE_1_CACHE_HIT
+        else:
+            cache_str = constants.PHASE_1_CACHE_MISS
+        logging.info(
+            cache_str.format(
+                key_version=constants.CACHE_KEY_VERSION,
+                language='PACKAGES (%d)' % len(self._packages),
+                key=key))
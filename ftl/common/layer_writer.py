@@ -0,0 +1,401 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package writes directories into compressed layer blobs on disk."""
+
+import grp
+import hashlib
+import logging
+import os
+import pwd
+import stat
+import tarfile
+import time
+
+from ftl.common import blob_store
+from ftl.common import compression
+from ftl.common import constants
+from ftl.common import ignore
+
+
+class Options(object):
+    """Options controls how layer blobs are written.
+
+    Args:
+      codec: the compression.Codec layers are compressed with, gzip level 1
+        by default.
+      compression_threads: the number of threads compressing each layer.
+        Gzip layers are written in blocks whatever the number, so their
+        digest does not depend on it.
+      tuner: an optional tuning.Tuner choosing the codec of each layer
+        instead of codec.
+      reproducible: when True the mtime, ownership and mode of every entry
+        are normalized, so identical directory contents always produce an
+        identical layer digest.
+      dedup: when True hardlinked files, and files with identical content,
+        mode and owner, are stored once; later copies become hardlink
+        entries pointing at the first, and take its mtime.
+      store: the blob_store.Store layers are written to, the process wide
+        store by default.
+    """
+
+    def __init__(self,
+                 codec=None,
+                 compression_threads=1,
+                 tuner=None,
+                 reproducible=False,
+                 dedup=False,
+                 store=None):
+        self.codec = codec or compression.Gzip()
+        self.compression_threads = compression_threads
+        self.tuner = tuner
+        self.reproducible = reproducible
+        self.dedup = dedup
+        self.store = store
+
+    @classmethod
+    def FromArgs(cls, args, tuner=None, store=None):
+        return cls(
+            codec=compression.FromName(args.compression,
+                                       args.compression_level),
+            compression_threads=args.compression_threads,
+            tuner=tuner,
+            reproducible=args.reproducible,
+            dedup=args.dedup_files,
+            store=store)
+
+    def Codec(self):
+        """The codec the next layer is written with."""
+        if self.tuner:
+            return self.tuner.Choose()
+        return self.codec
+
+
+class _DigestingFile(object):
+    """A write-only file object which hashes and counts what passes through.
+
+    When fileobj is None the data is only hashed and counted.
+    """
+
+    def __init__(self, fileobj=None):
+        self._fileobj = fileobj
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self._size += len(data)
+        if self._fileobj:
+            self._fileobj.write(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        if self._fileobj:
+            self._fileobj.flush()
+
+    def digest(self):
+        return 'sha256:' + self._sha256.hexdigest()
+
+    def size(self):
+        return self._size
+
+
+def _normalized_mode(tarinfo, mode):
+    """The mode of an entry in a reproducible layer.
+
+    Only whether a file is executable survives; owner, group and umask
+    differences between build machines do not.
+    """
+    if tarinfo.issym():
+        return 0777
+    if tarinfo.isdir() or mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+        return 0755
+    return 0644
+
+
+class _DigestingReader(object):
+    """A read-only file object which hashes what is read through it."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        reader = _DigestingReader(f)
+        while reader.read(1024 * 1024):
+            pass
+    return reader.hexdigest()
+
+
+class LayerWriter(object):
+    """LayerWriter streams a tarball of directory contents into a
+    compressed blob on disk.
+
+    The directory is walked once; the uncompressed tar stream is hashed
+    for the diff_id on its way into the compressor and the compressed
+    stream is hashed for the digest on its way to disk, so neither the
+    tar nor the compressed blob is ever held in memory.
+    """
+
+    def __init__(self, options=None, store=None, ignore_paths=None):
+        self._options = options or Options()
+        self._store = store or self._options.store or blob_store.Default()
+        self._path = self._store.TempPath()
+        self._ignore = ignore_paths
+        self._codec = self._options.Codec()
+        self._start = time.time()
+        self._out = open(self._path, 'wb')
+        self._c_stream = _DigestingFile(self._out)
+        self._gz = self._codec.Compressor(self._c_stream,
+                                          self._options.compression_threads)
+        self._u_stream = _DigestingFile(self._gz)
+        self._tar = tarfile.open(
+            fileobj=self._u_stream, mode='w', format=tarfile.GNU_FORMAT)
+        self._owners = {}
+        self._groups = {}
+        self._inodes = {}
+        self._stored = {}
+        self._layer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, unused_value, unused_traceback):
+        if exc_type is None:
+            self.Close()
+        else:
+            self.Abort()
+
+    def AddDirectory(self, directory, destination_path, alter_symlinks=True):
+        """Add the contents of directory to the layer.
+
+        Entries are rooted at destination_path/. in the same way
+        `tar --transform 's,^,destination_path/,' .` names them. Paths are
+        left out as the .ftlignore of directory says, unless the writer
+        was given an ignore.Ignore of its own.
+
+        Args:
+          directory: the local directory to archive.
+          destination_path: the path the contents are placed under.
+          alter_symlinks: when False symlink targets are prefixed with
+            destination_path as well.
+        """
+        prefix = destination_path.rstrip('/') + '/.'
+        self._add(directory, prefix, destination_path if not alter_symlinks
+                  else None)
+        self._walk(directory, prefix, destination_path if not alter_symlinks
+                   else None, self._ignore or ignore.ForDirectory(directory),
+                   '')
+
+    def AddPath(self,
+                directory,
+                destination_path,
+                relative_path,
+                alter_symlinks=True):
+        """Add a single entry of directory, without any of its children.
+
+        The entry is named as AddDirectory would name it; an empty
+        relative_path adds the directory itself.
+        """
+        arcname = destination_path.rstrip('/') + '/.'
+        if relative_path:
+            arcname += '/' + relative_path
+        self._add(
+            os.path.join(directory, relative_path), arcname,
+            destination_path if not alter_symlinks else None)
+
+    def AddTarStream(self, fileobj):
+        """Copy every entry of an uncompressed tar stream into the layer.
+
+        Entries keep their names, metadata and hardlink targets, so the
+        entries of several layers can be merged into one.
+        """
+        src = tarfile.open(fileobj=fileobj, mode='r|')
+        try:
+            for tarinfo in src:
+                if tarinfo.isreg():
+                    self._tar.addfile(tarinfo, src.extractfile(tarinfo))
+                else:
+                    self._tar.addfile(tarinfo)
+        finally:
+            src.close()
+
+    def AddWhiteout(self, destination_path, relative_path):
+        """Mark relative_path as deleted from the layers below."""
+        parent, name = os.path.split(relative_path)
+        arcdir = destination_path.rstrip('/') + '/.'
+        if parent:
+            arcdir += '/' + parent
+        tarinfo = tarfile.TarInfo((arcdir + '/.wh.' + name).lstrip('/'))
+        tarinfo.mode = 0644
+        if not self._options.reproducible:
+            tarinfo.mtime = int(time.time())
+        self._tar.addfile(tarinfo)
+
+    def _walk(self, directory, arcdir, link_prefix, ignore_paths, relative):
+        # Entries are always sorted so the layer does not depend on the
+        # order the filesystem lists them in.
+        for name in sorted(os.listdir(directory)):
+            relative_path = relative + name
+            path = os.path.join(directory, name)
+            arcname = arcdir + '/' + name
+            if ignore_paths.Excluded(relative_path):
+                # Excluded subtrees are skipped without being stat-ed,
+                # unless a ! pattern may re-include something below them.
+                if (ignore_paths.CanPrune(relative_path)
+                        or not os.path.isdir(path)
+                        or os.path.islink(path)):
+                    continue
+            tarinfo = self._add(path, arcname, link_prefix)
+            if tarinfo is not None and tarinfo.isdir():
+                self._walk(path, arcname, link_prefix, ignore_paths,
+                           relative_path + '/')
+
+    def _add(self, path, arcname, link_prefix):
+        st = os.lstat(path)
+        tarinfo = self._tarinfo(path, arcname, st)
+        if tarinfo is None:
+            return None
+        if tarinfo.issym() and link_prefix is not None:
+            tarinfo.linkname = '%s/%s' % (link_prefix, tarinfo.linkname)
+        if tarinfo.isreg() and self._options.dedup:
+            self._add_deduplicated(path, st, tarinfo)
+        elif tarinfo.isreg():
+            with open(path, 'rb') as f:
+                self._tar.addfile(tarinfo, f)
+        else:
+            self._tar.addfile(tarinfo)
+        return tarinfo
+
+    def _add_deduplicated(self, path, st, tarinfo):
+        """Add a regular file, or a hardlink to an earlier copy of it.
+
+        Copies are only looked for among earlier files of the same size,
+        mode and owner, so a file is read twice only if one of those
+        exists. Copies from separate installs rarely share an mtime, so it
+        is not compared; a hardlink shares the inode of its target, so the
+        entry is recorded with the mtime of the target. The content hash
+        of every stored file is taken while it streams into the tar, so
+        earlier files are never re-read.
+        """
+        target = None
+        if st.st_nlink > 1:
+            target = self._inodes.setdefault((st.st_dev, st.st_ino),
+                                             (tarinfo.name, tarinfo.mtime))
+            if target[0] == tarinfo.name:
+                target = None
+        metadata = (tarinfo.size, tarinfo.mode, tarinfo.uid, tarinfo.gid)
+        stored = self._stored.setdefault(metadata, {})
+        if target is None and stored and tarinfo.size > 0:
+            target = stored.get(_file_digest(path))
+        if target is not None:
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname, tarinfo.mtime = target
+            tarinfo.size = 0
+            self._tar.addfile(tarinfo)
+            return
+        with open(path, 'rb') as f:
+            reader = _DigestingReader(f)
+            self._tar.addfile(tarinfo, reader)
+        stored.setdefault(reader.hexdigest(), (tarinfo.name, tarinfo.mtime))
+
+    def _tarinfo(self, path, arcname, st):
+        # Hardlinks are dereferenced unless deduplicating, so every regular
+        # file is stored with its full contents.
+        tarinfo = tarfile.TarInfo(arcname.lstrip('/'))
+        mode = st.st_mode
+        if stat.S_ISREG(mode):
+            tarinfo.type = tarfile.REGTYPE
+            tarinfo.size = st.st_size
+        elif stat.S_ISDIR(mode):
+            tarinfo.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            tarinfo.type = tarfile.SYMTYPE
+            tarinfo.linkname = os.readlink(path)
+        elif stat.S_ISFIFO(mode):
+            tarinfo.type = tarfile.FIFOTYPE
+        elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+            tarinfo.type = (tarfile.CHRTYPE
+                            if stat.S_ISCHR(mode) else tarfile.BLKTYPE)
+            tarinfo.devmajor = os.major(st.st_rdev)
+            tarinfo.devminor = os.minor(st.st_rdev)
+        else:
+            logging.info('%s: socket ignored', path)
+            return None
+        if self._options.reproducible:
+            tarinfo.mode = _normalized_mode(tarinfo, stat.S_IMODE(mode))
+            tarinfo.mtime = constants.REPRODUCIBLE_MTIME
+            return tarinfo
+        tarinfo.mode = stat.S_IMODE(mode)
+        tarinfo.uid = st.st_uid
+        tarinfo.gid = st.st_gid
+        tarinfo.uname = self._owner(st.st_uid)
+        tarinfo.gname = self._group(st.st_gid)
+        tarinfo.mtime = int(st.st_mtime)
+        return tarinfo
+
+    def _owner(self, uid):
+        if uid not in self._owners:
+            try:
+                self._owners[uid] = pwd.getpwuid(uid)[0]
+            except KeyError:
+                self._owners[uid] = ''
+        return self._owners[uid]
+
+    def _group(self, gid):
+        if gid not in self._groups:
+            try:
+                self._groups[gid] = grp.getgrgid(gid)[0]
+            except KeyError:
+                self._groups[gid] = ''
+        return self._groups[gid]
+
+    def Close(self):
+        """Finish the blob and return its blob_store.Entry."""
+        if self._layer is None:
+            self._tar.close()
+            self._gz.close()
+            self._out.close()
+            self._layer = self._store.Commit(
+                self._path, self._c_stream.digest(), self._u_stream.digest(),
+                self._c_stream.size(), self._u_stream.size(), self._codec)
+            if self._options.tuner:
+                self._options.tuner.Record(self._codec, self._layer,
+                                           time.time() - self._start)
+        return self._layer
+
+    def Abort(self):
+        """Discard a partially written blob."""
+        self._out.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+def FromDirectory(directory, destination_path, alter_symlinks=True,
+                  options=None, store=None):
+    """Write directory into a new layer blob and return its Entry."""
+    with LayerWriter(options=options, store=store) as writer:
+        writer.AddDirectory(directory, destination_path, alter_symlinks)
+    return writer.Close()
@@ -0,0 +1,166 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for layer_writer.py"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import layer_writer
+
+
+class LayerWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files = {
+            'foo': 'foo_contents',
+            'baz/bat': 'bat_contents',
+        }
+        for name, contents in self.files.iteritems():
+            path = os.path.join(self.tmp_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(contents)
+        with open(os.path.join(self.tmp_dir, 'foo.pyc'), 'w') as f:
+            f.write('bytecode')
+        os.symlink('foo', os.path.join(self.tmp_dir, 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_digests(self):
+        lyr = layer_writer.FromDirectory(self.tmp_dir, 'srv')
+        try:
+            with open(lyr.path, 'rb') as f:
+                blob = f.read()
+            with gzip.open(lyr.path, 'rb') as f:
+                u_blob = f.read()
+        finally:
+            os.remove(lyr.path)
+        self.assertEqual(lyr.digest,
+                         'sha256:' + hashlib.sha256(blob).hexdigest())
+        self.assertEqual(lyr.diff_id,
+                         'sha256:' + hashlib.sha256(u_blob).hexdigest())
+        self.assertEqual(lyr.size, len(blob))
+        self.assertEqual(lyr.uncompressed_size, len(u_blob))
+
+    def test_contents(self):
+        lyr = layer_writer.FromDirectory(self.tmp_dir, 'srv')
+        try:
+            with tarfile.open(lyr.path, 'r:gz') as tf:
+                names = tf.getnames()
+                for p, contents in self.files.iteritems():
+                    tar_path = os.path.join('srv/.', p)
+                    self.assertEqual(tf.extractfile(tar_path).read(),
+                                     contents)
+                self.assertEqual(tf.getmember('srv/./link').linkname, 'foo')
+        finally:
+            os.remove(lyr.path)
+        self.assertIn('srv/.', names)
+        self.assertIn('srv/./baz', names)
+        self.assertNotIn('srv/./foo.pyc', names)
+
+    def test_ftlignore(self):
+        os.makedirs(os.path.join(self.tmp_dir, '.git', 'objects'))
+        with open(os.path.join(self.tmp_dir, '.ftlignore'), 'w') as f:
+            f.write('.git\nbaz\n!baz/bat\n')
+        lyr = layer_writer.FromDirectory(self.tmp_dir, 'srv')
+        try:
+            with tarfile.open(lyr.path, 'r:gz') as tf:
+                names = tf.getnames()
+        finally:
+            os.remove(lyr.path)
+        self.assertNotIn('srv/./.git', names)
+        self.assertNotIn('srv/./.git/objects', names)
+        self.assertIn('srv/./baz/bat', names)
+        self.assertIn('srv/./foo', names)
+
+    def test_reproducible(self):
+        options = layer_writer.Options(reproducible=True)
+        first = layer_writer.FromDirectory(
+            self.tmp_dir, 'srv', options=options)
+        foo = os.path.join(self.tmp_dir, 'foo')
+        os.utime(foo, (1234567890, 1234567890))
+        os.chmod(foo, 0664)
+        second = layer_writer.FromDirectory(
+            self.tmp_dir, 'srv', options=options)
+        try:
+            with tarfile.open(second.path, 'r:gz') as tf:
+                member = tf.getmember('srv/./foo')
+        finally:
+            # Identical digests share a single blob in the store.
+            os.remove(second.path)
+        self.assertEqual(first.digest, second.digest)
+        self.assertEqual(member.mtime, 0)
+        self.assertEqual(member.mode, 0644)
+        self.assertEqual((member.uid, member.uname), (0, ''))
+
+    def test_dedup(self):
+        lib = os.path.join(self.tmp_dir, 'lib')
+        os.makedirs(lib)
+        contents = os.urandom(256 * 1024)
+        # Copies from separate installs have different mtimes.
+        for i, name in enumerate(('a.so', 'b.so')):
+            path = os.path.join(lib, name)
+            with open(path, 'wb') as f:
+                f.write(contents)
+            os.utime(path, (1234567890 + i, 1234567890 + i))
+        os.link(os.path.join(lib, 'a.so'), os.path.join(lib, 'c.so'))
+
+        plain = layer_writer.FromDirectory(self.tmp_dir, 'srv')
+        dedup = layer_writer.FromDirectory(
+            self.tmp_dir, 'srv', options=layer_writer.Options(dedup=True))
+        extracted = {}
+        try:
+            for layer in (plain, dedup):
+                out_dir = tempfile.mkdtemp()
+                with tarfile.open(layer.path, 'r:gz') as tf:
+                    tf.extractall(out_dir)
+                    links = [m.name for m in tf.getmembers() if m.islnk()]
+                    mtimes = set(m.mtime for m in tf.getmembers()
+                                 if m.islnk())
+                files = {}
+                for root, _, names in os.walk(out_dir):
+                    for name in names:
+                        path = os.path.join(root, name)
+                        with open(path, 'rb') as f:
+                            files[os.path.relpath(path, out_dir)] = f.read()
+                shutil.rmtree(out_dir)
+                extracted[layer.digest] = (files, links)
+        finally:
+            os.remove(plain.path)
+            os.remove(dedup.path)
+        self.assertEqual(extracted[plain.digest][0],
+                         extracted[dedup.digest][0])
+        self.assertEqual(extracted[plain.digest][1], [])
+        self.assertEqual(extracted[dedup.digest][1],
+                         ['srv/./lib/b.so', 'srv/./lib/c.so'])
+        # Links carry the mtime of the file they point at.
+        self.assertEqual(mtimes, set([1234567890]))
+        self.assertLess(dedup.size, plain.size - len(contents))
+
+    def test_abort_removes_blob(self):
+        writer = layer_writer.LayerWriter()
+        path = writer._path
+        writer.Abort()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package records which blobs are known to be in which repository.
+
+A build pushes the same blobs several times: a package layer to the
+cache, the requirements image holding it to the cache again, and the
+final image to the target. A Ledger shared by those pushes lets each of
+them skip the existence check and upload of every blob an earlier push,
+or a cache hit, already placed in the repository.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Ledger(object):
+    """Ledger is a set of (repository, digest) pairs known to exist.
+
+    When path is set the ledger is loaded from and saved to that file, so
+    later builds skip blobs earlier builds pushed. Registries may garbage
+    collect blobs, so entries are only trusted for ttl_hours.
+    """
+
+    def __init__(self, path=None, ttl_hours=24):
+        self._path = path
+        self._ttl = ttl_hours * 60 * 60
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    entries = json.load(f)
+            except (IOError, ValueError) as e:
+                logging.warning('Ignoring unreadable ledger %s: %s', path, e)
+                entries = {}
+            oldest = time.time() - self._ttl
+            for repo, digests in entries.iteritems():
+                self._entries[repo] = {
+                    digest: added
+                    for digest, added in digests.iteritems()
+                    if added > oldest
+                }
+
+    def Contains(self, repo, digest):
+        """Whether the blob digest is known to be in the repository."""
+        with self._lock:
+            added = self._entries.get(str(repo), {}).get(digest)
+        return added is not None and added > time.time() - self._ttl
+
+    def Add(self, repo, digest):
+        with self._lock:
+            self._entries.setdefault(str(repo), {})[digest] = time.time()
+            self._dirty = True
+
+    def AddImage(self, repo, image):
+        """Record the layers of an image found in the repository."""
+        for digest in image.fs_layers():
+            self.Add(repo, digest)
+
+    def Save(self):
+        """Write the ledger back to disk, if it changed."""
+        if not self._path or not self._dirty:
+            return
+        with self._lock:
+            try:
+                directory = os.path.dirname(self._path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                tmp_path = self._path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._entries, f)
+                os.rename(tmp_path, self._path)
+                self._dirty = False
+            except (IOError, OSError) as e:
+                logging.warning('Could not save ledger to %s: %s',
+                                self._path, e)
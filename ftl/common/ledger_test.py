@@ -0,0 +1,68 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for ledger.py"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import ledger
+
+
+class LedgerTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'ledger.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_per_repository(self):
+        blobs = ledger.Ledger()
+        blobs.Add('gcr.io/a', 'sha256:one')
+        self.assertTrue(blobs.Contains('gcr.io/a', 'sha256:one'))
+        self.assertFalse(blobs.Contains('gcr.io/b', 'sha256:one'))
+        self.assertFalse(blobs.Contains('gcr.io/a', 'sha256:two'))
+
+    def test_persisted(self):
+        blobs = ledger.Ledger(self._path)
+        blobs.Add('gcr.io/a', 'sha256:one')
+        blobs.Save()
+        self.assertTrue(
+            ledger.Ledger(self._path).Contains('gcr.io/a', 'sha256:one'))
+
+    def test_expired_entries_dropped(self):
+        with open(self._path, 'w') as f:
+            json.dump({
+                'gcr.io/a': {
+                    'sha256:old': time.time() - 2 * 60 * 60,
+                    'sha256:new': time.time()
+                }
+            }, f)
+        blobs = ledger.Ledger(self._path, ttl_hours=1)
+        self.assertFalse(blobs.Contains('gcr.io/a', 'sha256:old'))
+        self.assertTrue(blobs.Contains('gcr.io/a', 'sha256:new'))
+
+    def test_unreadable_ignored(self):
+        with open(self._path, 'w') as f:
+            f.write('not json')
+        blobs = ledger.Ledger(self._path)
+        self.assertFalse(blobs.Contains('gcr.io/a', 'sha256:one'))
+
+
+if __name__ == '__main__':
+    unittest.main()
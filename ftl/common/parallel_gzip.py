@@ -0,0 +1,135 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package implements a block-parallel gzip writer.
+
+The input is cut into fixed size blocks which are deflated independently
+on a thread pool (zlib releases the GIL while compressing). Every block
+but the last ends with a sync flush, so the concatenated blocks form a
+single deflate stream and the output is a standard gzip member. The
+block boundaries only depend on the block size, so the output (and
+therefore the layer digest) is identical for any number of threads,
+including one, where blocks are deflated on the writing thread.
+"""
+
+import struct
+import zlib
+import concurrent.futures
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+_GZIP_MAGIC = '\037\213'
+_DEFLATE = 8
+_OS_UNIX = 3
+
+
+def _deflate(block, compresslevel, last):
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    data = compressor.compress(block)
+    if last:
+        return data + compressor.flush(zlib.Z_FINISH)
+    return data + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipFile(object):
+    """A write-only gzip file object which compresses blocks in parallel.
+
+    The gzip header always carries a zero mtime and no file name.
+    """
+
+    def __init__(self,
+                 fileobj,
+                 compresslevel=1,
+                 threads=2,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        self._fileobj = fileobj
+        self._compresslevel = compresslevel
+        self._block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self._crc = zlib.crc32('') & 0xffffffff
+        self._size = 0
+        self._executor = None
+        if threads > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=threads)
+        # Bound the number of blocks held in memory at once.
+        self._max_pending = 2 * threads
+        self._pending = []
+        self._closed = False
+        self._write_header()
+
+    def _write_header(self):
+        if self._compresslevel == 9:
+            xfl = 2
+        elif self._compresslevel == 1:
+            xfl = 4
+        else:
+            xfl = 0
+        self._fileobj.write(_GZIP_MAGIC + struct.pack(
+            '<BBIBB', _DEFLATE, 0, 0, xfl, _OS_UNIX))
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError('write() on closed ParallelGzipFile')
+        if not data:
+            return
+        self._crc = zlib.crc32(data, self._crc) & 0xffffffff
+        self._size += len(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self._block_size:
+            joined = ''.join(self._buffer)
+            offset = 0
+            while len(joined) - offset >= self._block_size:
+                self._submit(joined[offset:offset + self._block_size], False)
+                offset += self._block_size
+            rest = joined[offset:]
+            self._buffer = [rest] if rest else []
+            self._buffered = len(rest)
+
+    def _submit(self, block, last):
+        if self._executor is None:
+            self._fileobj.write(_deflate(block, self._compresslevel, last))
+            return
+        self._pending.append(
+            self._executor.submit(_deflate, block, self._compresslevel,
+                                  last))
+        while len(self._pending) > self._max_pending:
+            self._fileobj.write(self._pending.pop(0).result())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._submit(''.join(self._buffer), True)
+            self._buffer = []
+            for future in self._pending:
+                self._fileobj.write(future.result())
+            self._pending = []
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+        self._fileobj.write(
+            struct.pack('<II', self._crc, self._size & 0xffffffff))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        self.close()
@@ -0,0 +1,58 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for parallel_gzip.py"""
+
+import cStringIO
+import gzip
+import os
+import unittest
+
+import parallel_gzip
+
+
+def _compress(content, threads, block_size=1024):
+    buf = cStringIO.StringIO()
+    with parallel_gzip.ParallelGzipFile(
+            buf, threads=threads, block_size=block_size) as f:
+        # Write in uneven chunks so blocks straddle write() calls.
+        for i in range(0, len(content), 700):
+            f.write(content[i:i + 700])
+    return buf.getvalue()
+
+
+class ParallelGzipTest(unittest.TestCase):
+    def setUp(self):
+        self.content = os.urandom(4096) + 'a' * 10000 + os.urandom(1500)
+
+    def test_round_trip(self):
+        blob = _compress(self.content, threads=4)
+        stream = cStringIO.StringIO(blob)
+        self.assertEqual(gzip.GzipFile(fileobj=stream).read(), self.content)
+
+    def test_stable_across_thread_counts(self):
+        self.assertEqual(
+            _compress(self.content, threads=1),
+            _compress(self.content, threads=2))
+        self.assertEqual(
+            _compress(self.content, threads=2),
+            _compress(self.content, threads=8))
+
+    def test_empty(self):
+        blob = _compress('', threads=2)
+        stream = cStringIO.StringIO(blob)
+        self.assertEqual(gzip.GzipFile(fileobj=stream).read(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package holds the state builds in one process can share.
+
+A single build creates its own Resources. A process running many builds,
+such as the FTL daemon, passes one Resources to all of them, so each
+build starts with warm connections, credentials, base image metadata and
+state files.
+"""
+
+import collections
+import httplib2
+import threading
+
+from containerregistry.client import docker_creds
+from containerregistry.client.v2_2 import docker_image
+from containerregistry.transport import transport_pool
+
+from ftl.common import constants
+
+# The number of base images kept open by Resources(keep_images=True).
+_MAX_BASE_IMAGES = 16
+
+
+class Resources(object):
+    """Resources are the connections and state shared by builds.
+
+    Args:
+      threads: the size of the shared connection pool.
+      keep_images: keep base images open between builds. The manifest of
+        the base image is then resolved when a build starts, since tags
+        move, and the config of an image seen before is not fetched again.
+    """
+
+    def __init__(self, threads=constants.THREADS, keep_images=False):
+        self.transport = transport_pool.Http(httplib2.Http, size=threads)
+        self._keep_images = keep_images
+        self._lock = threading.Lock()
+        self._creds = {}
+        self._images = collections.OrderedDict()
+        self._shared = {}
+        self._locks = {}
+
+    def Credentials(self, name):
+        """The credentials for the registry of name."""
+        with self._lock:
+            if name.registry not in self._creds:
+                self._creds[name.registry] = (
+                    docker_creds.DefaultKeychain.Resolve(name))
+            return self._creds[name.registry]
+
+    def BaseImage(self, name, creds):
+        """The image name in its registry, open for reading."""
+        img = docker_image.FromRegistry(name, creds, self.transport)
+        img.__enter__()
+        if not self._keep_images:
+            return img
+        digest = img.digest()
+        with self._lock:
+            if digest in self._images:
+                img = self._images.pop(digest)
+            self._images[digest] = img
+            while len(self._images) > _MAX_BASE_IMAGES:
+                self._images.popitem(last=False)
+        return img
+
+    def Shared(self, key, factory):
+        """The one object for key, created by calling factory the first
+        time it is asked for.
+
+        State kept in files, like a tuning.Stats, is shared by the path of
+        its file, so concurrent builds neither lose each other's updates
+        nor overwrite the file with stale contents.
+        """
+        with self._lock:
+            if key not in self._shared:
+                self._shared[key] = factory()
+            return self._shared[key]
+
+    def Lock(self, key):
+        """The lock serializing the builds which use key, for example the
+        directory they build in."""
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
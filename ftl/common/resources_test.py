@@ -0,0 +1,51 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for resources.py"""
+
+import unittest
+import mock
+
+import resources
+
+
+class ResourcesTest(unittest.TestCase):
+    def test_shared(self):
+        shared = resources.Resources(threads=1)
+        factory = mock.Mock(side_effect=[object(), object()])
+        first = shared.Shared(('index', '/a'), factory)
+        self.assertIs(shared.Shared(('index', '/a'), factory), first)
+        self.assertIsNot(shared.Shared(('index', '/b'), factory), first)
+        self.assertIs(shared.Lock('/a'), shared.Lock('/a'))
+
+    @mock.patch('containerregistry.client.v2_2.docker_image.FromRegistry')
+    def test_base_images_kept(self, mock_from):
+        first, second = mock.MagicMock(), mock.MagicMock()
+        first.digest.return_value = 'sha256:base'
+        second.digest.return_value = 'sha256:base'
+        mock_from.side_effect = [first, second]
+        shared = resources.Resources(threads=1, keep_images=True)
+        self.assertIs(shared.BaseImage('base', None), first)
+        # The tag is resolved again, but the image seen before is used.
+        self.assertIs(shared.BaseImage('base', None), first)
+        self.assertTrue(second.digest.called)
+
+    @mock.patch('containerregistry.client.v2_2.docker_image.FromRegistry')
+    def test_base_images_not_kept(self, mock_from):
+        shared = resources.Resources(threads=1)
+        self.assertIs(shared.BaseImage('base', None), mock_from.return_value)
+        self.assertFalse(mock_from.return_value.digest.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
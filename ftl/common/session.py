@@ -0,0 +1,228 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package defines the docker push session used by FTL."""
+
+import logging
+import os
+import threading
+import time
+
+import concurrent.futures
+
+from containerregistry.client.v2_2 import docker_session
+
+from ftl.common import ledger as ledger_lib
+
+
+class Push(docker_session.Push):
+    """Push is a docker_session.Push which measures upload throughput.
+
+    Blobs are uploaded concurrently, so throughput is measured over each
+    window in which at least one blob upload is in flight: the bytes put
+    during the window divided by its length. Windows are recorded into
+    stats, a tuning.Stats. Blobs mounted from one of the mount
+    repositories move no data and are not counted.
+
+    Blobs are only checked for and uploaded when they are not in ledger, a
+    ledger.Ledger shared with the other pushes of the build, and pushed
+    blobs are added to it.
+
+    Blobs of images which know the file holding them (blob_path) are
+    streamed from that file rather than read into memory.
+    """
+
+    def __init__(self,
+                 name,
+                 creds,
+                 transport,
+                 mount=None,
+                 threads=1,
+                 stats=None,
+                 ledger=None):
+        super(Push, self).__init__(
+            name, creds, transport, mount=mount, threads=threads)
+        self._repository = name.as_repository()
+        self._ledger = ledger or ledger_lib.Ledger()
+        self._stats = stats
+        self._window_lock = threading.Lock()
+        self._in_flight = 0
+        self._window_start = None
+        self._window_bytes = 0
+        self._mounted = set()
+
+    def _start_upload(self, digest, mount=None):
+        mounted, location = super(Push, self)._start_upload(
+            digest, mount=mount)
+        if mounted:
+            with self._window_lock:
+                self._mounted.add(digest)
+        return mounted, location
+
+    def _upload_one(self, image, digest):
+        # Blobs pushed earlier, for example by a StreamingPush or to the
+        # cache, are not checked for again.
+        if self._ledger.Contains(self._repository, digest):
+            return
+        super(Push, self)._upload_one(image, digest)
+        self._ledger.Add(self._repository, digest)
+
+    def _get_blob(self, image, digest):
+        path = None
+        if hasattr(image, 'blob_path'):
+            path = image.blob_path(digest)
+        if path:
+            return _FileBody(path)
+        return super(Push, self)._get_blob(image, digest)
+
+    def Mounted(self):
+        """The digests of the blobs mounted rather than uploaded."""
+        with self._window_lock:
+            return set(self._mounted)
+
+    def _put_blob(self, image, digest):
+        if self._stats is None:
+            return super(Push, self)._put_blob(image, digest)
+        with self._window_lock:
+            if self._in_flight == 0:
+                self._window_start = time.time()
+                self._window_bytes = 0
+            self._in_flight += 1
+        size = 0
+        try:
+            super(Push, self)._put_blob(image, digest)
+            if digest not in self.Mounted():
+                size = _blob_size(image, digest)
+        finally:
+            with self._window_lock:
+                self._in_flight -= 1
+                self._window_bytes += size
+                if self._in_flight == 0:
+                    self._stats.RecordUpload(
+                        self._window_bytes,
+                        time.time() - self._window_start)
+
+
+def _blob_size(image, digest):
+    # Images built by FTL only know the sizes of their layers, and the
+    # config is small enough to measure directly.
+    if digest == image.config_blob():
+        return len(image.config_file())
+    return image.blob_size(digest)
+
+
+class _FileBody(object):
+    """_FileBody is a request body read from the file at path in blocks.
+
+    httplib takes the length of a body at the start of every attempt to
+    send it, including those retried by httplib2 and docker_http, so the
+    file is rewound then. It is closed once read to the end.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._size = os.path.getsize(path)
+        self._file = None
+
+    def __len__(self):
+        self.close()
+        return self._size
+
+    def read(self, size=-1):
+        if self._file is None:
+            self._file = open(self._path, 'rb')
+        data = self._file.read(size)
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StreamingPush(object):
+    """StreamingPush uploads the layers of an image while it is built.
+
+    Layer images are handed over as their builders finish, and their blobs
+    are pushed in the background. Finish then only has to push what is
+    left, usually just the config and the manifest.
+
+    Args:
+      name, creds, transport, mount, threads, stats, ledger: as for Push.
+    """
+
+    def __init__(self,
+                 name,
+                 creds,
+                 transport,
+                 mount=None,
+                 threads=1,
+                 stats=None,
+                 ledger=None):
+        self._push = Push(
+            name,
+            creds,
+            transport,
+            mount=mount,
+            threads=threads,
+            stats=stats,
+            ledger=ledger)
+        self._threads = threads
+        self._lock = threading.Lock()
+        self._executor = None
+        self._open_push = False
+        self._futures = {}
+
+    def AddImage(self, image):
+        """Start pushing the layer blobs of image."""
+        with self._lock:
+            if self._executor is None:
+                self._open()
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._threads)
+            for digest in image.fs_layers():
+                if digest not in self._futures:
+                    self._futures[digest] = self._executor.submit(
+                        self._push._upload_one, image, digest)
+
+    def Finish(self, image):
+        """Wait for the streamed blobs, then push the rest of image."""
+        with self._lock:
+            futures = self._futures.values()
+            self._open()
+        logging.info('Waiting for %d streamed blobs', len(futures))
+        try:
+            for future in futures:
+                future.result()
+            self._push.upload(image)
+        finally:
+            self.Close()
+
+    def _open(self):
+        if not self._open_push:
+            self._push.__enter__()
+            self._open_push = True
+
+    def Close(self):
+        """Stop streaming; blobs already being pushed are finished."""
+        with self._lock:
+            if self._executor is not None:
+                for future in self._futures.values():
+                    future.cancel()
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self._open_push:
+                self._push.__exit__(None, None, None)
+                self._open_push = False
@@ -0,0 +1,147 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for session.py"""
+
+import cStringIO
+import gzip
+import threading
+import unittest
+
+import blob_store
+import ftl_util
+import session
+import tar_to_dockerimage
+
+
+class _FakePush(object):
+    def __init__(self, name, creds, transport, mount=None, threads=1,
+                 stats=None, ledger=None):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.events.append('enter')
+        return self
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        self.events.append('exit')
+
+    def _upload_one(self, image, digest):
+        with self._lock:
+            self.events.append(digest)
+
+    def upload(self, image):
+        self.events.append('manifest')
+
+
+class _FakeImage(object):
+    def __init__(self, digests):
+        self._digests = digests
+
+    def fs_layers(self):
+        return self._digests
+
+
+class _FakeName(object):
+    def as_repository(self):
+        return 'gcr.io/test/app'
+
+
+class _FakeStats(object):
+    def __init__(self):
+        self.uploads = []
+
+    def RecordUpload(self, size, seconds):
+        self.uploads.append(size)
+
+
+def _gzip(content):
+    buf = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+class PushTest(unittest.TestCase):
+    def setUp(self):
+        self.store = blob_store.Store()
+
+    def tearDown(self):
+        self.store.Close()
+
+    def _image(self, content):
+        lyr = self.store.AddBlob(_gzip(content), content)
+        return tar_to_dockerimage.FromFSImage(layers=[lyr], store=self.store)
+
+    def _push(self, img):
+        stats = _FakeStats()
+        with session.Push(_FakeName(), None, None, stats=stats) as push:
+            push.upload(img)
+        return stats
+
+    def test_config_measured(self):
+        img = self._image('app')
+        stats = self._push(img)
+        sizes = [img.blob_size(img.fs_layers()[0]), len(img.config_file())]
+        self.assertEqual(stats.uploads, sizes)
+
+    def test_layers_streamed_from_disk(self):
+        img = self._image('app')
+        digest = img.fs_layers()[0]
+        with session.Push(_FakeName(), None, None) as push:
+            body = push._get_blob(img, digest)
+            config = push._get_blob(img, img.config_blob())
+        self.assertFalse(isinstance(body, str))
+        self.assertEqual(config, img.config_file())
+        for _ in range(2):
+            # Every attempt measures the body and then reads all of it.
+            self.assertEqual(len(body), img.blob_size(digest))
+            self.assertEqual(body.read(5) + body.read(), img.blob(digest))
+        self.assertEqual(body.read(), '')
+
+    def test_assembled_image_pushed_with_stats(self):
+        img = ftl_util.AppendLayersIntoImage(
+            [self._image('base'), self._image('app')])
+        stats = self._push(img)
+        self.assertEqual(len(stats.uploads), 3)
+        self.assertEqual(stats.uploads[-1], len(img.config_file()))
+
+
+class StreamingPushTest(unittest.TestCase):
+    def setUp(self):
+        self._push = session.Push
+        session.Push = _FakePush
+
+    def tearDown(self):
+        session.Push = self._push
+
+    def test_layers_pushed_before_manifest(self):
+        stream = session.StreamingPush('name', None, None, threads=2)
+        stream.AddImage(_FakeImage(['sha256:base']))
+        stream.AddImage(_FakeImage(['sha256:app', 'sha256:base']))
+        stream.Finish(_FakeImage(['sha256:app', 'sha256:base']))
+
+        events = stream._push.events
+        self.assertEqual(events[0], 'enter')
+        self.assertEqual(sorted(events[1:3]), ['sha256:app', 'sha256:base'])
+        self.assertEqual(events[3:], ['manifest', 'exit'])
+
+    def test_nothing_streamed(self):
+        stream = session.StreamingPush('name', None, None)
+        stream.Finish(_FakeImage(['sha256:app']))
+        self.assertEqual(stream._push.events, ['enter', 'manifest', 'exit'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -49,6 +49,10 @@ class CacheableLayerBuilder(BaseLayerBuilder):
 
     __metaclass__ = abc.ABCMeta  # For enforcing that methods are overriden.
 
+    def __init__(self):
+        super(CacheableLayerBuilder, self).__init__()
+        self._cache_key = None
+
     @abc.abstractmethod
     def GetCacheKeyRaw(self):
         """
@@ -57,7 +61,16 @@ class CacheableLayerBuilder(BaseLayerBuilder):
         """
 
     def GetCacheKey(self):
-        return hashlib.sha256(self.GetCacheKeyRaw()).hexdigest()
+        """The hashed cache key, computed once per builder.
+
+        The inputs of a builder do not change while it is used, and its
+        key is asked for at least twice, to look the layer up and to
+        store it.
+        """
+        if self._cache_key is None:
+            self._cache_key = hashlib.sha256(
+                self.GetCacheKeyRaw()).hexdigest()
+        return self._cache_key
 
     @abc.abstractmethod
     def BuildLayer(self):
@@ -20,38 +20,34 @@ from containerregistry.client.v2_2 import docker_image
 from containerregistry.client.v2_2 import docker_http
 from containerregistry.transform.v2_2 import metadata as v2_2_metadata
 
+from ftl.common import blob_store
+from ftl.common import compression
+
 
 class FromFSImage(docker_image.DockerImage):
-    """Interface for implementations that interact with Docker images."""
-
-    def __init__(self, blob_lst, u_layer_lst, overrides={}):
-        digest_to_blob, digest_to_u_blob = self._gen_digest_to_blob_and_u_blob(
-            blob_lst, u_layer_lst)
-        self._digest_to_blob = digest_to_blob
-        self._digest_to_u_blob = digest_to_u_blob
-        self._diff_id_to_u_layer = self._gen_diff_id_to_u_layer(u_layer_lst)
+    """Interface for implementations that interact with Docker images.
+
+    Layers are held as blob_store entries, so the blobs themselves stay on
+    disk and only their precomputed digest and size metadata is kept in
+    memory. In-memory blob_lst/u_layer_lst pairs are written to the blob
+    store up front.
+    """
+
+    def __init__(self, blob_lst=None, u_layer_lst=None, overrides={},
+                 layers=None, store=None):
+        store = store or blob_store.Default()
+        self._layers = list(layers or [])
+        for blob, u_layer in zip(blob_lst or [], u_layer_lst or []):
+            self._layers.append(store.AddBlob(blob, u_layer))
+        self._digest_to_layer = {lyr.digest: lyr for lyr in self._layers}
+        self._diff_id_to_layer = {lyr.diff_id: lyr for lyr in self._layers}
         self._overrides = overrides
         self._manifest = None
         self._config_file = None
 
     def GetFirstBlob(self):
-        for digest in self._digest_to_blob:
-            return self._digest_to_blob[digest]
-
-    def _gen_digest_to_blob_and_u_blob(self, blob_lst, u_layer_lst):
-        digest_to_blob = {}
-        digest_to_u_blob = {}
-        for blob, u_layer in zip(blob_lst, u_layer_lst):
-            digest = docker_digest.SHA256(blob)
-            digest_to_blob[digest] = blob
-            digest_to_u_blob[digest] = u_layer
-        return digest_to_blob, digest_to_u_blob
-
-    def _gen_diff_id_to_u_layer(self, u_layer_lst):
-        diff_id_to_u_layer = {}
-        for u_layer in u_layer_lst:
-            diff_id_to_u_layer[docker_digest.SHA256(u_layer)] = u_layer
-        return diff_id_to_u_layer
+        for lyr in self._layers:
+            return lyr.Blob()
 
     def fs_layers(self):
         """The ordered collection of filesystem layers that
@@ -91,22 +87,28 @@ class FromFSImage(docker_image.DockerImage):
         """
         if self._manifest is None:
             content = self.config_file().encode('utf-8')
+            # Codecs without a docker media type (zstd) need an OCI manifest.
+            oci = any(lyr.codec.docker_media_type is None
+                      for lyr in self._layers)
             self._manifest = json.dumps(
                 {
                     'schemaVersion':
                     2,
                     'mediaType':
-                    docker_http.MANIFEST_SCHEMA2_MIME,
+                    docker_http.OCI_MANIFEST_MIME
+                    if oci else docker_http.MANIFEST_SCHEMA2_MIME,
                     'config': {
-                        'mediaType': docker_http.CONFIG_JSON_MIME,
+                        'mediaType': compression.OCI_CONFIG_MIME
+                        if oci else docker_http.CONFIG_JSON_MIME,
                         'size': len(content),
                         'digest': docker_digest.SHA256(content)
                     },
                     'layers': [{
-                        'mediaType': docker_http.LAYER_MIME,
-                        'size': self.blob_size(digest),
-                        'digest': digest
-                    } for digest in self._digest_to_blob]
+                        'mediaType': lyr.codec.oci_media_type
+                        if oci else lyr.codec.docker_media_type,
+                        'size': lyr.size,
+                        'digest': lyr.digest
+                    } for lyr in self._layers]
                 },
                 sort_keys=True)
         return self._manifest
@@ -120,20 +122,22 @@ class FromFSImage(docker_image.DockerImage):
             entrypoint = self._overrides.pop('Entrypoint', [])
             env = self._overrides.pop('Env', {})
             exposed_ports = self._overrides.pop('ExposedPorts', {})
+            labels = self._overrides.pop('Labels', {})
 
             output = v2_2_metadata.Override(
                 json.loads('{}'),
                 v2_2_metadata.Overrides(
                     author='Bazel',
                     created_by='bazel build ...',
-                    layers=[k for k in self._diff_id_to_u_layer],
+                    layers=[lyr.diff_id for lyr in self._layers],
                     entrypoint=entrypoint,
                     env=env,
-                    ports=exposed_ports),
+                    ports=exposed_ports,
+                    labels=labels),
                 architecture=_PROCESSOR_ARCHITECTURE,
                 operating_system=_OPERATING_SYSTEM)
             output['rootfs'] = {
-                'diff_ids': [k for k in self._diff_id_to_u_layer]
+                'diff_ids': [lyr.diff_id for lyr in self._layers]
             }
             if len(self._overrides) > 0:
                 output.update(self._overrides)
@@ -142,7 +146,9 @@ class FromFSImage(docker_image.DockerImage):
 
     def blob_size(self, digest):
         """The byte size of the raw blob."""
-        return len(self.blob(digest))
+        if digest == self.config_blob():
+            return len(self.config_file())
+        return self._digest_to_layer[digest].size
 
     def blob(self, digest):
         """The raw blob of the layer.
@@ -153,17 +159,22 @@ class FromFSImage(docker_image.DockerImage):
         Returns:
           The raw blob string of the layer.
         """
-        return self._digest_to_blob[digest]
+        if digest == self.config_blob():
+            return self.config_file()
+        return self._digest_to_layer[digest].Blob()
 
     def uncompressed_blob(self, digest):
         """Same as blob() but uncompressed."""
-        return self._digest_to_u_blob[digest]
+        return self._digest_to_layer[digest].UncompressedBlob()
+
+    def blob_path(self, digest):
+        """The file holding the raw blob of the layer."""
+        lyr = self._digest_to_layer.get(digest)
+        return lyr.path if lyr else None
 
     def _diff_id_to_digest(self, diff_id):
-        for (this_digest, this_diff_id) in zip(self.fs_layers(),
-                                               self.diff_ids()):
-            if this_diff_id == diff_id:
-                return this_digest
+        if diff_id in self._diff_id_to_layer:
+            return self._diff_id_to_layer[diff_id].digest
         raise ValueError('Unmatched "diff_id": "%s"' % diff_id)
 
     def layer(self, diff_id):
@@ -181,7 +192,12 @@ class FromFSImage(docker_image.DockerImage):
 
     def uncompressed_layer(self, diff_id):
         """Same as layer() but uncompressed."""
-        return self._diff_id_to_u_layer[diff_id]
+        return self._diff_id_to_layer[diff_id].UncompressedBlob()
+
+    def open_uncompressed_layer(self, diff_id):
+        """Like uncompressed_layer(), but a file object decompressing the
+        layer as it is read from disk, in a context manager."""
+        return self._diff_id_to_layer[diff_id].OpenUncompressed()
 
     def __enter__(self):
         """Open the image for reading."""
@@ -192,3 +208,126 @@ class FromFSImage(docker_image.DockerImage):
     def __str__(self):
         """A human-readable representation of the image."""
         return str(type(self))
+
+
+def NormalizeMediaTypes(manifest):
+    """Switch a parsed manifest to OCI when any layer needs it.
+
+    Layer media types which only exist in OCI (zstd) cannot appear in a
+    docker schema 2 manifest, so the manifest, its config and the docker
+    media types of its other layers are converted to their OCI
+    equivalents. The manifest is updated in place and returned.
+    """
+    oci_only = set(compression.OCI_EQUIVALENTS.values())
+    oci_only.add(compression.OCI_LAYER_ZSTD_MIME)
+    if any(lyr['mediaType'] in oci_only for lyr in manifest['layers']):
+        manifest['mediaType'] = docker_http.OCI_MANIFEST_MIME
+        manifest['config']['mediaType'] = compression.OCI_CONFIG_MIME
+        for lyr in manifest['layers']:
+            lyr['mediaType'] = compression.OCI_EQUIVALENTS.get(
+                lyr['mediaType'], lyr['mediaType'])
+    return manifest
+
+
+class WithLayerMediaTypes(docker_image.DockerImage):
+    """WithLayerMediaTypes restores the layer media types of an image.
+
+    append.Layer labels every appended layer as a gzipped docker layer.
+    This wraps such an image and puts back the media types the layers
+    were built with, switching to an OCI manifest when any of them can
+    only be expressed there.
+    """
+
+    def __init__(self, image, media_types):
+        self._image = image
+        self._media_types = media_types
+        self._manifest = None
+
+    def fs_layers(self):
+        manifest = json.loads(self.manifest())
+        return [x['digest'] for x in reversed(manifest['layers'])]
+
+    def diff_ids(self):
+        return self._image.diff_ids()
+
+    def config_blob(self):
+        manifest = json.loads(self.manifest())
+        return manifest['config']['digest']
+
+    def blob_set(self):
+        return set(self.fs_layers() + [self.config_blob()])
+
+    def digest(self):
+        return docker_digest.SHA256(self.manifest())
+
+    def media_type(self):
+        manifest = json.loads(self.manifest())
+        return manifest.get('mediaType', docker_http.OCI_MANIFEST_MIME)
+
+    def manifest(self):
+        if self._manifest is None:
+            manifest = json.loads(self._image.manifest())
+            for lyr in manifest['layers']:
+                if lyr['digest'] in self._media_types:
+                    lyr['mediaType'] = self._media_types[lyr['digest']]
+            self._manifest = json.dumps(
+                NormalizeMediaTypes(manifest), sort_keys=True)
+        return self._manifest
+
+    def config_file(self):
+        return self._image.config_file()
+
+    def blob_size(self, digest):
+        return self._image.blob_size(digest)
+
+    def blob(self, digest):
+        return self._image.blob(digest)
+
+    def blob_path(self, digest):
+        if not hasattr(self._image, 'blob_path'):
+            return None
+        return self._image.blob_path(digest)
+
+    def uncompressed_blob(self, digest):
+        if digest not in self._media_types:
+            return self._image.uncompressed_blob(digest)
+        codec = compression.FromMediaType(self._media_types[digest])
+        return codec.Decompress(self.blob(digest))
+
+    def _diff_id_to_digest(self, diff_id):
+        for (this_digest, this_diff_id) in zip(self.fs_layers(),
+                                               self.diff_ids()):
+            if this_diff_id == diff_id:
+                return this_digest
+        raise ValueError('Unmatched "diff_id": "%s"' % diff_id)
+
+    def layer(self, diff_id):
+        return self.blob(self._diff_id_to_digest(diff_id))
+
+    def uncompressed_layer(self, diff_id):
+        return self.uncompressed_blob(self._diff_id_to_digest(diff_id))
+
+    def __enter__(self):
+        """Open the image for reading."""
+
+    def __exit__(self, unused_type, unused_value, unused_traceback):
+        """Close the image."""
+
+    def __str__(self):
+        """A human-readable representation of the image."""
+        return str(type(self))
+
+
+class WithAnnotations(WithLayerMediaTypes):
+    """WithAnnotations adds annotations to the manifest of an image."""
+
+    def __init__(self, image, annotations):
+        super(WithAnnotations, self).__init__(image, {})
+        self._annotations = annotations
+
+    def manifest(self):
+        if self._manifest is None:
+            manifest = json.loads(self._image.manifest())
+            manifest.setdefault('annotations', {}).update(self._annotations)
+            self._manifest = json.dumps(manifest, sort_keys=True)
+        return self._manifest
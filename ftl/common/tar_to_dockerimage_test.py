@@ -0,0 +1,92 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for tar_to_dockerimage.py"""
+
+import cStringIO
+import gzip
+import hashlib
+import json
+import unittest
+
+import blob_store
+import compression
+import tar_to_dockerimage
+
+
+def _gzip(content):
+    buf = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+class FromFSImageTest(unittest.TestCase):
+    def setUp(self):
+        self.store = blob_store.Store()
+        self.u_blob = 'layer contents'
+        self.blob = _gzip(self.u_blob)
+
+    def tearDown(self):
+        self.store.Close()
+
+    def test_blobs_served_from_disk(self):
+        img = tar_to_dockerimage.FromFSImage(
+            [self.blob], [self.u_blob], {}, store=self.store)
+        digest = 'sha256:' + hashlib.sha256(self.blob).hexdigest()
+        diff_id = 'sha256:' + hashlib.sha256(self.u_blob).hexdigest()
+
+        self.assertEqual(img.fs_layers(), [digest])
+        self.assertEqual(img.diff_ids(), [diff_id])
+        self.assertEqual(img.blob(digest), self.blob)
+        self.assertEqual(img.blob_size(digest), len(self.blob))
+        self.assertEqual(img.uncompressed_layer(diff_id), self.u_blob)
+        self.assertEqual(img.layer(diff_id), self.blob)
+        layers = json.loads(img.manifest())['layers']
+        self.assertEqual(layers[0]['size'], len(self.blob))
+
+    def test_store_entries(self):
+        entry = self.store.AddBlob(self.blob, self.u_blob)
+        img = tar_to_dockerimage.FromFSImage(layers=[entry])
+        self.assertEqual(img.GetFirstBlob(), self.blob)
+        self.assertEqual(img.uncompressed_blob(entry.digest), self.u_blob)
+
+    def test_uncompressed_media_type(self):
+        path = self.store.TempPath()
+        with open(path, 'wb') as f:
+            f.write(self.u_blob)
+        digest = 'sha256:' + hashlib.sha256(self.u_blob).hexdigest()
+        entry = self.store.Commit(path, digest, digest, len(self.u_blob),
+                                  len(self.u_blob), compression.Uncompressed())
+        img = tar_to_dockerimage.FromFSImage(layers=[entry])
+        manifest = json.loads(img.manifest())
+        self.assertEqual(manifest['layers'][0]['mediaType'],
+                         compression.DOCKER_LAYER_TAR_MIME)
+        self.assertEqual(img.uncompressed_blob(digest), self.u_blob)
+
+    def test_annotations(self):
+        img = tar_to_dockerimage.FromFSImage(
+            [self.blob], [self.u_blob], {}, store=self.store)
+        annotated = tar_to_dockerimage.WithAnnotations(
+            img, {'ftl.created': '2018-01-01T00:00:00Z'})
+        manifest = json.loads(annotated.manifest())
+        self.assertEqual(manifest['annotations'],
+                         {'ftl.created': '2018-01-01T00:00:00Z'})
+        self.assertEqual(manifest['layers'],
+                         json.loads(img.manifest())['layers'])
+        self.assertEqual(annotated.fs_layers(), img.fs_layers())
+        self.assertNotEqual(annotated.digest(), img.digest())
+
+
+if __name__ == '__main__':
+    unittest.main()
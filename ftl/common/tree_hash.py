@@ -0,0 +1,238 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package computes Merkle hashes of directory trees.
+
+Every file is hashed by content, every directory by the sorted names,
+types, modes and hashes of its entries, so the root hash changes exactly
+when something a layer of the directory would contain changes. File
+hashes are remembered in an Index keyed by path and stat data, so an
+unchanged tree is hashed with a stat() per file and no reads.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+import time
+
+import concurrent.futures
+
+from ftl.common import ignore
+
+_READ_SIZE = 1024 * 1024
+
+# Files modified this recently may still be changing within the mtime
+# granularity of the filesystem, so their hashes are not remembered.
+_RACY_SECONDS = 2
+
+
+class Index(object):
+    """Index is a stat cache of file content hashes kept between builds.
+
+    An entry is only trusted while the size, mtime, inode and ctime of the
+    file are unchanged.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    self._entries = json.load(f)
+            except (IOError, ValueError) as e:
+                logging.warning('Ignoring unreadable index %s: %s', path, e)
+
+    @staticmethod
+    def _key(st):
+        return [st.st_size, st.st_mtime, st.st_ino, st.st_ctime]
+
+    def Lookup(self, path, st):
+        """The remembered hash of the file at path, or None."""
+        entry = self._entries.get(path)
+        if entry and entry[0] == self._key(st):
+            return entry[1]
+        return None
+
+    def Update(self, path, st, digest):
+        if st.st_mtime > time.time() - _RACY_SECONDS:
+            return
+        with self._lock:
+            self._entries[path] = [self._key(st), digest]
+            self._dirty = True
+
+    def Retain(self, directory, paths):
+        """Forget the entries under directory other than paths."""
+        prefix = os.path.join(directory, '')
+        with self._lock:
+            for path in self._entries.keys():
+                if path.startswith(prefix) and path not in paths:
+                    del self._entries[path]
+                    self._dirty = True
+
+    def Save(self):
+        """Write the index back to disk, if it changed."""
+        if not self._path or not self._dirty:
+            return
+        with self._lock:
+            try:
+                directory = os.path.dirname(self._path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                tmp_path = self._path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._entries, f)
+                os.rename(tmp_path, self._path)
+                self._dirty = False
+            except (IOError, OSError) as e:
+                logging.warning('Could not save index to %s: %s',
+                                self._path, e)
+
+
+def _hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(_READ_SIZE)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+class _Node(object):
+    def __init__(self, name, st):
+        self.name = name
+        self.st = st
+        self.children = []
+        self.digest = None
+
+
+class TreeHash(object):
+    """TreeHash computes the Merkle hash of a directory.
+
+    Args:
+      directory: the directory to hash.
+      index: an optional Index remembering file hashes between builds.
+      ignore_paths: the ignore.Ignore of paths left out, by default the
+        .ftlignore of directory, as the layer writer does.
+      threads: the number of files hashed in parallel.
+    """
+
+    def __init__(self, directory, index=None, ignore_paths=None, threads=8):
+        self._directory = directory
+        self._index = index or Index()
+        self._ignore = ignore_paths or ignore.ForDirectory(directory)
+        self._threads = threads
+        self._root = None
+
+    def Digest(self):
+        """The 'sha256:' Merkle hash of the directory."""
+        root = _Node('.', os.lstat(self._directory))
+        pending = []
+        files = set()
+        self._walk(self._directory, '', root, pending, files)
+        self._index.Retain(self._directory, files)
+        if pending:
+            logging.info('Hashing %d changed files', len(pending))
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._threads) as executor:
+                futures = [(path, node, executor.submit(_hash_file, path))
+                           for path, node in pending]
+                for path, node, future in futures:
+                    node.digest = future.result()
+                    self._index.Update(path, node.st, node.digest)
+        self._index.Save()
+        # Hash the root through a parent so its own mode is covered too.
+        parent = _Node('', None)
+        parent.children.append(root)
+        self._root = root
+        return 'sha256:' + self._tree_digest(parent)
+
+    def Entries(self):
+        """A short signature of every entry below the directory, by path.
+
+        The signature of a directory only covers its own mode, so
+        comparing the Entries of two versions of a tree gives exactly the
+        paths that were added, changed or removed. Digest must be called
+        first.
+        """
+        entries = {}
+        self._entries(self._root, '', entries, set())
+        return entries
+
+    def Directories(self):
+        """The paths of the directories below the directory."""
+        directories = set()
+        self._entries(self._root, '', {}, directories)
+        return directories
+
+    def _entries(self, node, relative, entries, directories):
+        for child in node.children:
+            path = relative + child.name
+            if stat.S_ISDIR(child.st.st_mode):
+                signature = '%o' % child.st.st_mode
+                directories.add(path)
+                self._entries(child, path + '/', entries, directories)
+            else:
+                signature = '%o %s' % (child.st.st_mode, child.digest)
+            entries[path] = hashlib.sha256(signature).hexdigest()[:16]
+
+    def _walk(self, directory, relative, parent, pending, files):
+        for name in sorted(os.listdir(directory)):
+            relative_path = relative + name
+            excluded = self._ignore.Excluded(relative_path)
+            if excluded and self._ignore.CanPrune(relative_path):
+                continue
+            path = os.path.join(directory, name)
+            st = os.lstat(path)
+            if excluded and not stat.S_ISDIR(st.st_mode):
+                continue
+            node = _Node(name, st)
+            if stat.S_ISDIR(st.st_mode):
+                self._walk(path, relative_path + '/', node, pending, files)
+            elif stat.S_ISREG(st.st_mode):
+                files.add(path)
+                node.digest = self._index.Lookup(path, st)
+                if node.digest is None:
+                    pending.append((path, node))
+            elif stat.S_ISLNK(st.st_mode):
+                node.digest = hashlib.sha256(os.readlink(path)).hexdigest()
+            elif stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+                node.digest = '%d,%d' % (os.major(st.st_rdev),
+                                         os.minor(st.st_rdev))
+            elif stat.S_ISFIFO(st.st_mode):
+                node.digest = ''
+            else:
+                # Sockets are not written into layers either.
+                continue
+            parent.children.append(node)
+
+    def _tree_digest(self, node):
+        sha256 = hashlib.sha256()
+        for child in node.children:
+            if stat.S_ISDIR(child.st.st_mode):
+                child.digest = self._tree_digest(child)
+            sha256.update('%o %s\0%s\n' %
+                          (child.st.st_mode, child.name, child.digest))
+        return sha256.hexdigest()
+
+
+def Digest(directory, index=None):
+    """The Merkle hash of directory, see TreeHash."""
+    return TreeHash(directory, index=index).Digest()
@@ -0,0 +1,85 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for tree_hash.py"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import tree_hash
+
+_PAST = 1234567890
+
+
+class TreeHashTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app_dir = os.path.join(self.tmp_dir, 'app')
+        self.index_path = os.path.join(self.tmp_dir, 'index.json')
+        self._write('foo', 'foo_contents')
+        self._write('baz/bat', 'bat_contents')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.app_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+        os.utime(path, (_PAST, _PAST))
+
+    def test_stable(self):
+        self.assertEqual(
+            tree_hash.Digest(self.app_dir), tree_hash.Digest(self.app_dir))
+
+    def test_content_change(self):
+        before = tree_hash.Digest(self.app_dir)
+        self._write('baz/bat', 'new_contents')
+        self.assertNotEqual(before, tree_hash.Digest(self.app_dir))
+
+    def test_mode_change(self):
+        before = tree_hash.Digest(self.app_dir)
+        os.chmod(os.path.join(self.app_dir, 'foo'), 0755)
+        self.assertNotEqual(before, tree_hash.Digest(self.app_dir))
+
+    def test_excluded_files_ignored(self):
+        before = tree_hash.Digest(self.app_dir)
+        self._write('foo.pyc', 'bytecode')
+        self.assertEqual(before, tree_hash.Digest(self.app_dir))
+
+    def test_index_skips_unchanged_files(self):
+        before = tree_hash.Digest(self.app_dir,
+                                  tree_hash.Index(self.index_path))
+        # A fresh index loaded from disk must not need to read any file.
+        hash_file = tree_hash._hash_file
+        tree_hash._hash_file = None
+        try:
+            after = tree_hash.Digest(self.app_dir,
+                                     tree_hash.Index(self.index_path))
+        finally:
+            tree_hash._hash_file = hash_file
+        self.assertEqual(before, after)
+
+    def test_index_notices_changes(self):
+        index = tree_hash.Index(self.index_path)
+        before = tree_hash.Digest(self.app_dir, index)
+        self._write('foo', 'changed_contents')
+        self.assertNotEqual(before, tree_hash.Digest(self.app_dir, index))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package tunes layer compression to the measured push bandwidth.
+
+Building and pushing a layer of n uncompressed bytes takes roughly
+
+    n * (1 / compression_speed + compression_ratio / bandwidth)
+
+so a slow link favours compressing harder and a fast one compressing
+less, or not at all. Stats remembers the push bandwidth and the speed
+and ratio of each codec across builds, and Tuner picks the codec with
+the lowest estimated cost for every layer it is asked about.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from ftl.common import compression
+from ftl.common import ftl_util
+
+# Weight of a new observation in the moving averages.
+_ALPHA = 0.3
+
+# Smaller blobs are dominated by request latency rather than bandwidth.
+_MIN_SAMPLE_SIZE = 256 * 1024
+
+# The compression levels tried for each codec.
+_LEVELS = {
+    compression.GZIP: [1, 3, 6, 9],
+    compression.ZSTD: [1, 3, 9, 19],
+    compression.UNCOMPRESSED: [],
+}
+
+# Single threaded (bytes/sec, ratio) used until a codec has been observed.
+_PRIORS = {
+    'gzip:1': (60e6, 0.42),
+    'gzip:3': (45e6, 0.40),
+    'gzip:6': (20e6, 0.37),
+    'gzip:9': (8e6, 0.36),
+    'zstd:1': (250e6, 0.40),
+    'zstd:3': (150e6, 0.37),
+    'zstd:9': (50e6, 0.34),
+    'zstd:19': (3e6, 0.30),
+}
+
+
+def _average(current, value):
+    if current is None:
+        return value
+    return (1 - _ALPHA) * current + _ALPHA * value
+
+
+class Stats(object):
+    """Stats holds the measured push bandwidth and codec performance.
+
+    When path is set the stats are loaded from and saved to that file, so
+    later builds start from what earlier builds measured.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._bandwidth = None
+        self._codecs = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    state = json.load(f)
+                self._bandwidth = state.get('bandwidth')
+                self._codecs = state.get('codecs', {})
+            except (IOError, ValueError) as e:
+                logging.warning('Ignoring unreadable stats %s: %s', path, e)
+
+    def Bandwidth(self):
+        """The push bandwidth in bytes/sec, or None if never measured."""
+        return self._bandwidth
+
+    def Codec(self, codec):
+        """The observed (bytes/sec, ratio) of codec, or None."""
+        observed = self._codecs.get(str(codec))
+        return tuple(observed) if observed else None
+
+    def RecordUpload(self, size, seconds):
+        if size < _MIN_SAMPLE_SIZE or seconds <= 0:
+            return
+        with self._lock:
+            self._bandwidth = _average(self._bandwidth, size / seconds)
+            self._save()
+
+    def RecordCompression(self, codec, uncompressed_size, size, seconds):
+        if uncompressed_size < _MIN_SAMPLE_SIZE or seconds <= 0:
+            return
+        with self._lock:
+            speed, ratio = self._codecs.get(str(codec), (None, None))
+            self._codecs[str(codec)] = [
+                _average(speed, uncompressed_size / seconds),
+                _average(ratio, float(size) / uncompressed_size)
+            ]
+            self._save()
+
+    def _save(self):
+        if not self._path:
+            return
+        try:
+            directory = os.path.dirname(self._path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'bandwidth': self._bandwidth,
+                    'codecs': self._codecs
+                }, f)
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            logging.warning('Could not save stats to %s: %s', self._path, e)
+
+
+class Tuner(object):
+    """Tuner picks the compression of each layer from measured Stats.
+
+    Until a push bandwidth has been measured the default level of the
+    configured codec is used.
+
+    Args:
+      stats: the Stats decisions are based on and observations go to.
+      codec_name: the --compression codec whose levels are considered,
+        alongside leaving the layer uncompressed.
+      threads: the compression threads used per layer.
+      export_location: the builder output directory decisions are
+        recorded in, if any.
+    """
+
+    def __init__(self, stats, codec_name, threads=1, export_location=None):
+        self._stats = stats
+        self._threads = max(threads, 1)
+        self._export_location = export_location
+        self._default = compression.FromName(codec_name)
+        self._candidates = [compression.Uncompressed()] + [
+            compression.FromName(codec_name, level)
+            for level in _LEVELS[codec_name]
+        ]
+        self._lock = threading.Lock()
+        self._decisions = []
+
+    def Choose(self):
+        """The codec the next layer should be written with."""
+        bandwidth = self._stats.Bandwidth()
+        if not bandwidth:
+            return self._default
+        return min(
+            self._candidates,
+            key=lambda codec: self._cost(codec, bandwidth))
+
+    def _cost(self, codec, bandwidth):
+        """The estimated seconds per uncompressed byte."""
+        speed, ratio = self._estimate(codec)
+        if speed is None:
+            return ratio / bandwidth
+        return 1.0 / speed + ratio / bandwidth
+
+    def _estimate(self, codec):
+        if codec.name == compression.UNCOMPRESSED:
+            return None, 1.0
+        observed = self._stats.Codec(codec)
+        if observed:
+            return observed
+        speed, ratio = _PRIORS.get(str(codec), _PRIORS['gzip:1'])
+        return speed * self._threads, ratio
+
+    def Record(self, codec, layer, seconds):
+        """Record how writing layer with codec went."""
+        self._stats.RecordCompression(codec, layer.uncompressed_size,
+                                      layer.size, seconds)
+        decision = {
+            'digest': layer.digest,
+            'codec': str(codec),
+            'size': layer.size,
+            'uncompressedSize': layer.uncompressed_size,
+            'seconds': round(seconds, 3),
+            'bandwidth': self._stats.Bandwidth(),
+        }
+        logging.info('Compressed layer %s with %s', layer.digest, codec)
+        with self._lock:
+            self._decisions.append(decision)
+            ftl_util.update_builder_output(
+                self._export_location,
+                {'compressionDecisions': list(self._decisions)})
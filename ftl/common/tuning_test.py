@@ -0,0 +1,87 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for tuning.py"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import blob_store
+import compression
+import constants
+import tuning
+
+_MB = 1024 * 1024
+
+
+class TuningTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'state', 'tuning.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_default_without_bandwidth(self):
+        tuner = tuning.Tuner(tuning.Stats(), compression.GZIP)
+        self.assertEqual(str(tuner.Choose()), 'gzip:1')
+
+    def test_slow_link_compresses_harder(self):
+        stats = tuning.Stats()
+        stats.RecordUpload(10 * _MB, 100)
+        tuner = tuning.Tuner(stats, compression.GZIP)
+        self.assertEqual(str(tuner.Choose()), 'gzip:9')
+
+    def test_fast_link_skips_compression(self):
+        stats = tuning.Stats()
+        stats.RecordUpload(1000 * _MB, 1)
+        tuner = tuning.Tuner(stats, compression.GZIP)
+        self.assertEqual(str(tuner.Choose()), 'uncompressed')
+
+    def test_stats_persist(self):
+        stats = tuning.Stats(self.path)
+        stats.RecordUpload(10 * _MB, 2)
+        stats.RecordCompression(compression.Gzip(6), 10 * _MB, 2 * _MB, 1)
+        stats = tuning.Stats(self.path)
+        self.assertEqual(stats.Bandwidth(), 5 * _MB)
+        self.assertEqual(stats.Codec(compression.Gzip(6)), (10 * _MB, 0.2))
+
+    def test_small_samples_ignored(self):
+        stats = tuning.Stats()
+        stats.RecordUpload(1024, 1)
+        self.assertIsNone(stats.Bandwidth())
+
+    def test_decisions_exported(self):
+        store = blob_store.Store()
+        try:
+            lyr = store.AddBlob('blob', 'uncompressed blob')
+            tuner = tuning.Tuner(
+                tuning.Stats(),
+                compression.GZIP,
+                export_location=self.tmp_dir)
+            tuner.Record(compression.Gzip(), lyr, 0.5)
+        finally:
+            store.Close()
+        with open(os.path.join(self.tmp_dir,
+                               constants.BUILDER_OUTPUT_FILE)) as f:
+            output = json.load(f)
+        decision = output['compressionDecisions'][0]
+        self.assertEqual(decision['digest'], lyr.digest)
+        self.assertEqual(decision['codec'], 'gzip:1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,6 +15,7 @@
 
 import unittest
 import constants
+import json
 import StringIO
 import logging
 import mock
@@ -83,6 +84,22 @@ class UtilTest(unittest.TestCase):
 
         self.assertEqual(log_pieces, None)
 
+    def test_reproducible_overrides(self):
+        options = mock.Mock()
+        options.reproducible = True
+        overrides = ftl_util.generate_overrides(False, options=options)
+        self.assertEqual(overrides['created'], constants.REPRODUCIBLE_CREATED)
+        created = overrides['Labels'][constants.CREATED_LABEL]
+
+        image = mock.Mock()
+        image.config_file.return_value = json.dumps({
+            'created': overrides['created'],
+            'config': {
+                'Labels': overrides['Labels']
+            }
+        })
+        self.assertEqual(ftl_util.creation_time(image), created)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A binary submitting a build to the FTL daemon.
+
+  client.py [--socket PATH] RUNTIME ARGS...
+
+runs the build ftl/RUNTIME/main.py ARGS... would run, in the daemon, and
+exits with the exit code of the build.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+
+from ftl.common import constants
+from ftl.common import ftl_error
+
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get(constants.FTL_STATE_DIR,
+                   os.path.expanduser(constants.DEFAULT_STATE_DIR)),
+    constants.DAEMON_SOCKET_FILE)
+
+parser = argparse.ArgumentParser(
+    description='Run an FTL build in the FTL daemon.')
+parser.add_argument(
+    '--socket',
+    dest='socket',
+    action='store',
+    default=DEFAULT_SOCKET,
+    help='The Unix socket the FTL daemon listens on')
+parser.add_argument(
+    'runtime',
+    action='store',
+    help='The runtime to build for: node, php or python')
+
+
+def Build(socket_path, runtime, cli_args):
+    """Run a build in the daemon listening on socket_path.
+
+    Args:
+      socket_path: the Unix socket the daemon listens on.
+      runtime: the runtime to build for.
+      cli_args: the arguments ftl/<runtime>/main.py would take.
+
+    Returns:
+      the reply of the daemon, a dict with the exitCode of the build and,
+      when it failed, the error.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        f = sock.makefile('rw')
+        f.write(json.dumps({'runtime': runtime, 'args': cli_args}) + '\n')
+        f.flush()
+        reply = f.readline()
+    finally:
+        sock.close()
+    if not reply:
+        raise ftl_error.InternalError(
+            'The FTL daemon on %s closed the connection' % socket_path)
+    return json.loads(reply)
+
+
+def main(cli_args):
+    logging.getLogger().setLevel(logging.INFO)
+    client_args, build_args = parser.parse_known_args(cli_args)
+    reply = Build(client_args.socket, client_args.runtime, build_args)
+    if reply.get('error'):
+        logging.error(reply['error'])
+    sys.exit(reply['exitCode'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,217 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A binary running FTL builds requested over a Unix socket.
+
+A request is one line of JSON, {"runtime": "python", "args": [...]},
+holding the arguments ftl/<runtime>/main.py takes. The reply is one line
+of JSON holding the exitCode of the build and, when it failed, the error.
+
+Builds run concurrently and share one resources.Resources, so they start
+with warm connections, credentials, base image metadata and state files
+instead of setting them up again in a fresh process. Each build writes
+its layers to a blob store of its own, removed when it finishes; builds
+of the same app directory, or of Python apps sharing a virtualenv, take
+turns.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import SocketServer
+import sys
+
+from containerregistry.tools import patched
+
+from ftl.common import constants
+from ftl.common import context
+from ftl.common import ftl_error
+from ftl.common import ftl_util
+from ftl.common import logger
+from ftl.common import resources
+from ftl.daemon import client
+
+from ftl.node import builder as node_builder
+from ftl.node import main as node_main
+from ftl.php import builder as php_builder
+from ftl.php import main as php_main
+from ftl.python import builder as python_builder
+from ftl.python import main as python_main
+
+# The argument parser and builder of each runtime.
+RUNTIMES = {
+    'node': (node_main.node_parser, node_builder.Node),
+    'php': (php_main.php_parser, php_builder.PHP),
+    'python': (python_main.python_parser, python_builder.Python),
+}
+
+parser = argparse.ArgumentParser(
+    description='Run FTL builds requested over a Unix socket.')
+parser.add_argument(
+    '--socket',
+    dest='socket',
+    action='store',
+    default=client.DEFAULT_SOCKET,
+    help='The Unix socket to listen on')
+parser.add_argument(
+    '--threads',
+    dest='threads',
+    action='store',
+    type=int,
+    default=constants.THREADS,
+    help='The number of connections to registries shared by all builds')
+parser.add_argument(
+    '--verbosity',
+    default=constants.DEFAULT_LOG_LEVEL,
+    nargs='?',
+    action='store',
+    choices=logger.LEVEL_MAP.keys())
+
+
+def _error_reply(handler, err, builder_args):
+    """Report err the way main.py does, without exiting the daemon."""
+    try:
+        handler(err, builder_args.builder_output_path,
+                builder_args.fail_on_error)
+    except SystemExit as e:
+        return {'exitCode': e.code, 'error': str(err)}
+    return {'exitCode': 0, 'error': str(err)}
+
+
+def run_build(shared, runtime, cli_args, runtimes=None):
+    """Run a build as ftl/<runtime>/main.py cli_args would.
+
+    Args:
+      shared: the resources.Resources the build shares with others.
+      runtime: the runtime to build for.
+      cli_args: the arguments of ftl/<runtime>/main.py.
+      runtimes: the argument parser and builder of each runtime.
+
+    Returns:
+      a dict with the exitCode of the build and, when it failed, the error.
+    """
+    runtimes = runtimes or RUNTIMES
+    if runtime not in runtimes:
+        return {'exitCode': 2, 'error': 'Unknown runtime: %s' % runtime}
+    build_parser, builder_class = runtimes[runtime]
+    try:
+        builder_args = build_parser.parse_args(cli_args)
+    except SystemExit as e:
+        return {'exitCode': e.code, 'error': 'Invalid arguments'}
+    logger.preamble(runtime, builder_args)
+    # Builders write to the app directory, so builds of the same
+    # directory run one at a time; other builds run alongside.
+    lock = shared.Lock(os.path.realpath(builder_args.directory))
+    try:
+        with lock:
+            with ftl_util.Timing('full build'):
+                with ftl_util.Timing('builder initialization'):
+                    ftl = builder_class(
+                        context.Workspace(builder_args.directory),
+                        builder_args,
+                        resources=shared)
+                try:
+                    with ftl_util.Timing('build process for FTL image'):
+                        ftl.Build()
+                finally:
+                    # The daemon outlives its builds, so their blobs and
+                    # scratch directories are removed as they finish.
+                    ftl.Close()
+    except ftl_error.UserError as e:
+        return _error_reply(ftl_error.UserErrorHandler, e, builder_args)
+    except ftl_error.InternalError as e:
+        return _error_reply(ftl_error.InternalErrorHandler, e, builder_args)
+    except Exception as e:
+        logging.exception('Build failed')
+        return {'exitCode': 1, 'error': str(e)}
+    return {'exitCode': 0}
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # A connection closed without a request, like the check of
+            # _remove_stale_socket whether a daemon is still listening.
+            return
+        try:
+            request = json.loads(line)
+            reply = self.server.Build(request['runtime'],
+                                      request.get('args', []))
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {'exitCode': 2, 'error': 'Invalid request: %s' % e}
+        self.wfile.write(json.dumps(reply) + '\n')
+
+
+class Server(SocketServer.ThreadingUnixStreamServer):
+    """Server runs the builds requested on socket_path, each in a thread.
+
+    Args:
+      socket_path: the Unix socket to listen on.
+      shared: the resources.Resources all builds share.
+      runtimes: the argument parser and builder of each runtime.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, shared, runtimes=None):
+        _remove_stale_socket(socket_path)
+        SocketServer.ThreadingUnixStreamServer.__init__(
+            self, socket_path, _Handler)
+        self._shared = shared
+        self._runtimes = runtimes
+
+    def Build(self, runtime, cli_args):
+        """Run a build, returning the reply to the client."""
+        return run_build(self._shared, runtime, cli_args, self._runtimes)
+
+
+def _remove_stale_socket(socket_path):
+    """Remove the socket of a daemon which is no longer running."""
+    directory = os.path.dirname(socket_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    if not os.path.exists(socket_path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        os.remove(socket_path)
+        return
+    finally:
+        sock.close()
+    raise ftl_error.UserError(
+        'An FTL daemon is already listening on %s' % socket_path)
+
+
+def main(cli_args):
+    daemon_args = parser.parse_args(cli_args)
+    logger.setup_logging(daemon_args)
+    shared = resources.Resources(
+        threads=daemon_args.threads, keep_images=True)
+    server = Server(daemon_args.socket, shared)
+    logging.info('FTL daemon %s listening on %s', constants.FTL_VERSION,
+                 daemon_args.socket)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(daemon_args.socket)
+
+
+if __name__ == '__main__':
+    with patched.Httplib2():
+        main(sys.argv[1:])
@@ -0,0 +1,98 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for daemon.py"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ftl.common import ftl_error
+from ftl.common import resources
+from ftl.daemon import client
+from ftl.daemon import daemon
+
+_parser = argparse.ArgumentParser()
+_parser.add_argument('--directory', required=True)
+_parser.add_argument('--fail', action='store_true', default=False)
+_parser.add_argument('--builder-output-path', default=None)
+_parser.add_argument('--fail-on-error', default=True)
+
+
+class _FakeBuilder(object):
+    built = []
+    closed = []
+
+    def __init__(self, ctx, args, resources=None):
+        self._args = args
+        self._resources = resources
+
+    def Build(self):
+        if self._args.fail:
+            raise ftl_error.UserError('bad app')
+        _FakeBuilder.built.append((self._args.directory, self._resources))
+
+    def Close(self):
+        _FakeBuilder.closed.append(self._args.directory)
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._socket = os.path.join(self._dir, 'daemon.sock')
+        self._shared = resources.Resources(threads=1)
+        self._server = daemon.Server(
+            self._socket,
+            self._shared,
+            runtimes={'fake': (_parser, _FakeBuilder)})
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        _FakeBuilder.built = []
+        _FakeBuilder.closed = []
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        shutil.rmtree(self._dir)
+
+    def test_build(self):
+        reply = client.Build(self._socket, 'fake',
+                             ['--directory', self._dir])
+        self.assertEqual(reply, {'exitCode': 0})
+        self.assertEqual(_FakeBuilder.built, [(self._dir, self._shared)])
+        self.assertEqual(_FakeBuilder.closed, [self._dir])
+
+    def test_build_error(self):
+        reply = client.Build(self._socket, 'fake',
+                             ['--directory', self._dir, '--fail'])
+        self.assertEqual(reply, {'exitCode': 1, 'error': 'bad app'})
+        self.assertEqual(_FakeBuilder.closed, [self._dir])
+
+    def test_invalid_requests(self):
+        reply = client.Build(self._socket, 'unknown', [])
+        self.assertEqual(reply['exitCode'], 2)
+        reply = client.Build(self._socket, 'fake', ['--no-such-flag'])
+        self.assertEqual(reply['exitCode'], 2)
+        self.assertEqual(_FakeBuilder.built, [])
+
+    def test_running_daemon_kept(self):
+        self.assertRaises(ftl_error.UserError, daemon.Server, self._socket,
+                          self._shared)
+
+
+if __name__ == '__main__':
+    unittest.main()
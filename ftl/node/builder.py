@@ -20,16 +20,19 @@ from ftl.common import builder
 from ftl.common import constants
 from ftl.common import ftl_util
 from ftl.common import ftl_error
-from ftl.common import layer_builder as base_builder
 from ftl.node import layer_builder as node_builder
 
 
 class Node(builder.RuntimeBase):
-    def __init__(self, ctx, args):
-        super(Node, self).__init__(ctx, constants.NODE_CACHE_NAMESPACE, args, [
-            constants.PACKAGE_LOCK, constants.YARN_LOCK,
-            constants.PACKAGE_JSON, constants.NPMRC
-        ])
+    def __init__(self, ctx, args, resources=None):
+        super(Node, self).__init__(
+            ctx,
+            constants.NODE_CACHE_NAMESPACE,
+            args, [
+                constants.PACKAGE_LOCK, constants.YARN_LOCK,
+                constants.PACKAGE_JSON, constants.NPMRC
+            ],
+            resources=resources)
         self._gen_package_lock_if_required(self._ctx)
         self._should_use_yarn = self._should_use_yarn(self._ctx)
 
@@ -60,8 +63,6 @@ class Node(builder.RuntimeBase):
         return False
 
     def Build(self):
-        lyr_imgs = []
-        lyr_imgs.append(self._base_image)
         # delete any existing files in node_modules folder
         if self._args.directory:
             modules_dir = os.path.join(self._args.directory, "node_modules")
@@ -69,6 +70,10 @@ class Node(builder.RuntimeBase):
             ftl_util.run_command('rm_node_modules', rm_cmd)
             os.makedirs(os.path.join(modules_dir))
 
+        scheduler = builder.Scheduler()
+        scheduler.Add('base_image', self._prefetch_base_image)
+        lyr_builders = []
+        app_deps = []
         if ftl_util.has_pkg_descriptor(self._descriptor_files, self._ctx):
             layer_builder = node_builder.LayerBuilder(
                 ctx=self._ctx,
@@ -77,24 +82,26 @@ class Node(builder.RuntimeBase):
                 destination_path=self._args.destination_path,
                 should_use_yarn=self._should_use_yarn,
                 cache_key_version=self._args.cache_key_version,
-                cache=self._cache)
-            layer_builder.BuildLayer()
-            lyr_imgs.append(layer_builder.GetImage())
+                cache=self._cache,
+                layer_options=self._layer_options)
+            scheduler.Add('node_modules', self._layer_step(layer_builder))
+            lyr_builders.append(layer_builder)
+            # node_modules is installed inside the app directory.
+            app_deps.append('node_modules')
 
-        app = base_builder.AppLayerBuilder(
-            directory=self._args.directory,
-            destination_path=self._args.destination_path,
-            entrypoint=self._args.entrypoint,
-            exposed_ports=self._args.exposed_ports)
-        app.BuildLayer()
-        lyr_imgs.append(app.GetImage())
+        app = self._app_layer_builder(self._args.directory,
+                                      self._args.destination_path)
+        scheduler.Add('app', self._layer_step(app), app_deps)
+        lyr_builders.append(app)
         if self._args.additional_directory:
-            additional_directory = base_builder.AppLayerBuilder(
-                directory=self._args.additional_directory,
-                destination_path=self._args.additional_directory,
-                entrypoint=self._args.entrypoint,
-                exposed_ports=self._args.exposed_ports)
-            additional_directory.BuildLayer()
-            lyr_imgs.append(additional_directory.GetImage())
+            additional_directory = self._app_layer_builder(
+                self._args.additional_directory,
+                self._args.additional_directory)
+            scheduler.Add('additional_directory',
+                          self._layer_step(additional_directory))
+            lyr_builders.append(additional_directory)
+        scheduler.Run()
+        lyr_imgs = [self._base_image]
+        lyr_imgs.extend(b.GetImage() for b in lyr_builders)
         ftl_image = ftl_util.AppendLayersIntoImage(lyr_imgs)
         self.StoreImage(ftl_image)
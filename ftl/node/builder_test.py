@@ -17,6 +17,7 @@ import unittest
 import tempfile
 import mock
 
+from ftl.common import blob_store
 from ftl.common import context
 
 from ftl.node import builder
@@ -63,6 +64,21 @@ class NodeTest(unittest.TestCase):
         args.base = 'gcr.io/google-appengine/python:latest'
         args.entrypoint = None
         args.tar_base_image_path = None
+        args.compression = 'gzip'
+        args.compression_level = None
+        args.compression_threads = 1
+        args.adaptive_compression = False
+        args.reproducible = False
+        args.dedup_files = False
+        args.stream_upload = False
+        args.persistent_blob_ledger = False
+        args.local_cache_dir = None
+        args.cache_tag_index = False
+        args.cache_writes = 'sync'
+        args.app_delta = False
+        args.app_layer_split = None
+        args.app_layer_split_learned = False
+        args.state_dir = None
         self.builder = builder.Node(self.ctx, args)
         self.layer_builder = layer_builder.LayerBuilder(
             ctx=self.builder._ctx,
@@ -71,7 +87,8 @@ class NodeTest(unittest.TestCase):
 
         # Mock out the calls to package managers for speed.
         self.layer_builder._gen_npm_install_tar = mock.Mock()
-        self.layer_builder._gen_npm_install_tar.return_value = ('layer', 'sha')
+        self.layer_builder._gen_npm_install_tar.return_value = \
+            blob_store.Default().AddBlob('layer', 'sha')
         self.builder._pip_download_wheels = mock.Mock()
 
     @mock.patch('ftl.common.tar_to_dockerimage.FromFSImage.uncompressed_blob')
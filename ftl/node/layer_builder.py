@@ -33,7 +33,8 @@ class LayerBuilder(single_layer_image.CacheableLayerBuilder):
                  destination_path=constants.DEFAULT_DESTINATION_PATH,
                  should_use_yarn=None,
                  cache_key_version=None,
-                 cache=None):
+                 cache=None,
+                 layer_options=None):
         super(LayerBuilder, self).__init__()
         self._ctx = ctx
         self._descriptor_files = descriptor_files
@@ -43,6 +44,7 @@ class LayerBuilder(single_layer_image.CacheableLayerBuilder):
         self._should_use_yarn = should_use_yarn
         self._cache_key_version = cache_key_version
         self._cache = cache
+        self._layer_options = layer_options
 
     def GetCacheKeyRaw(self):
         all_descriptor_contents = ftl_util.all_descriptor_contents(
@@ -86,12 +88,12 @@ class LayerBuilder(single_layer_image.CacheableLayerBuilder):
 
     def _build_layer(self):
         if self._should_use_yarn:
-            blob, u_blob = self._gen_yarn_install_tar(self._directory)
+            lyr = self._gen_yarn_install_tar(self._directory)
         else:
-            blob, u_blob = self._gen_npm_install_tar(self._directory)
-        self._img = tar_to_dockerimage.FromFSImage([blob], [u_blob],
-                                                   ftl_util.generate_overrides(
-                                                       False))
+            lyr = self._gen_npm_install_tar(self._directory)
+        self._img = tar_to_dockerimage.FromFSImage(
+            layers=[lyr], overrides=ftl_util.generate_overrides(
+                False, options=self._layer_options))
 
     def _cleanup_build_layer(self):
         if self._directory:
@@ -110,7 +112,8 @@ class LayerBuilder(single_layer_image.CacheableLayerBuilder):
         module_destination = os.path.join(self._destination_path,
                                           'node_modules')
         modules_dir = os.path.join(self._directory, "node_modules")
-        return ftl_util.zip_dir_to_layer_sha(modules_dir, module_destination)
+        return ftl_util.zip_dir_to_layer(
+            modules_dir, module_destination, options=self._layer_options)
 
     def _gen_npm_install_tar(self, app_dir):
         npm_install_cmd = ['npm', 'install', '--production']
@@ -127,7 +130,8 @@ class LayerBuilder(single_layer_image.CacheableLayerBuilder):
             if "Invalid name" in npm_output:
                 raise ftl_error.UserError("%s\n%s" % (npm_output, "0"))
 
-        return ftl_util.zip_dir_to_layer_sha(modules_dir, module_destination)
+        return ftl_util.zip_dir_to_layer(
+            modules_dir, module_destination, options=self._layer_options)
 
     def _log_cache_result(self, hit, key):
         if self._pkg_descriptor:
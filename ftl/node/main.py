@@ -45,8 +45,11 @@ def main(cli_args):
             with ftl_util.Timing("builder initialization"):
                 node_ftl = node_builder.Node(
                     context.Workspace(builder_args.directory), builder_args)
-            with ftl_util.Timing("build process for FTL image"):
-                node_ftl.Build()
+            try:
+                with ftl_util.Timing("build process for FTL image"):
+                    node_ftl.Build()
+            finally:
+                node_ftl.Close()
     except ftl_error.UserError as e:
         ftl_error.UserErrorHandler(
             e, builder_args.builder_output_path, builder_args.fail_on_error)
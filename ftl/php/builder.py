@@ -18,19 +18,18 @@ import os
 from ftl.common import builder
 from ftl.common import constants
 from ftl.common import ftl_util
-from ftl.common import layer_builder as base_builder
 from ftl.php import layer_builder as php_builder
 
 
 class PHP(builder.RuntimeBase):
-    def __init__(self, ctx, args):
+    def __init__(self, ctx, args, resources=None):
         super(PHP, self).__init__(
-            ctx, constants.PHP_CACHE_NAMESPACE, args,
-            [constants.COMPOSER_LOCK, constants.COMPOSER_JSON])
+            ctx,
+            constants.PHP_CACHE_NAMESPACE,
+            args, [constants.COMPOSER_LOCK, constants.COMPOSER_JSON],
+            resources=resources)
 
     def Build(self):
-        lyr_imgs = []
-        lyr_imgs.append(self._base_image)
         # delete any existing files in vendor folder
         if self._args.directory:
             vendor_dir = os.path.join(self._args.directory, 'vendor')
@@ -38,6 +37,10 @@ class PHP(builder.RuntimeBase):
             ftl_util.run_command('rm_vendor_dir', rm_cmd)
             os.makedirs(os.path.join(vendor_dir))
 
+        scheduler = builder.Scheduler()
+        scheduler.Add('base_image', self._prefetch_base_image)
+        lyr_builders = []
+        app_deps = []
         if ftl_util.has_pkg_descriptor(self._descriptor_files, self._ctx):
             layer_builder = php_builder.PhaseOneLayerBuilder(
                 ctx=self._ctx,
@@ -45,24 +48,26 @@ class PHP(builder.RuntimeBase):
                 directory=self._args.directory,
                 destination_path=self._args.destination_path,
                 cache_key_version=self._args.cache_key_version,
-                cache=self._cache)
-            layer_builder.BuildLayer()
-            lyr_imgs.append(layer_builder.GetImage())
+                cache=self._cache,
+                layer_options=self._layer_options)
+            scheduler.Add('vendor', self._layer_step(layer_builder))
+            lyr_builders.append(layer_builder)
+            # vendor is installed inside the app directory.
+            app_deps.append('vendor')
 
-        app = base_builder.AppLayerBuilder(
-            directory=self._args.directory,
-            destination_path=self._args.destination_path,
-            entrypoint=self._args.entrypoint,
-            exposed_ports=self._args.exposed_ports)
-        app.BuildLayer()
-        lyr_imgs.append(app.GetImage())
+        app = self._app_layer_builder(self._args.directory,
+                                      self._args.destination_path)
+        scheduler.Add('app', self._layer_step(app), app_deps)
+        lyr_builders.append(app)
         if self._args.additional_directory:
-            additional_directory = base_builder.AppLayerBuilder(
-                directory=self._args.additional_directory,
-                destination_path=self._args.additional_directory,
-                entrypoint=self._args.entrypoint,
-                exposed_ports=self._args.exposed_ports)
-            additional_directory.BuildLayer()
-            lyr_imgs.append(additional_directory.GetImage())
+            additional_directory = self._app_layer_builder(
+                self._args.additional_directory,
+                self._args.additional_directory)
+            scheduler.Add('additional_directory',
+                          self._layer_step(additional_directory))
+            lyr_builders.append(additional_directory)
+        scheduler.Run()
+        lyr_imgs = [self._base_image]
+        lyr_imgs.extend(b.GetImage() for b in lyr_builders)
         ftl_image = ftl_util.AppendLayersIntoImage(lyr_imgs)
         self.StoreImage(ftl_image)
@@ -17,6 +17,7 @@ import unittest
 import tempfile
 import mock
 
+from ftl.common import blob_store
 from ftl.common import context
 from ftl.php import builder
 from ftl.php import layer_builder
@@ -74,14 +75,29 @@ class PHPTest(unittest.TestCase):
         args.base = 'gcr.io/google-appengine/php:latest'
         args.entrypoint = None
         args.tar_base_image_path = None
+        args.compression = 'gzip'
+        args.compression_level = None
+        args.compression_threads = 1
+        args.adaptive_compression = False
+        args.reproducible = False
+        args.dedup_files = False
+        args.stream_upload = False
+        args.persistent_blob_ledger = False
+        args.local_cache_dir = None
+        args.cache_tag_index = False
+        args.cache_writes = 'sync'
+        args.app_delta = False
+        args.app_layer_split = None
+        args.app_layer_split_learned = False
+        args.state_dir = None
         self.builder = builder.PHP(self.ctx, args)
         self.layer_builder = layer_builder.PhaseOneLayerBuilder(
             self.builder._ctx, self.builder._descriptor_files, "/app")
 
         # Mock out the calls to package managers for speed.
         self.layer_builder._gen_composer_install_tar = mock.Mock()
-        self.layer_builder._gen_composer_install_tar.return_value = ('layer',
-                                                                     'sha')
+        self.layer_builder._gen_composer_install_tar.return_value = \
+            blob_store.Default().AddBlob('layer', 'sha')
         self.builder._gen_composer_lock = mock.Mock()
 
     def test_create_package_base_no_descriptor(self):
@@ -33,7 +33,8 @@ class PhaseOneLayerBuilder(single_layer_image.CacheableLayerBuilder):
                  destination_path=constants.DEFAULT_DESTINATION_PATH,
                  cache_key_version=None,
                  directory=None,
-                 cache=None):
+                 cache=None,
+                 layer_options=None):
         super(PhaseOneLayerBuilder, self).__init__()
         self._ctx = ctx
         self._descriptor_files = descriptor_files
@@ -41,6 +42,7 @@ class PhaseOneLayerBuilder(single_layer_image.CacheableLayerBuilder):
         self._cache_key_version = cache_key_version
         self._directory = directory
         self._cache = cache
+        self._layer_options = layer_options
 
     def GetCacheKeyRaw(self):
         cache_key = "%s %s" % (
@@ -80,11 +82,11 @@ class PhaseOneLayerBuilder(single_layer_image.CacheableLayerBuilder):
                     self._cache.Set(key, self.GetImage())
 
     def _build_layer(self):
-        blob, u_blob = self._gen_composer_install_tar(self._directory,
-                                                      self._destination_path)
-        self._img = tar_to_dockerimage.FromFSImage([blob], [u_blob],
-                                                   ftl_util.generate_overrides(
-                                                       False))
+        lyr = self._gen_composer_install_tar(self._directory,
+                                             self._destination_path)
+        self._img = tar_to_dockerimage.FromFSImage(
+            layers=[lyr], overrides=ftl_util.generate_overrides(
+                False, options=self._layer_options))
 
     def _cleanup_build_layer(self):
         if self._directory:
@@ -106,7 +108,8 @@ class PhaseOneLayerBuilder(single_layer_image.CacheableLayerBuilder):
 
         vendor_dir = os.path.join(self._directory, 'vendor')
         vendor_destination = os.path.join(destination_path, 'vendor')
-        return ftl_util.zip_dir_to_layer_sha(vendor_dir, vendor_destination)
+        return ftl_util.zip_dir_to_layer(
+            vendor_dir, vendor_destination, options=self._layer_options)
 
     def _log_cache_result(self, hit, key):
         if hit:
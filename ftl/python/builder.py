@@ -14,19 +14,22 @@
 """This package defines the interface for orchestrating image builds."""
 
 import json
+import os
+import shutil
+
 import concurrent.futures
 
 from ftl.common import builder
 from ftl.common import constants
 from ftl.common import ftl_util
-from ftl.common import layer_builder as base_builder
+from ftl.common import layer_builder
 
 from ftl.python import layer_builder as package_builder
 from ftl.python import python_util
 
 
 class Python(builder.RuntimeBase):
-    def __init__(self, ctx, args):
+    def __init__(self, ctx, args, resources=None):
         super(Python, self).__init__(
             ctx,
             constants.PYTHON_CACHE_NAMESPACE,
@@ -35,7 +38,8 @@ class Python(builder.RuntimeBase):
                 constants.PIPFILE_LOCK,
                 constants.PIPFILE,  # not supported rn
                 constants.REQUIREMENTS_TXT
-            ])
+            ],
+            resources=resources)
         self._virtualenv_dir = args.virtualenv_dir
         self._wheel_dir = ftl_util.gen_tmp_dir(constants.WHEEL_DIR)
 
@@ -60,80 +64,118 @@ class Python(builder.RuntimeBase):
         return pkgs
 
     def Build(self):
-        lyr_imgs = []
-        lyr_imgs.append(self._base_image)
+        # Builds sharing a process share the virtualenv, whose path is
+        # baked into the layers built from it, so they take turns.
+        venv_lock = self._resources.Lock(
+            ('virtualenv', os.path.realpath(self._virtualenv_dir)))
+        with venv_lock:
+            self._build()
+
+    def Close(self):
+        try:
+            super(Python, self).Close()
+        finally:
+            shutil.rmtree(os.path.dirname(self._wheel_dir),
+                          ignore_errors=True)
 
+    def _build(self):
         interpreter_builder = package_builder.InterpreterLayerBuilder(
             virtualenv_dir=self._virtualenv_dir,
             python_cmd=self._python_cmd,
             virtualenv_cmd=self._virtualenv_cmd,
             venv_cmd=self._venv_cmd,
             cache_key_version=self._args.cache_key_version,
-            cache=self._cache)
-        interpreter_builder.BuildLayer()
-        lyr_imgs.append(interpreter_builder.GetImage())
-
-        if ftl_util.has_pkg_descriptor(self._descriptor_files, self._ctx):
-            # build interpreter layer
+            cache=self._cache,
+            layer_options=self._layer_options)
 
+        # Packages are installed into the virtualenv, not the app
+        # directory, so the app layers are built alongside them.
+        scheduler = builder.Scheduler()
+        scheduler.Add('base_image', self._prefetch_base_image)
+        scheduler.Add('interpreter', self._layer_step(interpreter_builder))
+        has_packages = ftl_util.has_pkg_descriptor(self._descriptor_files,
+                                                   self._ctx)
+        if has_packages:
             if self._is_phase2:
                 # do a phase 2 build of the package layers w/ Pipfile.lock
-                # iterate over package/version Pipfile.lock
-                python_util.setup_virtualenv(self._virtualenv_dir,
-                                             self._virtualenv_cmd,
-                                             self._python_cmd,
-                                             self._venv_cmd)
-                pkgs = self._parse_pipfile_pkgs()
-                with ftl_util.Timing('uploading_all_package_layers'):
-                    with concurrent.futures.ThreadPoolExecutor(
-                            max_workers=constants.THREADS) as executor:
-                        future_to_params = {executor.submit(
-                                self._build_pkg, pkg,
-                                interpreter_builder, lyr_imgs): pkg
-                                for pkg in pkgs
-                        }
-                        for future in concurrent.futures.as_completed(
-                                future_to_params):
-                            future.result()
+                build_packages = self._build_pipfile_pkgs
             else:
                 # do a phase 1 build of the package layers w/ requirements.txt
-                req_txt_builder = package_builder.RequirementsLayerBuilder(
-                    ctx=self._ctx,
-                    descriptor_files=self._descriptor_files,
-                    directory=self._args.directory,
-                    pkg_dir=None,
-                    wheel_dir=self._wheel_dir,
-                    virtualenv_dir=self._virtualenv_dir,
-                    python_cmd=self._python_cmd,
-                    pip_cmd=self._pip_cmd,
-                    virtualenv_cmd=self._virtualenv_cmd,
-                    venv_cmd=self._venv_cmd,
-                    dep_img_lyr=interpreter_builder,
-                    cache_key_version=self._args.cache_key_version,
-                    cache=self._cache)
-                req_txt_builder.BuildLayer()
-                if req_txt_builder.GetImage():
-                    lyr_imgs.append(req_txt_builder.GetImage())
-
-        app = base_builder.AppLayerBuilder(
-            directory=self._args.directory,
-            destination_path=self._args.destination_path,
-            entrypoint=self._args.entrypoint,
-            exposed_ports=self._args.exposed_ports)
-        app.BuildLayer()
-        lyr_imgs.append(app.GetImage())
+                build_packages = self._build_requirements
+            scheduler.Add(
+                'packages',
+                lambda: self._stream(build_packages(interpreter_builder)),
+                ['interpreter'])
+        app = self._app_layer_builder(self._args.directory,
+                                      self._args.destination_path)
+        scheduler.Add('app', self._layer_step(app))
+        additional_directory = None
         if self._args.additional_directory:
-            additional_directory = base_builder.AppLayerBuilder(
-                directory=self._args.additional_directory,
-                destination_path=self._args.additional_directory,
-                entrypoint=self._args.entrypoint,
-                exposed_ports=self._args.exposed_ports)
-            additional_directory.BuildLayer()
+            additional_directory = self._app_layer_builder(
+                self._args.additional_directory,
+                self._args.additional_directory)
+            scheduler.Add('additional_directory',
+                          self._layer_step(additional_directory))
+        results = scheduler.Run()
+
+        lyr_imgs = [self._base_image, interpreter_builder.GetImage()]
+        if has_packages:
+            lyr_imgs.extend(results['packages'])
+        lyr_imgs.append(app.GetImage())
+        if additional_directory:
             lyr_imgs.append(additional_directory.GetImage())
         ftl_image = ftl_util.AppendLayersIntoImage(lyr_imgs)
         self.StoreImage(ftl_image)
 
-    def _build_pkg(self, pkg, interpreter_builder, lyr_imgs):
+    def _build_pipfile_pkgs(self, interpreter_builder):
+        # iterate over package/version Pipfile.lock
+        python_util.setup_virtualenv(self._virtualenv_dir,
+                                     self._virtualenv_cmd,
+                                     self._python_cmd,
+                                     self._venv_cmd)
+        pkgs = self._parse_pipfile_pkgs()
+        pkg_imgs = []
+        with ftl_util.Timing('uploading_all_package_layers'):
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=constants.THREADS) as executor:
+                future_to_params = {executor.submit(
+                        self._build_pkg, pkg,
+                        interpreter_builder, pkg_imgs): pkg
+                        for pkg in pkgs
+                }
+                for future in concurrent.futures.as_completed(
+                        future_to_params):
+                    future.result()
+        return layer_builder.coalesce_packages(
+            pkg_imgs,
+            self._args.max_package_layers,
+            layer_options=self._layer_options,
+            cache_key_version=self._args.cache_key_version,
+            cache=self._cache)
+
+    def _build_requirements(self, interpreter_builder):
+        req_txt_builder = package_builder.RequirementsLayerBuilder(
+            ctx=self._ctx,
+            descriptor_files=self._descriptor_files,
+            directory=self._args.directory,
+            pkg_dir=None,
+            wheel_dir=self._wheel_dir,
+            virtualenv_dir=self._virtualenv_dir,
+            python_cmd=self._python_cmd,
+            pip_cmd=self._pip_cmd,
+            virtualenv_cmd=self._virtualenv_cmd,
+            venv_cmd=self._venv_cmd,
+            dep_img_lyr=interpreter_builder,
+            cache_key_version=self._args.cache_key_version,
+            cache=self._cache,
+            layer_options=self._layer_options,
+            max_package_layers=self._args.max_package_layers)
+        req_txt_builder.BuildLayer()
+        if req_txt_builder.GetImage():
+            return [req_txt_builder.GetImage()]
+        return []
+
+    def _build_pkg(self, pkg, interpreter_builder, pkg_imgs):
         pipfile_builder = package_builder.PipfileLayerBuilder(
             ctx=self._ctx,
             descriptor_files=self._descriptor_files,
@@ -146,6 +188,8 @@ class Python(builder.RuntimeBase):
             virtualenv_cmd=self._virtualenv_cmd,
             dep_img_lyr=interpreter_builder,
             cache_key_version=self._args.cache_key_version,
-            cache=self._cache)
+            cache=self._cache,
+            layer_options=self._layer_options)
         pipfile_builder.BuildLayer()
-        lyr_imgs.append(pipfile_builder.GetImage())
+        pkg_imgs.append((pkg[0], pipfile_builder.GetCacheKey(),
+                         pipfile_builder.GetImage()))
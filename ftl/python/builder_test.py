@@ -16,12 +16,18 @@ import unittest
 import datetime
 import mock
 import json
+import os
+import shutil
+import tempfile
 
 from ftl.common import context
 from ftl.common import constants
+from ftl.common import ftl_error
 from ftl.common import ftl_util
+from ftl.common import resources
 from ftl.python import builder
 from ftl.python import layer_builder
+from ftl.python import python_util
 
 _REQUIREMENTS_TXT = """
 Flask==0.12.0
@@ -58,6 +64,23 @@ class PythonTest(unittest.TestCase):
         args.pip_cmd = 'pip'
         args.virtualenv_cmd = 'virtualenv'
         args.tar_base_image_path = None
+        args.compression = 'gzip'
+        args.compression_level = None
+        args.compression_threads = 1
+        args.adaptive_compression = False
+        args.reproducible = False
+        args.dedup_files = False
+        args.stream_upload = False
+        args.persistent_blob_ledger = False
+        args.local_cache_dir = None
+        args.cache_tag_index = False
+        args.cache_writes = 'sync'
+        args.max_package_layers = None
+        args.app_delta = False
+        args.app_layer_split = None
+        args.app_layer_split_learned = False
+        args.state_dir = None
+        self.args = args
         self.builder = builder.Python(self.ctx, args)
 
         # constants.VIRTUALENV_DIR.replace('/', '') is used as the default path
@@ -78,6 +101,77 @@ class PythonTest(unittest.TestCase):
         now = datetime.datetime.now()
         self.assertTrue(last_created > now - datetime.timedelta(days=2))
 
+    @mock.patch('subprocess.Popen')
+    def test_python_version_probed_once(self, mock_popen):
+        mock_popen.return_value.communicate.return_value = ('Python 2.7', '')
+        mock_popen.return_value.returncode = 0
+        pkg_builders = [
+            layer_builder.PipfileLayerBuilder(
+                pkg_descriptor=('pkg%d' % i, '1.0'),
+                dep_img_lyr=self.interpreter_builder) for i in range(3)
+        ]
+        keys = [pkg.GetCacheKey() for pkg in pkg_builders]
+        self.assertEqual(len(set(keys)), 3)
+        self.assertEqual(keys, [pkg.GetCacheKey() for pkg in pkg_builders])
+        self.assertEqual(mock_popen.call_count, 1)
+
+    @mock.patch('containerregistry.client.v2_2.docker_image.FromRegistry')
+    def test_close_releases_build_blobs(self, mock_from):
+        python = builder.Python(
+            self.ctx, self.args, resources=resources.Resources(threads=1))
+        app_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, app_dir)
+        lyr = ftl_util.zip_dir_to_layer(
+            app_dir, '/srv', options=python._layer_options)
+        self.assertTrue(os.path.exists(lyr.path))
+        python.Close()
+        self.assertFalse(os.path.exists(lyr.path))
+        self.assertFalse(os.path.exists(python._wheel_dir))
+
+    @mock.patch('containerregistry.client.v2_2.docker_image.FromRegistry')
+    def test_learned_split_requires_state_dir(self, mock_from):
+        self.args.app_layer_split_learned = True
+        with self.assertRaises(ftl_error.UserError):
+            builder.Python(self.ctx, self.args)
+
+    @mock.patch('ftl.common.session.Push')
+    @mock.patch('containerregistry.client.v2_2.docker_image.FromRegistry')
+    def test_failed_build_stops_streaming(self, mock_from, mock_push):
+        self.args.stream_upload = True
+        self.args.upload = True
+        self.args.output_path = None
+        self.args.virtualenv_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.args.virtualenv_dir)
+        python = builder.Python(self.ctx, self.args)
+        img = mock.MagicMock()
+        img.fs_layers.return_value = ['sha256:app']
+        python._streaming_push.AddImage(img)
+        python._build = mock.Mock(side_effect=ValueError('build failed'))
+        with self.assertRaises(ValueError):
+            try:
+                python.Build()
+            finally:
+                python.Close()
+        # The upload threads are stopped and the push session is closed.
+        self.assertIsNone(python._streaming_push._executor)
+        self.assertTrue(mock_push.return_value.__exit__.called)
+
+    @mock.patch('ftl.common.ftl_util.run_command')
+    def test_virtualenv_recreated_for_other_interpreter(self, mock_run):
+        venv_dir = os.path.join(tempfile.mkdtemp(), 'env')
+        self.addCleanup(shutil.rmtree, os.path.dirname(venv_dir))
+        mock_run.side_effect = lambda *args, **kwargs: os.mkdir(venv_dir)
+
+        python_util.setup_virtualenv(venv_dir, ['virtualenv'],
+                                     ['python2.7'], None)
+        python_util.setup_virtualenv(venv_dir, ['virtualenv'],
+                                     ['python2.7'], None)
+        self.assertEqual(mock_run.call_count, 1)
+        python_util.setup_virtualenv(venv_dir, ['virtualenv'],
+                                     ['python3.6'], None)
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertIn('python3.6', mock_run.call_args[0][1])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -17,11 +17,13 @@ import logging
 import os
 import tempfile
 import subprocess
+import threading
 import concurrent.futures
 
 from ftl.common import constants
 from ftl.common import ftl_util
 from ftl.common import ftl_error
+from ftl.common import layer_builder as common_builder
 from ftl.common import single_layer_image
 from ftl.common import tar_to_dockerimage
 
@@ -35,7 +37,8 @@ class PackageLayerBuilder(single_layer_image.CacheableLayerBuilder):
                  pkg_dir=None,
                  dep_img_lyr=None,
                  cache_key_version=None,
-                 cache=None):
+                 cache=None,
+                 layer_options=None):
         super(PackageLayerBuilder, self).__init__()
         self._ctx = ctx
         self._pkg_dir = pkg_dir
@@ -43,6 +46,7 @@ class PackageLayerBuilder(single_layer_image.CacheableLayerBuilder):
         self._dep_img_lyr = dep_img_lyr
         self._cache_key_version = cache_key_version
         self._cache = cache
+        self._layer_options = layer_options
 
     def GetCacheKeyRaw(self):
         cache_key = ""
@@ -56,9 +60,12 @@ class PackageLayerBuilder(single_layer_image.CacheableLayerBuilder):
                 self._cache.Set(self.GetCacheKey(), self.GetImage())
 
     def _build_layer(self):
-        blob, u_blob = ftl_util.zip_dir_to_layer_sha(self._pkg_dir, "")
-        overrides = ftl_util.generate_overrides(False)
-        self._img = tar_to_dockerimage.FromFSImage([blob], [u_blob], overrides)
+        lyr = ftl_util.zip_dir_to_layer(
+            self._pkg_dir, "", options=self._layer_options)
+        overrides = ftl_util.generate_overrides(
+            False, options=self._layer_options)
+        self._img = tar_to_dockerimage.FromFSImage(
+            layers=[lyr], overrides=overrides)
 
     def _log_cache_result(self, hit):
         if hit:
@@ -86,7 +93,9 @@ class RequirementsLayerBuilder(single_layer_image.CacheableLayerBuilder):
                  pip_cmd=[constants.PIP_DEFAULT_CMD],
                  virtualenv_cmd=[constants.VIRTUALENV_DEFAULT_CMD],
                  venv_cmd=[constants.VENV_DEFAULT_CMD],
-                 cache=None):
+                 cache=None,
+                 layer_options=None,
+                 max_package_layers=None):
         super(RequirementsLayerBuilder, self).__init__()
         self._ctx = ctx
         self._pkg_dir = pkg_dir
@@ -101,10 +110,19 @@ class RequirementsLayerBuilder(single_layer_image.CacheableLayerBuilder):
         self._dep_img_lyr = dep_img_lyr
         self._cache_key_version = cache_key_version
         self._cache = cache
+        self._layer_options = layer_options
+        self._max_package_layers = max_package_layers
+        self._descriptor_contents = None
+
+    def _descriptor(self):
+        """The contents of the package descriptor, read once."""
+        if self._descriptor_contents is None:
+            self._descriptor_contents = ftl_util.descriptor_parser(
+                self._descriptor_files, self._ctx)
+        return self._descriptor_contents
 
     def GetCacheKeyRaw(self):
-        descriptor_contents = ftl_util.descriptor_parser(
-            self._descriptor_files, self._ctx)
+        descriptor_contents = self._descriptor()
         cache_key = '%s %s' % (descriptor_contents,
                                self._dep_img_lyr.GetCacheKeyRaw())
         return "%s %s" % (cache_key, self._cache_key_version)
@@ -124,26 +142,31 @@ class RequirementsLayerBuilder(single_layer_image.CacheableLayerBuilder):
                                          self._python_cmd,
                                          self._venv_cmd)
 
-            pkg_descriptor = ftl_util.descriptor_parser(
-                self._descriptor_files, self._ctx)
+            pkg_descriptor = self._descriptor()
             self._pip_download_wheels(pkg_descriptor)
             whls = self._resolve_whls()
-            pkg_dirs = [self._whl_to_fslayer(whl) for whl in whls]
+            pkg_dirs = [(whl, self._whl_to_fslayer(whl)) for whl in whls]
 
             req_txt_imgs = []
             with ftl_util.Timing('uploading_all_package_layers'):
                 with concurrent.futures.ThreadPoolExecutor(
                         max_workers=constants.THREADS) as executor:
                     future_to_params = {
-                        executor.submit(self._build_pkg, whl_pkg_dir,
+                        executor.submit(self._build_pkg, whl, whl_pkg_dir,
                                         req_txt_imgs): whl_pkg_dir
-                        for whl_pkg_dir in pkg_dirs
+                        for whl, whl_pkg_dir in pkg_dirs
                     }
                     for future in concurrent.futures.as_completed(
                             future_to_params):
                         future.result()
 
-            req_txt_image = ftl_util.AppendLayersIntoImage(req_txt_imgs)
+            req_txt_image = ftl_util.AppendLayersIntoImage(
+                common_builder.coalesce_packages(
+                    req_txt_imgs,
+                    self._max_package_layers,
+                    layer_options=self._layer_options,
+                    cache_key_version=self._cache_key_version,
+                    cache=self._cache))
 
             if req_txt_image:
                 self.SetImage(req_txt_image)
@@ -152,16 +175,21 @@ class RequirementsLayerBuilder(single_layer_image.CacheableLayerBuilder):
                     with ftl_util.Timing('uploading_requirements.txt_pkg_lyr'):
                         self._cache.Set(self.GetCacheKey(), self.GetImage())
 
-    def _build_pkg(self, whl_pkg_dir, req_txt_imgs):
+    def _build_pkg(self, whl, whl_pkg_dir, req_txt_imgs):
         layer_builder = PackageLayerBuilder(
             ctx=self._ctx,
             descriptor_files=self._descriptor_files,
             pkg_dir=whl_pkg_dir,
             dep_img_lyr=self._dep_img_lyr,
             cache_key_version=self._cache_key_version,
-            cache=self._cache)
+            cache=self._cache,
+            layer_options=self._layer_options)
         layer_builder.BuildLayer()
-        req_txt_imgs.append(layer_builder.GetImage())
+        img = layer_builder.GetImage()
+        # Package layers share a cache key, so they are told apart by
+        # their contents.
+        req_txt_imgs.append((os.path.basename(whl).split('-')[0],
+                             ' '.join(img.diff_ids()), img))
 
     def _resolve_whls(self):
         with ftl_util.Timing('resolving_whl_paths'):
@@ -239,7 +267,8 @@ class PipfileLayerBuilder(RequirementsLayerBuilder):
                  python_cmd=[constants.PYTHON_DEFAULT_CMD],
                  pip_cmd=[constants.PIP_DEFAULT_CMD],
                  virtualenv_cmd=[constants.VIRTUALENV_DEFAULT_CMD],
-                 cache=None):
+                 cache=None,
+                 layer_options=None):
         super(PipfileLayerBuilder, self).__init__()
         self._ctx = ctx
         self._pkg_dir = pkg_dir
@@ -253,6 +282,7 @@ class PipfileLayerBuilder(RequirementsLayerBuilder):
         self._dep_img_lyr = dep_img_lyr
         self._cache_key_version = cache_key_version
         self._cache = cache
+        self._layer_options = layer_options
         self._pkg_descriptor = pkg_descriptor
 
     def GetCacheKeyRaw(self):
@@ -289,10 +319,12 @@ class PipfileLayerBuilder(RequirementsLayerBuilder):
             if len(whls) != 1:
                 raise Exception("expected one whl for one installed pkg")
             pkg_dir = self._whl_to_fslayer(whls[0])
-            blob, u_blob = ftl_util.zip_dir_to_layer_sha(pkg_dir, "")
-            overrides = ftl_util.generate_overrides(False)
-            self._img = tar_to_dockerimage.FromFSImage([blob], [u_blob],
-                                                       overrides)
+            lyr = ftl_util.zip_dir_to_layer(
+                pkg_dir, "", options=self._layer_options)
+            overrides = ftl_util.generate_overrides(
+                False, options=self._layer_options)
+            self._img = tar_to_dockerimage.FromFSImage(
+                layers=[lyr], overrides=overrides)
             if self._cache:
                 with ftl_util.Timing('uploading_pipfile_pkg_layer'):
                     self._cache.Set(self.GetCacheKey(), self.GetImage())
@@ -319,7 +351,8 @@ class InterpreterLayerBuilder(single_layer_image.CacheableLayerBuilder):
                  virtualenv_cmd=[constants.VIRTUALENV_DEFAULT_CMD],
                  venv_cmd=[constants.VENV_DEFAULT_CMD],
                  cache_key_version=None,
-                 cache=None):
+                 cache=None,
+                 layer_options=None):
         super(InterpreterLayerBuilder, self).__init__()
         self._virtualenv_dir = virtualenv_dir
         self._python_cmd = python_cmd
@@ -327,13 +360,36 @@ class InterpreterLayerBuilder(single_layer_image.CacheableLayerBuilder):
         self._venv_cmd = venv_cmd
         self._cache_key_version = cache_key_version
         self._cache = cache
+        self._layer_options = layer_options
+        self._version_lock = threading.Lock()
+        self._version = None
+        self._cache_key_raw = None
 
     def GetCacheKeyRaw(self):
-        cache_key = '%s %s %s' % (self._python_version(), self._virtualenv_cmd,
-                                  self._virtualenv_dir)
-        return "%s %s" % (cache_key, self._cache_key_version)
+        """The raw key of the interpreter, computed once per builder.
+
+        It is the shared input of the key of every package layer.
+        """
+        if self._cache_key_raw is None:
+            cache_key = '%s %s %s' % (self._python_version(),
+                                      self._virtualenv_cmd,
+                                      self._virtualenv_dir)
+            self._cache_key_raw = "%s %s" % (cache_key,
+                                             self._cache_key_version)
+        return self._cache_key_raw
 
     def _python_version(self):
+        """The version output of the interpreter, run once per builder.
+
+        Every package layer keyed on the interpreter asks for it, many of
+        them concurrently.
+        """
+        with self._version_lock:
+            if self._version is None:
+                self._version = self._probe_python_version()
+            return self._version
+
+    def _probe_python_version(self):
         with ftl_util.Timing('check python version'):
             python_version_cmd = list(self._python_cmd)
             python_version_cmd.append('--version')
@@ -375,11 +431,15 @@ class InterpreterLayerBuilder(single_layer_image.CacheableLayerBuilder):
                                      self._python_cmd,
                                      self._venv_cmd)
 
-        blob, u_blob = ftl_util.zip_dir_to_layer_sha(self._virtualenv_dir,
-                                                     self._virtualenv_dir)
+        lyr = ftl_util.zip_dir_to_layer(
+            self._virtualenv_dir,
+            self._virtualenv_dir,
+            options=self._layer_options)
 
-        overrides = ftl_util.generate_overrides(True, self._virtualenv_dir)
-        self._img = tar_to_dockerimage.FromFSImage([blob], [u_blob], overrides)
+        overrides = ftl_util.generate_overrides(
+            True, self._virtualenv_dir, options=self._layer_options)
+        self._img = tar_to_dockerimage.FromFSImage(
+            layers=[lyr], overrides=overrides)
 
     def _log_cache_result(self, hit):
         if hit:
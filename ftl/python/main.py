@@ -45,8 +45,11 @@ def main(cli_args):
             with ftl_util.Timing("builder initialization"):
                 python_ftl = python_builder.Python(
                     context.Workspace(builder_args.directory), builder_args)
-            with ftl_util.Timing("build process for FTL image"):
-                python_ftl.Build()
+            try:
+                with ftl_util.Timing("build process for FTL image"):
+                    python_ftl.Build()
+            finally:
+                python_ftl.Close()
     except ftl_error.UserError as e:
         ftl_error.UserErrorHandler(
             e, builder_args.builder_output_path, builder_args.fail_on_error)
@@ -13,11 +13,32 @@
 # limitations under the License.
 """This package defines helpful utilities for FTL ."""
 import os
+import shutil
+import threading
 
 from ftl.common import ftl_util
 
+# Builds sharing a process, like those run by the FTL daemon, may set up
+# the same virtualenv concurrently.
+_virtualenv_lock = threading.Lock()
+# The commands each virtualenv used by this process was set up with.
+_virtualenv_cmds = {}
+
 
 def setup_virtualenv(virtualenv_dir, virtualenv_cmd, python_cmd, venv_cmd):
+    with _virtualenv_lock:
+        cmds = (tuple(virtualenv_cmd), tuple(python_cmd),
+                tuple(venv_cmd or ()))
+        created = _virtualenv_cmds.get(virtualenv_dir)
+        if created is not None and created != cmds:
+            # An earlier build of this process wanted another interpreter.
+            shutil.rmtree(virtualenv_dir)
+        _setup_virtualenv(virtualenv_dir, virtualenv_cmd, python_cmd,
+                          venv_cmd)
+        _virtualenv_cmds[virtualenv_dir] = cmds
+
+
+def _setup_virtualenv(virtualenv_dir, virtualenv_cmd, python_cmd, venv_cmd):
     if os.path.isdir(virtualenv_dir):
         return
 